@@ -0,0 +1,320 @@
+# Bulk (re-)analysis of stored claim photos, e.g. after a Groq outage or a prompt change.
+# Usage: python -m app.batch_analyzer --concurrency 4 --rpm 30
+import argparse
+import asyncio
+import json
+import os
+import time
+import uuid
+from collections import Counter
+from app.config import load_env
+from app.db_helper import run_db
+from app.image_processor import analyze_car_damage_detailed, is_failed_analysis
+from app.logger import get_logger
+from app.storage import stored_photo_refs, STORAGE_REF_PREFIX
+from app.claim_analysis import save_claim_analysis
+
+load_env()
+
+log = get_logger(__name__)
+
+# Configuration
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+UPLOAD_DIR = os.path.join(BASE_DIR, "data", "uploads")
+BATCH_CHECKPOINT_FILE = os.getenv("BATCH_CHECKPOINT_FILE", os.path.join(BASE_DIR, "data", "batch_checkpoint.jsonl"))
+BATCH_CONCURRENCY = int(os.getenv("BATCH_CONCURRENCY", 4))
+BATCH_RPM = float(os.getenv("BATCH_RPM", 30))  # vision requests per minute
+BATCH_UPDATE_SIZE = int(os.getenv("BATCH_UPDATE_SIZE", 25))  # rows per UPDATE batch
+IMAGE_EXTENSIONS = {".jpg", ".jpeg", ".png", ".webp"}
+
+
+# --- Discovery & checkpoint ---
+
+def session_id_candidates(filename):
+    """
+    Possible session ids of an upload stored as '{session_id}_{original filename}',
+    longest first. Both parts may contain '_', so every split is a candidate.
+    """
+    candidates = []
+    head = filename
+    while True:
+        head, sep, _ = head.rpartition("_")
+        if not sep:
+            return candidates
+        if head:
+            candidates.append(head)
+
+def session_id_from_filename(filename, known_ids):
+    """The longest '{session_id}_' prefix of filename that is an existing session id, or None."""
+    return next((c for c in session_id_candidates(filename) if c in known_ids), None)
+
+def discover_images(upload_dir=UPLOAD_DIR):
+    """Returns (path, filename) for every legacy upload in upload_dir, oldest first."""
+    items = []
+    if not os.path.isdir(upload_dir):
+        return items
+    for entry in os.scandir(upload_dir):
+        if not entry.is_file() or os.path.splitext(entry.name)[1].lower() not in IMAGE_EXTENSIONS:
+            continue
+        if session_id_candidates(entry.name):
+            items.append((entry.stat().st_mtime, entry.path, entry.name))
+    return [(path, name) for _, path, name in sorted(items)]
+
+def load_checkpoint(path, run_id=None):
+    """Paths already analysed and written back by a previous run (only by run_id's run, if given)."""
+    done = set()
+    if not os.path.exists(path):
+        return done
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if line:
+                entry = json.loads(line)
+                if run_id is None or entry.get("run") == run_id:
+                    done.add(entry["path"])
+    return done
+
+def append_checkpoint(path, entries):
+    with open(path, "a", encoding="utf-8") as f:
+        for entry in entries:
+            f.write(json.dumps(entry) + "\n")
+
+
+# --- DB Work ---
+
+def _existing_sessions(conn, session_ids):
+    if not session_ids:
+        return set()
+    placeholders = ", ".join(["%s"] * len(session_ids))
+    with conn.cursor() as cursor:
+        cursor.execute(f"SELECT session_id FROM insurance_sessions WHERE session_id IN ({placeholders})",
+                       tuple(session_ids))
+        return {row["session_id"] for row in cursor.fetchall()}
+
+def _sessions_with_reports(conn, session_ids):
+    """Sessions with a usable damage report (the error strings is_failed_analysis detects don't count)."""
+    if not session_ids:
+        return set()
+    placeholders = ", ".join(["%s"] * len(session_ids))
+    with conn.cursor() as cursor:
+        cursor.execute(
+            f"SELECT session_id FROM insurance_sessions "
+            f"WHERE session_id IN ({placeholders}) AND damage_report IS NOT NULL AND damage_report <> '' "
+            f"AND damage_report NOT LIKE 'Error:%%' AND damage_report NOT LIKE 'Analysis failed%%'",
+            tuple(session_ids)
+        )
+        return {row["session_id"] for row in cursor.fetchall()}
+
+def _write_photo_reports(conn, rows):
+    """
+    rows: [(VisionResult, session_id, storage ref or legacy path)] - per-photo
+    results, then each claim's aggregate over its photos.
+    """
+    by_session = {}
+    for result, session_id, ref in rows:
+        by_session.setdefault(session_id, []).append((ref, result))
+    for session_id, photos in by_session.items():
+        save_claim_analysis(conn, session_id, photos)
+
+async def legacy_images(upload_dir=UPLOAD_DIR):
+    """(path, session_id) for legacy uploads whose filename starts with an existing session id."""
+    found = discover_images(upload_dir)
+    candidates = sorted({c for _, name in found for c in session_id_candidates(name)})
+    known = set()
+    for i in range(0, len(candidates), 500):
+        known |= await run_db(_existing_sessions, candidates[i:i + 500], long_running=True)
+    images = [(path, session_id_from_filename(name, known)) for path, name in found]
+    return [(path, session_id) for path, session_id in images if session_id]
+
+
+# --- Throughput control & reporting ---
+
+class RateLimiter:
+    """Spaces request starts evenly to stay under a requests-per-minute limit."""
+
+    def __init__(self, rpm):
+        self.interval = 60.0 / rpm if rpm and rpm > 0 else 0.0
+        self._next_slot = 0.0
+        self._lock = asyncio.Lock()
+
+    async def wait(self):
+        if not self.interval:
+            return
+        async with self._lock:
+            now = time.monotonic()
+            slot = max(self._next_slot, now)
+            self._next_slot = slot + self.interval
+        if slot > now:
+            await asyncio.sleep(slot - now)
+
+
+class BatchProgress:
+    def __init__(self):
+        self.run_id = None
+        self.started_at = None
+        self.finished_at = None
+        self.total = 0
+        self.analyzed = 0
+        self.cache_hits = 0
+        self.failed = 0
+        self.skipped = 0
+        self.written = 0
+        self.tokens = 0
+        self.running = False
+        self.error = None
+
+    def snapshot(self):
+        elapsed = ((self.finished_at or time.monotonic()) - self.started_at) if self.started_at else 0.0
+        return {
+            "run_id": self.run_id,
+            "running": self.running,
+            "total": self.total,
+            "analyzed": self.analyzed,
+            "cache_hits": self.cache_hits,
+            "failed": self.failed,
+            "skipped": self.skipped,
+            "written": self.written,
+            "remaining": max(self.total - self.analyzed - self.failed - self.skipped, 0),
+            "elapsed_s": round(elapsed, 1),
+            "images_per_s": round(self.analyzed / elapsed, 3) if elapsed else 0.0,
+            "tokens_per_s": round(self.tokens / elapsed, 1) if elapsed else 0.0,
+            "error": self.error,
+        }
+
+    def report(self):
+        snap = self.snapshot()
+        log.info("Batch progress: %s/%s analyzed", snap["analyzed"], snap["total"], extra={"progress": snap})
+
+
+async def run_batch(images=None, concurrency=BATCH_CONCURRENCY, rpm=BATCH_RPM,
+                    checkpoint_path=BATCH_CHECKPOINT_FILE, force=False, run_id=None,
+                    update_size=BATCH_UPDATE_SIZE, report_every=10.0, progress=None):
+    """
+    Analyses stored photos with bounded concurrency and a requests-per-minute
+    cap, writing damage reports back to insurance_sessions in batches.
+
+    A photo is added to the checkpoint, under this run's id, only after its
+    report has been written. Failures are not checkpointed and are retried
+    on the next run. Without force, photos checkpointed by any run are
+    skipped, and so are sessions that already have a damage report. With
+    force, everything is re-analysed except photos checkpointed by run_id
+    itself, so passing the id of an interrupted forced run resumes it.
+
+    Returns:
+        dict: Final progress snapshot
+    """
+    progress = progress or BatchProgress()
+    progress.run_id = run_id = run_id or uuid.uuid4().hex[:12]
+    progress.running = True
+    progress.started_at = time.monotonic()
+    if images is None:
+        # Legacy per-session files first, then the content-addressed store (claim_photos index)
+        images = await legacy_images() + await run_db(stored_photo_refs, long_running=True)
+    progress.total = len(images)
+
+    done = load_checkpoint(checkpoint_path, run_id if force else None)
+    pending = [(path, sid) for path, sid in images if path not in done]
+    progress.skipped += len(images) - len(pending)
+
+    if not force and pending:
+        session_ids = sorted({sid for _, sid in pending})
+        analysed = set()
+        for i in range(0, len(session_ids), 500):
+            analysed |= await run_db(_sessions_with_reports, session_ids[i:i + 500], long_running=True)
+        before = len(pending)
+        pending = [(path, sid) for path, sid in pending if sid not in analysed]
+        progress.skipped += before - len(pending)
+
+    queue = asyncio.Queue()
+    for item in pending:
+        queue.put_nowait(item)
+
+    limiter = RateLimiter(rpm)
+    buffer = []  # [(VisionResult, session_id, path)]
+    flush_lock = asyncio.Lock()
+    # Legacy files have no claim_photos row to aggregate from later, so a session's legacy
+    # results are held back until all of them are in and then written together
+    legacy_left = Counter(sid for path, sid in pending if not path.startswith(STORAGE_REF_PREFIX))
+    legacy_held = {}
+
+    async def flush():
+        async with flush_lock:
+            if not buffer:
+                return
+            rows = buffer[:]
+            del buffer[:]
+            await run_db(_write_photo_reports, rows, long_running=True)
+            await asyncio.to_thread(append_checkpoint, checkpoint_path,
+                                    [{"run": run_id, "path": path, "session_id": sid} for _, sid, path in rows])
+            progress.written += len(rows)
+
+    async def worker():
+        while True:
+            try:
+                path, session_id = queue.get_nowait()
+            except asyncio.QueueEmpty:
+                return
+            result = None
+            try:
+                await limiter.wait()
+                result = await analyze_car_damage_detailed(path)
+            except Exception:
+                log.exception("Batch analysis crashed", extra={"path": path})
+            failed = result is None or is_failed_analysis(result.text)
+            if failed:
+                progress.failed += 1
+            else:
+                progress.analyzed += 1
+                progress.tokens += result.total_tokens
+                progress.cache_hits += int(result.cached)
+            if not path.startswith(STORAGE_REF_PREFIX):
+                if not failed:
+                    legacy_held.setdefault(session_id, []).append((result, session_id, path))
+                legacy_left[session_id] -= 1
+                if legacy_left[session_id] == 0:
+                    buffer.extend(legacy_held.pop(session_id, []))
+            elif not failed:
+                buffer.append((result, session_id, path))
+            if len(buffer) >= update_size:
+                await flush()
+
+    async def reporter():
+        while True:
+            await asyncio.sleep(report_every)
+            progress.report()
+
+    reporter_task = asyncio.create_task(reporter())
+    try:
+        await asyncio.gather(*[worker() for _ in range(max(concurrency, 1))])
+        await flush()
+    except Exception as e:
+        progress.error = f"{type(e).__name__}: {e}"
+        raise
+    finally:
+        reporter_task.cancel()
+        progress.running = False
+        progress.finished_at = time.monotonic()
+        progress.report()
+    return progress.snapshot()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Bulk vision analysis of stored claim photos.")
+    parser.add_argument("--concurrency", type=int, default=BATCH_CONCURRENCY)
+    parser.add_argument("--rpm", type=float, default=BATCH_RPM, help="max vision requests per minute (0 = unlimited)")
+    parser.add_argument("--checkpoint", default=BATCH_CHECKPOINT_FILE)
+    parser.add_argument("--force", action="store_true", help="re-analyse sessions that already have a report")
+    parser.add_argument("--run-id", help="with --force, resume this interrupted run instead of starting afresh")
+    parser.add_argument("--update-size", type=int, default=BATCH_UPDATE_SIZE)
+    parser.add_argument("--report-every", type=float, default=10.0, help="seconds between progress lines")
+    args = parser.parse_args()
+
+    summary = asyncio.run(run_batch(
+        concurrency=args.concurrency, rpm=args.rpm, checkpoint_path=args.checkpoint,
+        force=args.force, run_id=args.run_id, update_size=args.update_size, report_every=args.report_every
+    ))
+    log.info("Batch analysis finished", extra={"summary": summary})
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,211 @@
+# Circuit breakers for the upstreams a request can stall on (MySQL, each Groq model): once calls
+# keep failing or running slow, callers get an immediate CircuitOpenError and take their degraded
+# path (template question, queued vision job, "database unavailable" reply) instead of waiting
+# through timeouts and retries.
+import os
+import threading
+import time
+from collections import deque
+from app.config import load_env
+from app.logger import get_logger
+
+load_env()
+
+log = get_logger(__name__)
+
+# Configuration (shared defaults; slow-call thresholds are set per upstream)
+BREAKER_WINDOW = float(os.getenv("BREAKER_WINDOW", 30))  # seconds of calls the rates are computed over
+BREAKER_MIN_CALLS = int(os.getenv("BREAKER_MIN_CALLS", 10))  # calls in the window before it can trip
+BREAKER_FAILURE_RATE = float(os.getenv("BREAKER_FAILURE_RATE", 0.5))
+BREAKER_SLOW_RATE = float(os.getenv("BREAKER_SLOW_RATE", 0.8))
+BREAKER_OPEN_SECONDS = float(os.getenv("BREAKER_OPEN_SECONDS", 15))  # before letting probe calls through
+BREAKER_HALF_OPEN_CALLS = int(os.getenv("BREAKER_HALF_OPEN_CALLS", 2))  # successful probes needed to close
+
+CLOSED, OPEN, HALF_OPEN = "closed", "open", "half_open"
+STATE_CODES = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+
+
+class CircuitOpenError(Exception):
+    """Raised instead of calling an upstream whose breaker is open."""
+    status_code = 503
+
+    def __init__(self, name, retry_after):
+        super().__init__(f"Circuit '{name}' is open (next probe in {retry_after:.1f}s)")
+        self.retry_after = retry_after
+
+
+class CircuitBreaker:
+    """
+    Closed / open / half-open breaker over a rolling time window.
+
+    Closed: calls go through; each outcome is recorded. When the window holds
+    at least min_calls and the share of failures reaches failure_rate, or the
+    share of calls slower than slow_call reaches slow_rate, the breaker opens.
+    Open: allow() refuses for open_seconds. Half-open: up to half_open_calls
+    probes go through at a time; that many successes close the breaker, any
+    failure (or slow probe) opens it again. Thread-safe (DB calls finish on
+    executor threads).
+    """
+
+    def __init__(self, name, slow_call, window=BREAKER_WINDOW, min_calls=BREAKER_MIN_CALLS,
+                 failure_rate=BREAKER_FAILURE_RATE, slow_rate=BREAKER_SLOW_RATE,
+                 open_seconds=BREAKER_OPEN_SECONDS, half_open_calls=BREAKER_HALF_OPEN_CALLS):
+        self.name = name
+        self.slow_call = slow_call
+        self.window = window
+        self.min_calls = min_calls
+        self.failure_rate = failure_rate
+        self.slow_rate = slow_rate
+        self.open_seconds = open_seconds
+        self.half_open_calls = max(half_open_calls, 1)
+        self._lock = threading.Lock()
+        self._state = CLOSED
+        self._calls = deque()  # (finished_at, failed, slow)
+        self._failures = 0
+        self._slow = 0
+        self._opened_at = 0.0
+        self._probes = 0  # half-open calls in flight
+        self._probe_successes = 0
+        self._stats = {"rejected": 0, "opened": 0}
+
+    def _prune(self, now):
+        # Caller holds the lock
+        while self._calls and self._calls[0][0] < now - self.window:
+            _, failed, slow = self._calls.popleft()
+            self._failures -= failed
+            self._slow -= slow
+
+    def _transition(self, state, reason=None):
+        # Caller holds the lock
+        previous, self._state = self._state, state
+        if state == OPEN:
+            self._opened_at = time.monotonic()
+            self._stats["opened"] += 1
+        if state in (OPEN, CLOSED):
+            self._calls.clear()
+            self._failures = self._slow = 0
+        self._probes = self._probe_successes = 0
+        log.warning("Circuit %s: %s -> %s", self.name, previous, state, extra={"reason": reason})
+
+    def retry_after(self):
+        """Seconds until calls are let through again (0 when they are now)."""
+        with self._lock:
+            if self._state != OPEN:
+                return 0.0
+            return max(self._opened_at + self.open_seconds - time.monotonic(), 0.0)
+
+    def allow(self):
+        """True if a call may go ahead now; callers must record() every allowed call."""
+        with self._lock:
+            if self._state == OPEN:
+                if time.monotonic() - self._opened_at < self.open_seconds:
+                    self._stats["rejected"] += 1
+                    return False
+                self._transition(HALF_OPEN, "probing")
+            if self._state == HALF_OPEN:
+                if self._probes >= self.half_open_calls:
+                    self._stats["rejected"] += 1
+                    return False
+                self._probes += 1
+            return True
+
+    def check(self):
+        """
+        Raises:
+            CircuitOpenError: If the breaker refuses the call
+        """
+        if not self.allow():
+            raise CircuitOpenError(self.name, self.retry_after())
+
+    def skip(self):
+        """An allowed call that never reached the upstream (e.g. no free pooled connection): not recorded."""
+        with self._lock:
+            if self._state == HALF_OPEN:
+                self._probes = max(self._probes - 1, 0)
+
+    def record(self, elapsed, failed=False, timed_out=False):
+        """
+        Records the outcome of an allowed call.
+
+        Args:
+            elapsed (float): Seconds the call took
+            failed (bool): The upstream failed (connection error, 5xx, ...)
+            timed_out (bool): The caller gave up on it (counted as slow)
+        """
+        slow = timed_out or elapsed >= self.slow_call
+        with self._lock:
+            if self._state == HALF_OPEN:
+                self._probes = max(self._probes - 1, 0)
+                if failed or slow:
+                    self._transition(OPEN, "probe failed" if failed else "probe slow")
+                else:
+                    self._probe_successes += 1
+                    if self._probe_successes >= self.half_open_calls:
+                        self._transition(CLOSED, "probes succeeded")
+                return
+            if self._state == OPEN:
+                return  # a call started before the breaker opened
+
+            now = time.monotonic()
+            self._calls.append((now, failed, slow))
+            self._failures += failed
+            self._slow += slow
+            self._prune(now)
+            count = len(self._calls)
+            if count >= self.min_calls:
+                if self._failures / count >= self.failure_rate:
+                    self._transition(OPEN, f"{self._failures}/{count} calls failed")
+                elif self._slow / count >= self.slow_rate:
+                    self._transition(OPEN, f"{self._slow}/{count} calls slower than {self.slow_call}s")
+
+    @property
+    def state(self):
+        with self._lock:
+            if self._state == OPEN and time.monotonic() - self._opened_at >= self.open_seconds:
+                return HALF_OPEN  # the next allow() lets a probe through
+            return self._state
+
+    def stats(self):
+        state = self.state
+        with self._lock:
+            self._prune(time.monotonic())
+            count = len(self._calls)
+            return {
+                "state": state,
+                "calls": count,
+                "failure_rate": round(self._failures / count, 3) if count else 0.0,
+                "slow_rate": round(self._slow / count, 3) if count else 0.0,
+                "retry_after": round(max(self._opened_at + self.open_seconds - time.monotonic(), 0.0), 1)
+                if state == OPEN else 0.0,
+                **self._stats,
+            }
+
+
+_breakers = {}
+_registry_lock = threading.Lock()
+
+
+def get_breaker(name, slow_call):
+    """The process-wide breaker for an upstream, created on first use."""
+    with _registry_lock:
+        if name not in _breakers:
+            _breakers[name] = CircuitBreaker(name, slow_call)
+        return _breakers[name]
+
+
+def get_breaker_stats():
+    """State of every breaker, by name (health endpoints)."""
+    with _registry_lock:
+        breakers = list(_breakers.values())
+    return {breaker.name: breaker.stats() for breaker in breakers}
+
+
+def get_breaker_gauges():
+    """Numeric view for /metrics: {name}_state (0 closed, 1 half-open, 2 open), rejected, opened."""
+    gauges = {}
+    for name, stats in get_breaker_stats().items():
+        key = "".join(ch if ch.isalnum() else "_" for ch in name)
+        gauges[f"{key}_state"] = STATE_CODES[stats["state"]]
+        gauges[f"{key}_rejected"] = stats["rejected"]
+        gauges[f"{key}_opened"] = stats["opened"]
+    return gauges
@@ -0,0 +1,186 @@
+# Multi-photo claims: the photos of a claim are analysed together (concurrently within a per-claim
+# cap, or packed several to a vision request), each result is kept on its claim_photos row, and
+# the claim's damage report is the aggregate: worst severity seen and one combined plate reading.
+import asyncio
+import os
+from typing import List, NamedTuple, Tuple
+from app.config import load_env
+from app.image_processor import (
+    analyze_car_damage_detailed, analyze_car_damage_packed, is_failed_analysis, VisionResult
+)
+from app.damage_report import DAMAGE_REPORT_ASSIGNMENTS, damage_report_values, format_damage_report, report_from_columns
+from app.schemas import DamageReport, SEVERITY_LEVELS
+from app.storage import key_from_ref
+from app.logger import get_logger
+
+load_env()
+
+log = get_logger(__name__)
+
+# Configuration
+CLAIM_MAX_PHOTOS = int(os.getenv("CLAIM_MAX_PHOTOS", 10))  # photos per upload
+PHOTO_ANALYSIS_CONCURRENCY = int(os.getenv("PHOTO_ANALYSIS_CONCURRENCY", 3))  # vision calls in flight per claim
+VISION_PACK_PHOTOS = os.getenv("VISION_PACK_PHOTOS", "false").lower() == "true"
+VISION_PACK_SIZE = int(os.getenv("VISION_PACK_SIZE", 4))  # photos per packed request (Groq allows up to 5)
+
+# A vision job covering several photos stores their refs newline-separated in vision_jobs.image_ref
+REF_SEPARATOR = "\n"
+
+
+def join_refs(refs):
+    return REF_SEPARATOR.join(refs)
+
+
+def split_refs(image_ref):
+    return [ref for ref in image_ref.split(REF_SEPARATOR) if ref]
+
+
+class ClaimAnalysis(NamedTuple):
+    result: VisionResult  # aggregate over the analysed photos, or the failure to retry
+    photos: List[Tuple[str, VisionResult]]  # (image ref, result) per photo
+
+
+# --- Aggregation ---
+
+def combine_plates(readings):
+    """
+    One plate from several (plate, confidence) readings. Readings are summed
+    by confidence, and a partial reading (a substring of a longer one, e.g. a
+    plate half out of frame) counts towards the longer plate.
+    """
+    scores = {}
+    for plate, confidence in readings:
+        scores[plate] = scores.get(plate, 0.0) + confidence + 0.01  # zero-confidence readings still count
+    for partial in list(scores):
+        longer = [plate for plate in scores if plate != partial and partial in plate]
+        if longer:
+            scores[max(longer, key=len)] += scores[partial]
+    return max(scores, key=lambda plate: (scores[plate], len(plate))) if scores else None
+
+
+def aggregate_reports(reports):
+    """
+    Claim-level DamageReport from per-photo reports: the highest severity
+    (with the confidence of the surest photo showing it), one combined plate
+    and the photo descriptions in order. A single report is returned as is.
+    """
+    reports = [report for report in reports if report is not None]
+    if len(reports) <= 1:
+        return reports[0] if reports else None
+
+    rated = [report for report in reports if report.severity]
+    severity = max((report.severity for report in rated), key=SEVERITY_LEVELS.index, default=None)
+    confidence = max((report.confidence for report in rated if report.severity == severity),
+                     default=max(report.confidence for report in reports))
+    plate = combine_plates([(report.license_plate, report.confidence) for report in reports if report.license_plate])
+    description = " ".join(f"Photo {i}: {report.description}" for i, report in enumerate(reports, 1)
+                           if report.description)
+    return DamageReport(license_plate=plate, severity=severity, description=description, confidence=confidence)
+
+
+# --- DB Work (claim_photos analysis columns, see sql/schema.sql) ---
+
+def save_claim_analysis(conn, session_id, photos):
+    """
+    Stores per-photo results on their claim_photos rows and writes the claim's
+    aggregate report (over every analysed photo of the session, not just
+    these) to insurance_sessions. The session row is locked first, so two
+    jobs for the same claim cannot overwrite each other's aggregate.
+
+    Returns:
+        tuple: (damage_report text, DamageReport) written for the claim
+    """
+    with conn.cursor() as cursor:
+        cursor.execute("SELECT session_id FROM insurance_sessions WHERE session_id = %s FOR UPDATE", (session_id,))
+        unindexed = []  # URL photos and legacy files have no claim_photos row
+        for ref, result in photos:
+            key = key_from_ref(ref)
+            if key:
+                cursor.execute(
+                    f"UPDATE claim_photos SET {DAMAGE_REPORT_ASSIGNMENTS}, analyzed_at = CURRENT_TIMESTAMP "
+                    f"WHERE session_id = %s AND object_key = %s",
+                    (*damage_report_values(result.text, result.report), session_id, key)
+                )
+                if cursor.rowcount:
+                    continue
+            unindexed.append(result.report)
+
+        cursor.execute(
+            "SELECT damage_report, license_plate, damage_severity, damage_confidence FROM claim_photos "
+            "WHERE session_id = %s AND analyzed_at IS NOT NULL ORDER BY created_at, id",
+            (session_id,)
+        )
+        reports = [report_from_columns(row) for row in cursor.fetchall()] + unindexed
+        report = aggregate_reports(reports)
+        text = format_damage_report(report) if report else photos[0][1].text
+        cursor.execute(
+            f"UPDATE insurance_sessions SET {DAMAGE_REPORT_ASSIGNMENTS}, photo_uploaded = TRUE WHERE session_id = %s",
+            (*damage_report_values(text, report), session_id)
+        )
+    conn.commit()
+    return text, report
+
+
+def photo_reports(conn, session_id):
+    """Per-photo analysis of a claim, oldest photo first."""
+    with conn.cursor() as cursor:
+        cursor.execute(
+            "SELECT object_key, original_filename, license_plate, damage_severity, damage_confidence, "
+            "damage_report, analyzed_at, created_at FROM claim_photos WHERE session_id = %s ORDER BY created_at, id",
+            (session_id,)
+        )
+        return cursor.fetchall()
+
+
+# --- Analysis ---
+
+async def _analyze_packed(refs, image_hashes):
+    results = []
+    for start in range(0, len(refs), VISION_PACK_SIZE):
+        chunk, hashes = refs[start:start + VISION_PACK_SIZE], image_hashes[start:start + VISION_PACK_SIZE]
+        packed = await analyze_car_damage_packed(chunk, hashes) if len(chunk) > 1 else None
+        if packed is None:
+            packed = [await analyze_car_damage_detailed(ref, image_hash=h) for ref, h in zip(chunk, hashes)]
+        results.extend(packed)
+    return results
+
+
+async def analyze_claim_photos(image_ref, image_hash=None, pack=VISION_PACK_PHOTOS,
+                               concurrency=PHOTO_ANALYSIS_CONCURRENCY):
+    """
+    Analyses every photo of a vision job (image_ref is one ref or several,
+    see join_refs): concurrently, at most `concurrency` at a time, or in
+    packed requests when pack is set.
+
+    Returns:
+        ClaimAnalysis: result is the aggregate of this job's photos. If any
+            photo failed with a retryable error, result is that failure (the
+            successful photos are cached, so a retry only redoes the others);
+            photos with a permanent error are left out of the aggregate.
+    """
+    refs = split_refs(image_ref)
+    hashes = [image_hash] if len(refs) == 1 else [None] * len(refs)  # image_hash describes a single photo
+    if pack and len(refs) > 1:
+        results = await _analyze_packed(refs, hashes)
+    else:
+        semaphore = asyncio.Semaphore(max(concurrency, 1))
+
+        async def analyze(ref, ref_hash):
+            async with semaphore:
+                return await analyze_car_damage_detailed(ref, image_hash=ref_hash)
+
+        results = await asyncio.gather(*[analyze(ref, h) for ref, h in zip(refs, hashes)])
+
+    photos = list(zip(refs, results))
+    analysed = [(ref, result) for ref, result in photos if not is_failed_analysis(result.text)]
+    retryable = [result for result in results if is_failed_analysis(result.text) and not result.text.startswith("Error:")]
+    if retryable or not analysed:
+        return ClaimAnalysis((retryable or results)[0], photos)
+
+    report = aggregate_reports([result.report for _, result in analysed])
+    total_tokens = sum(result.total_tokens for result in results)
+    cached = all(result.cached for _, result in analysed)
+    if report is None:
+        return ClaimAnalysis(VisionResult(analysed[0][1].text, total_tokens=total_tokens, cached=cached), analysed)
+    return ClaimAnalysis(VisionResult(format_damage_report(report), total_tokens=total_tokens, cached=cached,
+                                      report=report), analysed)
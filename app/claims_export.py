@@ -0,0 +1,228 @@
+# Streaming claim extracts (NDJSON or CSV, optionally gzipped) in constant memory: rows come off
+# an unbuffered server-side cursor in batches and are encoded and sent as they arrive.
+import argparse
+import asyncio
+import csv
+import io
+import json
+import os
+import sys
+import threading
+import time
+import zlib
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from datetime import datetime
+import pymysql
+from app.config import load_env
+from app.db_helper import run_db
+from app.claims_query import CLAIM_FIELDS, serialize_claim
+from app.logger import get_logger
+
+load_env()
+
+log = get_logger(__name__)
+
+# Configuration
+EXPORT_BATCH_SIZE = int(os.getenv("EXPORT_BATCH_SIZE", 1000))  # rows per fetchmany()
+EXPORT_QUEUE_BATCHES = 4  # batches buffered between the DB thread and a slow client
+EXPORT_MAX_CONCURRENT = int(os.getenv("EXPORT_MAX_CONCURRENT", 2))  # each holds a pooled connection throughout
+# MySQL aborts a streaming result the client doesn't read for net_write_timeout seconds (default 60)
+EXPORT_NET_WRITE_TIMEOUT = int(os.getenv("EXPORT_NET_WRITE_TIMEOUT", 600))
+EXPORT_FORMATS = {"ndjson": "application/x-ndjson", "csv": "text/csv"}
+
+_export_slots = threading.BoundedSemaphore(EXPORT_MAX_CONCURRENT)
+
+
+class ExportBusyError(Exception):
+    """Raised when EXPORT_MAX_CONCURRENT exports are already running."""
+
+
+class _ExportCancelled(Exception):
+    """The consumer went away; raised on the DB thread so the connection is discarded."""
+
+
+# --- DB side (runs on the DB executor) ---
+
+def _stream_rows(conn, fields, since, until, batch_size, emit):
+    """Reads the extract with an unbuffered cursor and hands each batch to emit()."""
+    where, params = [], []
+    if since:
+        where.append("created_at >= %s")
+        params.append(since)
+    if until:
+        where.append("created_at < %s")
+        params.append(until)
+
+    with conn.cursor() as cursor:
+        cursor.execute("SET SESSION net_write_timeout = %s", (EXPORT_NET_WRITE_TIMEOUT,))
+    cursor = conn.cursor(pymysql.cursors.SSDictCursor)
+    try:
+        # Index order on idx_created_at: rows stream out without a sort
+        cursor.execute(
+            f"SELECT {', '.join(fields)} FROM insurance_sessions "
+            f"{'WHERE ' + ' AND '.join(where) if where else ''} ORDER BY created_at, session_id",
+            tuple(params)
+        )
+        while True:
+            batch = cursor.fetchmany(batch_size)
+            if not batch:
+                break
+            if not emit(batch):
+                # Closing the cursor would read (and discard) the rest of the result;
+                # closing the connection drops it at once and the pool discards it
+                conn.close()
+                raise _ExportCancelled()
+    finally:
+        if conn.open:
+            cursor.close()
+            # The connection goes back to the pool: later users get the server's default again
+            with conn.cursor() as reset:
+                reset.execute("SET SESSION net_write_timeout = DEFAULT")
+
+
+async def iter_claim_batches(fields=CLAIM_FIELDS, since=None, until=None, batch_size=EXPORT_BATCH_SIZE):
+    """
+    Async iterator over batches of claim rows (oldest first), with at most
+    EXPORT_QUEUE_BATCHES batches in memory however large the extract.
+
+    Raises:
+        ExportBusyError: EXPORT_MAX_CONCURRENT exports are already running
+        DatabaseUnavailableError: No connection for the export
+    """
+    if not _export_slots.acquire(blocking=False):
+        raise ExportBusyError(f"{EXPORT_MAX_CONCURRENT} exports are already running; try again shortly.")
+
+    loop = asyncio.get_running_loop()
+    queue = asyncio.Queue(EXPORT_QUEUE_BATCHES)
+    cancelled = threading.Event()
+
+    def emit(batch):
+        future = asyncio.run_coroutine_threadsafe(queue.put(batch), loop)
+        while True:
+            try:
+                future.result(timeout=0.5)  # blocks while the client is slower than the DB (backpressure)
+                return not cancelled.is_set()
+            except FutureTimeoutError:
+                if cancelled.is_set():
+                    future.cancel()
+                    return False
+
+    producer = asyncio.ensure_future(run_db(_stream_rows, fields, since, until, batch_size, emit, max_retries=1,
+                                               long_running=True))
+    # The slot is held until the DB thread is done with the connection, not just the consumer
+    producer.add_done_callback(lambda task: (_export_slots.release(), task.cancelled() or task.exception()))
+    try:
+        while True:
+            getter = asyncio.ensure_future(queue.get())
+            done, _ = await asyncio.wait({getter, producer}, return_when=asyncio.FIRST_COMPLETED)
+            if getter in done:
+                yield getter.result()
+                continue
+            getter.cancel()
+            producer.result()  # raises what the DB side raised
+            return
+    finally:
+        cancelled.set()
+
+
+# --- Encoding ---
+
+class _Encoder:
+    """Batch of rows -> bytes in the export format, gzip-compressed on the fly if asked."""
+
+    def __init__(self, fields, fmt, compress):
+        self.fields = fields
+        self.fmt = fmt
+        self._gzip = zlib.compressobj(6, zlib.DEFLATED, 31) if compress else None  # wbits 31: gzip container
+        self._header_done = fmt != "csv"
+
+    def _text(self, rows):
+        if self.fmt == "ndjson":
+            return "".join(json.dumps(serialize_claim(row), ensure_ascii=False, default=str) + "\n" for row in rows)
+        out = io.StringIO()
+        writer = csv.writer(out)
+        if not self._header_done:
+            writer.writerow(self.fields)
+            self._header_done = True
+        for row in rows:
+            record = serialize_claim(row)
+            writer.writerow(["" if record[f] is None else record[f] for f in self.fields])
+        return out.getvalue()
+
+    def encode(self, rows):
+        data = self._text(rows).encode("utf-8")
+        if self._gzip:
+            # Sync flush: every batch leaves as soon as it is encoded (small cost in ratio)
+            data = self._gzip.compress(data) + self._gzip.flush(zlib.Z_SYNC_FLUSH)
+        return data
+
+    def finish(self):
+        tail = self._text([]).encode("utf-8") if not self._header_done else b""  # CSV header of an empty extract
+        if self._gzip:
+            tail = self._gzip.compress(tail) + self._gzip.flush()
+        return tail
+
+
+async def stream_export(fields=CLAIM_FIELDS, since=None, until=None, fmt="ndjson", compress=False,
+                        batch_size=EXPORT_BATCH_SIZE, stats=None):
+    """
+    Yields the encoded extract chunk by chunk. The first chunk comes with
+    the first batch of rows, so priming the generator surfaces a busy or
+    unavailable database before any response has been started.
+    """
+    stats = stats if stats is not None else {}
+    stats.update(rows=0, bytes=0)
+    encoder = _Encoder(fields, fmt, compress)
+    async for batch in iter_claim_batches(fields, since, until, batch_size):
+        chunk = encoder.encode(batch)
+        stats["rows"] += len(batch)
+        stats["bytes"] += len(chunk)
+        yield chunk
+    tail = encoder.finish()
+    stats["bytes"] += len(tail)
+    if tail:
+        yield tail
+
+
+def export_filename(fmt, since=None, until=None, compress=False):
+    span = "-".join(d.strftime("%Y%m%d") for d in (since, until) if d) or "all"
+    return f"claims-{span}.{fmt}{'.gz' if compress else ''}"
+
+
+# --- CLI ---
+
+async def export_to_file(out, fields, since, until, fmt, compress, batch_size):
+    stats = {}
+    started = time.perf_counter()
+    async for chunk in stream_export(fields, since, until, fmt, compress, batch_size, stats):
+        out.write(chunk)
+    stats["elapsed_s"] = round(time.perf_counter() - started, 2)
+    return stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Stream a claims extract to a file (constant memory).")
+    parser.add_argument("--since", type=datetime.fromisoformat, default=None, help="created_at >= (ISO date)")
+    parser.add_argument("--until", type=datetime.fromisoformat, default=None, help="created_at < (ISO date)")
+    parser.add_argument("--format", choices=sorted(EXPORT_FORMATS), default="ndjson")
+    parser.add_argument("--gzip", action="store_true")
+    parser.add_argument("--fields", default=None, help="comma-separated columns (default: all)")
+    parser.add_argument("--batch-size", type=int, default=EXPORT_BATCH_SIZE)
+    parser.add_argument("--out", default=None, help="file path (default: generated name, '-' for stdout)")
+    args = parser.parse_args()
+
+    from app.claims_query import parse_fields
+    fields = parse_fields(args.fields, default=CLAIM_FIELDS)
+    path = args.out or export_filename(args.format, args.since, args.until, args.gzip)
+    if path == "-":
+        stats = asyncio.run(export_to_file(sys.stdout.buffer, fields, args.since, args.until,
+                                           args.format, args.gzip, args.batch_size))
+    else:
+        with open(path, "wb") as out:
+            stats = asyncio.run(export_to_file(out, fields, args.since, args.until,
+                                               args.format, args.gzip, args.batch_size))
+    log.info("Exported %s claim(s) to %s", stats["rows"], path, extra={"stats": stats})
+
+
+if __name__ == "__main__":
+    main()
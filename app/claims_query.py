@@ -0,0 +1,116 @@
+# Read API over insurance_sessions: keyset pagination on (created_at, session_id), newest first.
+# Each page is an index range scan that starts at the cursor, so page 10,000 costs the same as page 1
+# (OFFSET would read and discard every earlier row).
+import base64
+import json
+from datetime import datetime
+
+# Columns a caller may project; the TEXT ones are only read when asked for
+CLAIM_FIELDS = (
+    "session_id", "policy_number", "claimant_name", "date_time_of_incident", "vehicle_info",
+    "incident_description", "photo_uploaded", "damage_report", "license_plate", "damage_severity",
+    "damage_confidence", "is_complete", "near_duplicate_of", "near_duplicate_distance", "created_at", "updated_at",
+)
+TEXT_FIELDS = {"vehicle_info", "incident_description", "damage_report"}
+DEFAULT_LIST_FIELDS = tuple(f for f in CLAIM_FIELDS if f not in TEXT_FIELDS)
+MAX_PAGE_SIZE = 200
+
+
+class InvalidQueryError(ValueError):
+    """Bad cursor or unknown field names (answered with 400)."""
+
+
+def parse_fields(fields, default=DEFAULT_LIST_FIELDS):
+    """'a,b,c' -> validated column tuple; session_id and created_at are always included (the cursor needs them)."""
+    if not fields:
+        return default
+    requested = [f.strip() for f in fields.split(",") if f.strip()]
+    unknown = [f for f in requested if f not in CLAIM_FIELDS]
+    if unknown:
+        raise InvalidQueryError(f"Unknown field(s): {', '.join(unknown)}. Allowed: {', '.join(CLAIM_FIELDS)}")
+    return tuple(dict.fromkeys(["session_id", "created_at", *requested]))
+
+
+def encode_cursor(row):
+    """Opaque cursor pointing just past row."""
+    key = json.dumps([str(row["created_at"]), row["session_id"]], separators=(",", ":"))
+    return base64.urlsafe_b64encode(key.encode("utf-8")).decode("ascii").rstrip("=")
+
+
+def decode_cursor(cursor):
+    try:
+        created_at, session_id = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+        datetime.fromisoformat(created_at)
+        return created_at, str(session_id)
+    except (ValueError, TypeError):
+        raise InvalidQueryError("Invalid cursor")
+
+
+def list_claims(conn, fields=DEFAULT_LIST_FIELDS, policy_number=None, complete=None, cursor=None,
+                limit=50):
+    """
+    One page of claims, newest first.
+
+    The keyset scan selects only session_ids, which idx_created_at /
+    idx_policy_created / idx_complete_created cover (InnoDB secondary
+    indexes carry the primary key), and the projected columns are then read
+    for just those rows (deferred join).
+
+    Returns:
+        tuple: (rows, next_cursor) - next_cursor is None on the last page
+    """
+    where, params = [], []
+    if policy_number:
+        where.append("policy_number = %s")
+        params.append(policy_number)
+    if complete is not None:
+        where.append("is_complete = %s")
+        params.append(bool(complete))
+    if cursor:
+        created_at, session_id = decode_cursor(cursor)
+        # The leading 'created_at <=' bound is what lets the optimizer range-scan the index
+        where.append("created_at <= %s AND (created_at < %s OR session_id < %s)")
+        params.extend([created_at, created_at, session_id])
+
+    columns = ", ".join(f"s.{f}" for f in fields)
+    with conn.cursor() as db_cursor:
+        db_cursor.execute(
+            f"""
+            SELECT {columns} FROM insurance_sessions s
+            JOIN (
+                SELECT session_id FROM insurance_sessions
+                {"WHERE " + " AND ".join(where) if where else ""}
+                ORDER BY created_at DESC, session_id DESC
+                LIMIT %s
+            ) page ON page.session_id = s.session_id
+            ORDER BY s.created_at DESC, s.session_id DESC
+            """,
+            (*params, limit + 1)
+        )
+        rows = db_cursor.fetchall()
+
+    next_cursor = encode_cursor(rows[limit - 1]) if len(rows) > limit else None
+    return rows[:limit], next_cursor
+
+
+def get_claim(conn, session_id, fields=CLAIM_FIELDS):
+    with conn.cursor() as cursor:
+        cursor.execute(
+            f"SELECT {', '.join(fields)} FROM insurance_sessions WHERE session_id = %s",
+            (session_id,)
+        )
+        return cursor.fetchone()
+
+
+def serialize_claim(row):
+    """JSON-safe copy of a row (datetimes as ISO strings, DECIMAL as float, flags as bool)."""
+    out = {}
+    for key, value in row.items():
+        if isinstance(value, datetime):
+            value = value.isoformat(sep=" ")
+        elif key == "damage_confidence" and value is not None:
+            value = float(value)
+        elif key in ("photo_uploaded", "is_complete") and value is not None:
+            value = bool(value)
+        out[key] = value
+    return out
@@ -1 +1,62 @@
-# Environment config
\ No newline at end of file
+# Environment config: .env is read once per process, and the settings object and the
+# expensive SDK clients are built on first use (not at import) to keep cold starts short.
+import functools
+import threading
+from typing import Optional
+from dotenv import load_dotenv
+from pydantic_settings import BaseSettings
+
+_env_lock = threading.Lock()
+_env_loaded = False
+
+
+def load_env():
+    """Loads .env into os.environ once; cheap no-op on every later call."""
+    global _env_loaded
+    if _env_loaded:
+        return
+    with _env_lock:
+        if not _env_loaded:
+            load_dotenv()
+            _env_loaded = True
+
+
+def lazy(factory):
+    """
+    Thread-safe build-once accessor: the first caller builds the object,
+    concurrent callers wait for it instead of building their own.
+    """
+    lock = threading.Lock()
+    built = []
+
+    @functools.wraps(factory)
+    def get():
+        if not built:
+            with lock:
+                if not built:
+                    built.append(factory())
+        return built[0]
+
+    get.is_built = lambda: bool(built)
+    return get
+
+
+class Settings(BaseSettings):
+    """Typed view of the environment variables the clients need (names are case-insensitive)."""
+
+    groq_api_key: Optional[str] = None
+    groq_base_url: Optional[str] = None  # e.g. a local stand-in (benchmarks/fake_groq.py)
+    chat_request_timeout: float = 4.0
+
+    db_host: Optional[str] = None
+    db_port: int = 15215
+    db_user: Optional[str] = None
+    db_password: Optional[str] = None
+    db_name: Optional[str] = None
+    db_connect_timeout: int = 30
+
+
+@lazy
+def get_settings():
+    load_env()
+    return Settings()
@@ -0,0 +1,193 @@
+# Structured damage reports: parsing the vision model's output into app.schemas.DamageReport,
+# the indexed insurance_sessions columns it is stored in, triage queries and the backfill job.
+# Usage: python -m app.damage_report --backfill
+import argparse
+import asyncio
+import json
+import re
+from pydantic import ValidationError
+from app.schemas import DamageReport, SEVERITY_LEVELS
+from app.db_helper import run_db
+from app.logger import get_logger
+
+log = get_logger(__name__)
+
+BACKFILL_BATCH_SIZE = 500
+
+# SET clause shared by every writer of a damage report (job queue, batch analyzer, backfill)
+DAMAGE_REPORT_ASSIGNMENTS = (
+    "damage_report = %s, license_plate = %s, damage_severity = %s, damage_confidence = %s"
+)
+
+_JSON_OBJECT = re.compile(r"\{.*\}", re.DOTALL)
+_PLATE_PATTERN = re.compile(r"licen[cs]e\s*plate[^:\n]*[:\-]\s*\**\s*([A-Z0-9][A-Z0-9 \-]{1,14}[A-Z0-9])", re.IGNORECASE)
+_SEVERITY_PATTERN = re.compile(r"severity[^:\n]*[:\-]\s*\**\s*(low|medium|high)", re.IGNORECASE)
+
+
+# --- Parsing & display ---
+
+def parse_damage_report(text):
+    """
+    Parses the vision model's reply into a DamageReport.
+    JSON output is validated against the schema; fields that fail validation
+    are dropped (and logged) and the rest kept. Older free-text reports (and
+    replies that ignored JSON mode) fall back to pattern matching with
+    confidence 0.
+
+    Returns:
+        DamageReport or None: None when there is nothing to parse
+    """
+    if not text:
+        return None
+
+    match = _JSON_OBJECT.search(text)
+    if match:
+        try:
+            data = json.loads(match.group(0))
+        except ValueError:
+            data = None
+        if isinstance(data, dict):
+            try:
+                return DamageReport.model_validate(data)
+            except ValidationError as e:
+                invalid = {error["loc"][0] for error in e.errors() if error["loc"]}
+                # Field names and error types only: the values may hold the plate
+                log.warning("Damage report JSON failed validation: %s",
+                            ", ".join(f"{error['loc'][0]} ({error['type']})" for error in e.errors() if error["loc"]))
+                return DamageReport.model_validate({k: v for k, v in data.items() if k not in invalid})
+
+    plate = _PLATE_PATTERN.search(text)
+    severity = _SEVERITY_PATTERN.search(text)
+    if not severity:
+        # Prose such as "the damage is high" without a labelled field
+        mentioned = [level for level in SEVERITY_LEVELS if re.search(rf"\b{level}\b", text, re.IGNORECASE)]
+        severity = mentioned[0] if len(mentioned) == 1 else None
+    else:
+        severity = severity.group(1)
+    return DamageReport(
+        license_plate=plate.group(1) if plate else None,
+        severity=severity,
+        description=text.strip(),
+        confidence=0.0
+    )
+
+
+def format_damage_report(report):
+    """Human-readable report kept in damage_report and shown to the claimant."""
+    plate = report.license_plate or "not visible"
+    severity = report.severity or "undetermined"
+    return f"Severity: {severity}. License plate: {plate}. {report.description}".strip()
+
+
+_FORMATTED_PREFIX = re.compile(r"^Severity: \w+\. License plate: [^.]*\.\s*")
+
+def report_from_columns(row):
+    """DamageReport from stored columns (the inverse of damage_report_values for formatted reports)."""
+    return DamageReport(
+        license_plate=row["license_plate"],
+        severity=row["damage_severity"],
+        description=_FORMATTED_PREFIX.sub("", row["damage_report"] or ""),
+        confidence=row["damage_confidence"] or 0.0
+    )
+
+
+def damage_report_values(text, report):
+    """Parameters for DAMAGE_REPORT_ASSIGNMENTS, in order."""
+    if report is None:
+        return (text, None, None, None)
+    return (text, report.license_plate, report.severity, report.confidence)
+
+
+# --- Triage queries (index lookups, see sql/migrations/001_structured_damage_report.sql) ---
+
+TRIAGE_COLUMNS = "session_id, claimant_name, policy_number, license_plate, damage_severity, damage_confidence, created_at"
+
+def find_claims_by_severity(conn, severity, since, limit=100):
+    """Claims of one severity created at or after `since` (uses idx_damage_severity_created)."""
+    with conn.cursor() as cursor:
+        cursor.execute(
+            f"SELECT {TRIAGE_COLUMNS} FROM insurance_sessions "
+            f"WHERE damage_severity = %s AND created_at >= %s ORDER BY created_at DESC LIMIT %s",
+            (severity, since, limit)
+        )
+        return cursor.fetchall()
+
+def find_claims_by_plate(conn, plate, limit=100):
+    """Claims for a license plate, matched on the normalized plate (uses idx_license_plate)."""
+    plate = DamageReport(license_plate=plate).license_plate
+    if not plate:
+        return []
+    with conn.cursor() as cursor:
+        cursor.execute(
+            f"SELECT {TRIAGE_COLUMNS} FROM insurance_sessions "
+            f"WHERE license_plate = %s ORDER BY created_at DESC LIMIT %s",
+            (plate, limit)
+        )
+        return cursor.fetchall()
+
+
+# --- Backfill of rows written before the structured columns existed ---
+
+def _unparsed_reports(conn, after_session_id, limit):
+    with conn.cursor() as cursor:
+        cursor.execute(
+            "SELECT session_id, damage_report FROM insurance_sessions "
+            "WHERE session_id > %s AND damage_report IS NOT NULL AND damage_confidence IS NULL "
+            "ORDER BY session_id LIMIT %s",
+            (after_session_id, limit)
+        )
+        return cursor.fetchall()
+
+def _write_parsed_reports(conn, rows):
+    """rows: [(license_plate, damage_severity, damage_confidence, session_id)]"""
+    with conn.cursor() as cursor:
+        cursor.executemany(
+            "UPDATE insurance_sessions SET license_plate = %s, damage_severity = %s, damage_confidence = %s "
+            "WHERE session_id = %s",
+            rows
+        )
+    conn.commit()
+
+async def backfill_structured_reports(batch_size=BACKFILL_BATCH_SIZE):
+    """
+    Parses existing free-text damage reports into the structured columns.
+    Walks the table in primary-key order (keyset, no OFFSET scans) and keeps
+    damage_report untouched. Rows with a non-NULL damage_confidence are skipped,
+    so the job can be interrupted and re-run safely.
+
+    Returns:
+        dict: Counts of scanned rows and rows with a plate / severity found
+    """
+    counts = {"scanned": 0, "with_plate": 0, "with_severity": 0}
+    last_id = ""
+    while True:
+        rows = await run_db(_unparsed_reports, last_id, batch_size, long_running=True)
+        if not rows:
+            break
+        updates = []
+        for row in rows:
+            report = parse_damage_report(row["damage_report"])
+            _, plate, severity, confidence = damage_report_values(row["damage_report"], report)
+            updates.append((plate, severity, confidence or 0.0, row["session_id"]))
+            counts["with_plate"] += int(bool(plate))
+            counts["with_severity"] += int(bool(severity))
+        await run_db(_write_parsed_reports, updates, long_running=True)
+        counts["scanned"] += len(rows)
+        last_id = rows[-1]["session_id"]
+        log.info("Backfilled %s damage report(s) so far", counts["scanned"])
+    return counts
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Structured damage report maintenance.")
+    parser.add_argument("--backfill", action="store_true", help="parse existing reports into the structured columns")
+    parser.add_argument("--batch-size", type=int, default=BACKFILL_BATCH_SIZE)
+    args = parser.parse_args()
+    if not args.backfill:
+        parser.print_help()
+        return
+    log.info("Backfill finished", extra={"counts": asyncio.run(backfill_structured_reports(args.batch_size))})
+
+
+if __name__ == "__main__":
+    main()
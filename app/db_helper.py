@@ -1,74 +1,447 @@
 import pymysql
 import os
 import time
-from dotenv import load_dotenv
+import asyncio
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from functools import partial
+from app.config import load_env, get_settings
+from app.metrics import stage, observe_stage
+from app.circuit_breaker import get_breaker
+from app.logger import get_logger
+
+load_env()
+
+log = get_logger(__name__)
+
+# Pool configuration
+DB_POOL_MIN_SIZE = int(os.getenv("DB_POOL_MIN_SIZE", 1))
+DB_POOL_MAX_SIZE = int(os.getenv("DB_POOL_MAX_SIZE", 10))
+DB_POOL_MAX_AGE = float(os.getenv("DB_POOL_MAX_AGE", 1800))  # seconds before a connection is recycled
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", 10))  # seconds to wait for a free connection
+DB_SLOW_CALL_SECONDS = float(os.getenv("DB_SLOW_CALL_SECONDS", 5))  # counted as slow by the DB circuit breaker
 
-load_dotenv()
 
 def get_db_connection(max_retries=3):
     """
     Establishes a PyMySQL connection to Aiven MySQL with SSL.
     Includes retry logic with exponential backoff for resilience.
-    
+
     Args:
         max_retries (int): Maximum number of connection attempts
-        
+
     Returns:
         pymysql.Connection or None: Database connection object or None on failure
     """
     # Validate required environment variables
+    settings = get_settings()
     required_vars = ["DB_HOST", "DB_USER", "DB_PASSWORD", "DB_NAME"]
-    missing_vars = [var for var in required_vars if not os.getenv(var)]
-    
+    missing_vars = [var for var in required_vars if not getattr(settings, var.lower())]
+
     if missing_vars:
-        print(f"❌ Missing environment variables: {', '.join(missing_vars)}")
+        log.error("Missing database environment variables", extra={"missing": missing_vars})
         return None
-    
+
     # Resolve SSL certificate path dynamically
     ssl_ca_path = os.path.join(os.path.dirname(__file__), 'ca.pem')
-    
+
     if not os.path.exists(ssl_ca_path):
-        print(f"❌ SSL certificate not found at: {ssl_ca_path}")
+        log.error("SSL certificate not found", extra={"path": ssl_ca_path})
         return None
-    
+
     # Retry logic with exponential backoff
     for attempt in range(max_retries):
         try:
             conn = pymysql.connect(
-                host=os.getenv("DB_HOST"),
-                port=int(os.getenv("DB_PORT", 15215)),
-                user=os.getenv("DB_USER"),
-                password=os.getenv("DB_PASSWORD"),
-                database=os.getenv("DB_NAME"),
+                host=settings.db_host,
+                port=settings.db_port,
+                user=settings.db_user,
+                password=settings.db_password,
+                database=settings.db_name,
                 ssl={'ca': ssl_ca_path},
                 cursorclass=pymysql.cursors.DictCursor,
-                connect_timeout=30,
+                connect_timeout=settings.db_connect_timeout,
                 read_timeout=30,
                 write_timeout=30
             )
-            
-            # Test the connection with a simple query
-            with conn.cursor() as cursor:
-                cursor.execute("SELECT 1")
-                cursor.fetchone()
-            
-            print(f"✅ Database connection established (attempt {attempt + 1}/{max_retries})")
+
+            log.info("Database connection established", extra={"attempt": attempt + 1, "max_retries": max_retries})
             return conn
-            
+
         except pymysql.err.OperationalError as e:
             error_code = e.args[0] if e.args else 'unknown'
-            print(f"⚠️  Connection attempt {attempt + 1}/{max_retries} failed: {error_code} - {str(e)}")
-            
+            log.warning("Database connection attempt failed: %s", e,
+                        extra={"attempt": attempt + 1, "max_retries": max_retries, "error_code": error_code})
+
             if attempt < max_retries - 1:
                 wait_time = 2 ** attempt  # Exponential backoff: 1s, 2s, 4s
-                print(f"⏳ Retrying in {wait_time} seconds...")
                 time.sleep(wait_time)
             else:
-                print(f"❌ Database connection failed after {max_retries} attempts")
+                log.error("Database connection failed after %s attempts", max_retries)
                 return None
-                
-        except Exception as e:
-            print(f"❌ Unexpected database error: {type(e).__name__} - {str(e)}")
+
+        except Exception:
+            log.exception("Unexpected database error")
             return None
-    
+
     return None
+
+
+class ConnectionPool:
+    """
+    Process-wide pool of PyMySQL connections.
+
+    Connections are checked out with acquire() and returned with release().
+    Liveness is verified with a COM_PING on checkout (no extra query), and
+    connections older than max_age seconds are closed and replaced.
+    """
+
+    def __init__(self, connect=get_db_connection, min_size=DB_POOL_MIN_SIZE,
+                 max_size=DB_POOL_MAX_SIZE, max_age=DB_POOL_MAX_AGE, timeout=DB_POOL_TIMEOUT):
+        self._connect = connect
+        self.min_size = min_size
+        self.max_size = max(max_size, 1)
+        self.max_age = max_age
+        self.timeout = timeout
+
+        self._lock = threading.Condition()
+        self._idle = deque()  # (conn, created_at)
+        self._created_at = {}  # id(conn) -> created_at for checked-out connections
+        self._in_use = 0
+
+        # Metrics
+        self._checkouts = 0
+        self._waits = 0
+        self._wait_time_total = 0.0
+        self._wait_time_max = 0.0
+        self._recycled = 0
+        self._dead = 0
+        self._connect_failures = 0
+
+    # --- Internal helpers ---
+
+    def _open(self, max_retries):
+        with stage("db.connect"):
+            conn = self._connect(max_retries=max_retries)
+        if conn is None:
+            with self._lock:
+                self._connect_failures += 1
+        return conn
+
+    def _total(self):
+        return self._in_use + len(self._idle)
+
+    def _is_alive(self, conn):
+        try:
+            conn.ping(reconnect=False)
+            return True
+        except Exception:
+            return False
+
+    @staticmethod
+    def _close_quietly(conn):
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+    # --- Public API ---
+
+    def warm_up(self):
+        """Opens connections until the pool holds min_size of them."""
+        while True:
+            with self._lock:
+                if self._total() >= self.min_size:
+                    return
+                # Reserve the slot so concurrent callers don't overshoot
+                self._in_use += 1
+            conn = self._open(max_retries=1)
+            with self._lock:
+                self._in_use -= 1
+                if conn is None:
+                    self._lock.notify()
+                    return
+                self._idle.append((conn, time.monotonic()))
+                self._lock.notify()
+
+    def acquire(self, timeout=None, max_retries=3):
+        """
+        Checks a live connection out of the pool.
+
+        Args:
+            timeout (float): Seconds to wait for a free slot (defaults to pool timeout)
+            max_retries (int): Connection attempts when a new connection must be opened
+
+        Returns:
+            pymysql.Connection or None: Connection object or None if none could be obtained
+        """
+        return self.checkout(timeout, max_retries)[0]
+
+    def checkout(self, timeout=None, max_retries=3):
+        """
+        acquire() that also says why no connection was obtained.
+
+        Returns:
+            tuple: (connection or None, connect_failed) - connect_failed is True
+                when MySQL could not be reached, False when the pool was full
+        """
+        timeout = self.timeout if timeout is None else timeout
+        started = time.monotonic()
+        deadline = started + timeout
+        waited = False
+        recorded = False
+
+        while True:
+            candidate = None
+            with self._lock:
+                while not self._idle and self._total() >= self.max_size:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        if not recorded:
+                            self._record_wait(time.monotonic() - started, waited)
+                        log.warning("DB pool exhausted", extra={"in_use": self.max_size})
+                        return None, False
+                    waited = True
+                    self._lock.wait(remaining)
+
+                if self._idle:
+                    # LIFO keeps the hot connections busy and lets surplus ones age out
+                    candidate = self._idle.pop()
+                # Reserve the slot for either the idle connection or a new one
+                self._in_use += 1
+                if not recorded:
+                    self._record_wait(time.monotonic() - started, waited)
+                    recorded = True
+
+            if candidate is None:
+                break
+
+            conn, created_at = candidate
+            expired = time.monotonic() - created_at > self.max_age
+            if not expired and self._is_alive(conn):
+                return self._checked_out(conn, created_at), False
+            self._close_quietly(conn)
+            with self._lock:
+                if expired:
+                    self._recycled += 1
+                else:
+                    self._dead += 1
+                self._in_use -= 1
+
+        conn = self._open(max_retries=max_retries)
+        if conn is not None:
+            return self._checked_out(conn, time.monotonic()), False
+
+        with self._lock:
+            self._in_use -= 1
+            self._lock.notify()
+        return None, True
+
+    def _record_wait(self, elapsed, waited):
+        # Caller holds the lock
+        if waited:
+            self._waits += 1
+        self._wait_time_total += elapsed
+        self._wait_time_max = max(self._wait_time_max, elapsed)
+
+    def _checked_out(self, conn, created_at):
+        with self._lock:
+            self._checkouts += 1
+            self._created_at[id(conn)] = created_at
+        return conn
+
+    def release(self, conn, discard=False):
+        """
+        Returns a connection to the pool.
+
+        Kept connections are rolled back first: connections are not
+        autocommit, so a caller that only read would otherwise leave its
+        REPEATABLE READ snapshot open and the next checkout would see stale rows.
+
+        Args:
+            conn (pymysql.Connection): Connection previously returned by acquire()
+            discard (bool): Close the connection instead of keeping it idle
+        """
+        if conn is None:
+            return
+        if not discard and conn.open:
+            try:
+                conn.rollback()
+            except Exception:
+                discard = True
+        with self._lock:
+            created_at = self._created_at.pop(id(conn), time.monotonic())
+            self._in_use = max(self._in_use - 1, 0)
+            expired = time.monotonic() - created_at > self.max_age
+            keep = not discard and not expired and conn.open
+            if keep:
+                self._idle.append((conn, created_at))
+            elif expired:
+                self._recycled += 1
+            self._lock.notify()
+        if not keep:
+            self._close_quietly(conn)
+
+    def close_all(self):
+        """Closes every idle connection (checked-out ones are closed on release)."""
+        with self._lock:
+            idle = list(self._idle)
+            self._idle.clear()
+        for conn, _ in idle:
+            self._close_quietly(conn)
+
+    def stats(self):
+        """Returns a snapshot of pool metrics."""
+        with self._lock:
+            checkouts = self._checkouts
+            return {
+                "in_use": self._in_use,
+                "idle": len(self._idle),
+                "min_size": self.min_size,
+                "max_size": self.max_size,
+                "checkouts": checkouts,
+                "waits": self._waits,
+                "wait_time_avg_ms": round(self._wait_time_total / checkouts * 1000, 3) if checkouts else 0.0,
+                "wait_time_max_ms": round(self._wait_time_max * 1000, 3),
+                "recycled": self._recycled,
+                "dead_on_checkout": self._dead,
+                "connect_failures": self._connect_failures,
+            }
+
+
+db_pool = ConnectionPool()
+
+
+@contextmanager
+def db_connection(timeout=None, max_retries=3):
+    """
+    Checks a connection out of the shared pool for the duration of a with-block.
+    Yields None if no connection could be obtained. Uncommitted work is rolled
+    back on return (commit writes inside the block), and the connection is
+    discarded if the block raises.
+    """
+    with _pooled(timeout, max_retries) as (conn, _):
+        yield conn
+
+
+@contextmanager
+def _pooled(timeout=None, max_retries=3):
+    # db_connection(), yielding (conn, connect_failed) as ConnectionPool.checkout() returns
+    conn, connect_failed = db_pool.checkout(timeout=timeout, max_retries=max_retries)
+    try:
+        yield conn, connect_failed
+    except Exception:
+        if conn is not None:
+            try:
+                conn.rollback()
+            except Exception:
+                pass
+            db_pool.release(conn, discard=True)
+            conn = None
+        raise
+    finally:
+        if conn is not None:
+            db_pool.release(conn)
+
+
+def get_pool_stats():
+    """Returns the shared pool's metrics (in-use, idle, wait time)."""
+    return db_pool.stats()
+
+
+# --- Async access ---
+# pymysql is blocking, so DB work runs on a bounded executor sized to the pool.
+# Every executor thread holds at most one connection, so threads never queue on
+# the pool itself, and retry backoff happens with asyncio.sleep on the loop.
+
+_db_executor = ThreadPoolExecutor(max_workers=db_pool.max_size, thread_name_prefix="db")
+_NO_CONNECTION = object()
+_CIRCUIT_OPEN = object()
+
+
+class DatabaseUnavailableError(Exception):
+    """Raised when no pooled connection could be obtained after all retries, or the DB circuit is open."""
+
+
+db_breaker = get_breaker("db", DB_SLOW_CALL_SECONDS)
+
+
+def _call_with_connection(fn, args, kwargs, long_running):
+    # The breaker sees MySQL's side only: connect failures, lost connections and query time.
+    # A full pool is this process's own saturation and is not recorded.
+    if not db_breaker.allow():
+        return _CIRCUIT_OPEN
+    started = time.perf_counter()
+    with _pooled(max_retries=1) as (conn, connect_failed):
+        observe_stage("db.acquire", time.perf_counter() - started)
+        if conn is None:
+            if connect_failed:
+                db_breaker.record(0.0, failed=True)
+            else:
+                db_breaker.skip()
+            return _NO_CONNECTION
+        query_started = time.monotonic()
+        failed = False
+        try:
+            with stage("db.query", query=fn.__name__):
+                return fn(conn, *args, **kwargs)
+        except (pymysql.err.OperationalError, pymysql.err.InterfaceError):
+            failed = True  # lost connection / server gone (other errors are the query's fault)
+            raise
+        finally:
+            elapsed = time.monotonic() - query_started
+            db_breaker.record(0.0 if long_running and not failed else elapsed, failed=failed)
+
+
+async def run_db(fn, *args, max_retries=3, deadline=None, long_running=False, **kwargs):
+    """
+    Runs fn(conn, *args, **kwargs) with a pooled connection on the DB executor.
+
+    Args:
+        fn (callable): Blocking function taking a connection as first argument
+        max_retries (int): Connection attempts, with async exponential backoff between them
+        deadline (app.deadline.Deadline): Request budget; no wait or backoff runs past it.
+            On expiry the statement still completes in the background.
+        long_running (bool): fn is expected to run long (exports, batch work); its
+            duration is not counted towards the DB circuit breaker's slow calls
+
+    Returns:
+        Whatever fn returns
+
+    Raises:
+        DatabaseUnavailableError: If no connection could be obtained, or the
+            DB circuit breaker is open (raised at once, without waiting)
+    """
+    loop = asyncio.get_running_loop()
+    for attempt in range(max_retries):
+        if db_breaker.retry_after():
+            raise DatabaseUnavailableError(f"Database circuit open, not running {fn.__name__}")
+        call = loop.run_in_executor(_db_executor, partial(_call_with_connection, fn, args, kwargs, long_running))
+        if deadline is None:
+            result = await call
+        else:
+            try:
+                result = await deadline.run(call, stage="db")
+            except asyncio.TimeoutError:
+                raise DatabaseUnavailableError(f"Request deadline exceeded waiting for {fn.__name__}")
+        if result is _CIRCUIT_OPEN:
+            raise DatabaseUnavailableError(f"Database circuit open, not running {fn.__name__}")
+        if result is not _NO_CONNECTION:
+            return result
+
+        if attempt < max_retries - 1:
+            wait_time = 2 ** attempt  # Exponential backoff: 1s, 2s, 4s
+            if deadline is not None and deadline.remaining() <= wait_time:
+                break
+            log.warning("DB unavailable, retrying in %ss", wait_time, extra={"query": fn.__name__})
+            await asyncio.sleep(wait_time)
+
+    raise DatabaseUnavailableError(f"No database connection after {max_retries} attempts")
+
+
+def shutdown_db():
+    """Closes idle pooled connections and stops the DB executor."""
+    db_pool.close_all()
+    _db_executor.shutdown(wait=False)
@@ -0,0 +1,46 @@
+# Per-request time budget threaded through every stage of a webhook turn.
+# Dialogflow ES abandons a webhook call after ~5 seconds, so no stage may run past it.
+import asyncio
+import os
+import time
+from app.config import load_env
+from app.metrics import Counter, register_metric
+
+load_env()
+
+# Configuration
+WEBHOOK_BUDGET = float(os.getenv("WEBHOOK_BUDGET_SECONDS", 4.0))
+WEBHOOK_REPLY_RESERVE = float(os.getenv("WEBHOOK_REPLY_RESERVE_SECONDS", 0.3))  # kept back to build and send the reply
+
+deadline_exceeded = register_metric(Counter(
+    "webhook_deadline_exceeded_total", "Stages abandoned because the request's time budget ran out"
+))
+
+
+class Deadline:
+    """Absolute expiry for one request; stages ask it how long they may still take."""
+
+    def __init__(self, budget=WEBHOOK_BUDGET, reserve=WEBHOOK_REPLY_RESERVE):
+        self.expires_at = time.monotonic() + budget
+        self.reserve = reserve
+
+    def remaining(self):
+        """Seconds left for work, after the reply reserve."""
+        return max(self.expires_at - time.monotonic() - self.reserve, 0.0)
+
+    @property
+    def expired(self):
+        return self.remaining() <= 0
+
+    async def run(self, awaitable, stage):
+        """
+        Awaits within the remaining budget.
+
+        Raises:
+            asyncio.TimeoutError: When the budget runs out first (counted per stage)
+        """
+        try:
+            return await asyncio.wait_for(awaitable, self.remaining())
+        except asyncio.TimeoutError:
+            deadline_exceeded.inc(stage=stage)
+            raise
@@ -0,0 +1,313 @@
+# Shared rate limiting, concurrency caps and 429-aware retries for every Groq call
+# (vision client in image_processor, chat model in langchain_helper).
+import asyncio
+import json
+import os
+import random
+import sqlite3
+import threading
+import time
+import groq
+from app.config import load_env
+from app.metrics import stage
+from app.circuit_breaker import get_breaker, CircuitOpenError
+from app.logger import get_logger
+
+load_env()
+
+log = get_logger(__name__)
+
+# Configuration
+GROQ_GOVERNOR_DB = os.getenv(
+    "GROQ_GOVERNOR_DB",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "groq_governor.sqlite3")
+)
+GROQ_MAX_RETRIES = int(os.getenv("GROQ_MAX_RETRIES", 3))
+GROQ_BACKOFF_BASE = float(os.getenv("GROQ_BACKOFF_BASE", 1.0))  # seconds, doubled per retry
+GROQ_MAX_QUEUE_DEPTH = int(os.getenv("GROQ_MAX_QUEUE_DEPTH", 50))  # waiting callers per model before shedding
+
+# Per-model quotas: requests/min, tokens/min and in-flight calls per process, plus the latency
+# (seconds) the model's circuit breaker counts as slow.
+# Override with GROQ_MODEL_LIMITS='{"model": {"rpm": 30, "tpm": 6000, "concurrency": 4, "slow_call": 10}}'
+DEFAULT_LIMITS = {"rpm": 30, "tpm": 6000, "concurrency": 4, "slow_call": 10}
+MODEL_LIMITS = {
+    "meta-llama/llama-4-scout-17b-16e-instruct": {"rpm": 30, "tpm": 30000, "concurrency": 4, "slow_call": 20},
+    "llama-3.1-8b-instant": {"rpm": 30, "tpm": 6000, "concurrency": 8, "slow_call": 3},
+}
+MODEL_LIMITS.update(json.loads(os.getenv("GROQ_MODEL_LIMITS", "{}")))
+
+RETRYABLE_STATUS = {429, 500, 502, 503, 504}
+
+
+class GroqOverloadedError(Exception):
+    """Raised instead of queueing when too many calls are already waiting (load shedding)."""
+    status_code = 503
+
+
+def limits_for(model):
+    return {**DEFAULT_LIMITS, **MODEL_LIMITS.get(model, {})}
+
+
+class SharedBuckets:
+    """
+    Token buckets kept in a local SQLite file so that every gunicorn worker on
+    the host draws from the same quota. Each take() is one short
+    BEGIN IMMEDIATE transaction, which serializes workers through SQLite's
+    file lock.
+    """
+
+    def __init__(self, path=GROQ_GOVERNOR_DB):
+        self.path = path
+        self._local = threading.local()
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with self._connect() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS buckets ("
+                "name TEXT PRIMARY KEY, level REAL NOT NULL, updated_at REAL NOT NULL)"
+            )
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS cooldowns (model TEXT PRIMARY KEY, until REAL NOT NULL)"
+            )
+
+    def _connect(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            self._local.conn = conn
+        return conn
+
+    def _refilled(self, conn, name, capacity, refill_per_s, now):
+        row = conn.execute("SELECT level, updated_at FROM buckets WHERE name = ?", (name,)).fetchone()
+        return capacity if row is None else min(capacity, row[0] + (now - row[1]) * refill_per_s)
+
+    def _store(self, conn, name, level, now):
+        conn.execute(
+            "INSERT INTO buckets (name, level, updated_at) VALUES (?, ?, ?) "
+            "ON CONFLICT(name) DO UPDATE SET level = excluded.level, updated_at = excluded.updated_at",
+            (name, level, now)
+        )
+
+    def acquire(self, model, tokens, rpm, tpm):
+        """
+        Atomically takes one request and `tokens` tokens for a model, unless
+        the model is cooling down after a 429 or either bucket is short.
+        With tokens=0 (a retry, whose tokens were charged by the first
+        attempt) only the request slot is needed.
+
+        Returns:
+            float: 0 when taken, otherwise seconds to wait before trying again
+        """
+        conn = self._connect()
+        now = time.time()
+        tokens = min(tokens, tpm)  # an oversized request waits for a full bucket, never forever
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute("SELECT until FROM cooldowns WHERE model = ?", (model,)).fetchone()
+            if row and row[0] > now:
+                wait = row[0] - now
+            else:
+                requests_level = self._refilled(conn, f"{model}:requests", rpm, rpm / 60, now)
+                tokens_level = self._refilled(conn, f"{model}:tokens", tpm, tpm / 60, now)
+                tokens_wait = (tokens - tokens_level) / (tpm / 60) if tokens else 0.0
+                wait = max((1 - requests_level) / (rpm / 60), tokens_wait, 0.0)
+                if not wait:
+                    requests_level -= 1
+                    tokens_level -= tokens
+                self._store(conn, f"{model}:requests", requests_level, now)
+                self._store(conn, f"{model}:tokens", tokens_level, now)
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return wait
+
+    def adjust(self, name, delta, capacity):
+        """Refunds (delta > 0) or charges (delta < 0) a bucket once actual usage is known."""
+        conn = self._connect()
+        conn.execute(
+            "UPDATE buckets SET level = MIN(?, level + ?) WHERE name = ?",
+            (capacity, delta, name)
+        )
+
+    def set_cooldown(self, model, seconds):
+        conn = self._connect()
+        conn.execute(
+            "INSERT INTO cooldowns (model, until) VALUES (?, ?) "
+            "ON CONFLICT(model) DO UPDATE SET until = MAX(until, excluded.until)",
+            (model, time.time() + seconds)
+        )
+
+
+def _retry_after(error):
+    """Seconds from a Retry-After / retry-after-ms header on a Groq error, if any."""
+    response = getattr(error, "response", None)
+    headers = getattr(response, "headers", None) or {}
+    try:
+        if headers.get("retry-after-ms"):
+            return float(headers["retry-after-ms"]) / 1000
+        if headers.get("retry-after"):
+            return float(headers["retry-after"])
+    except (TypeError, ValueError):
+        pass
+    return None
+
+
+class GroqGovernor:
+    """
+    Every Groq call goes through call(): it takes a request token and an
+    estimated number of LLM tokens from the shared buckets (waiting for a
+    refill if needed), holds a per-model concurrency slot, and retries
+    429/5xx responses honouring Retry-After with jittered exponential backoff.
+    Each retry takes another request token but no further LLM tokens.
+    When more than max_queue_depth callers are already waiting for a model,
+    new calls are shed with GroqOverloadedError instead of piling up. Each
+    model has a circuit breaker fed by every attempt: while it is open,
+    calls fail at once with CircuitOpenError.
+    """
+
+    def __init__(self, buckets=None, max_retries=GROQ_MAX_RETRIES, backoff_base=GROQ_BACKOFF_BASE,
+                 max_queue_depth=GROQ_MAX_QUEUE_DEPTH):
+        self._buckets = buckets
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.max_queue_depth = max_queue_depth
+        self._semaphores = {}
+        self._waiting = {}
+        self._lock = threading.Lock()
+        self._stats = {"calls": 0, "throttled": 0, "shed": 0, "short_circuited": 0, "retries": 0,
+                       "rate_limited": 0, "errors": 0}
+
+    @property
+    def buckets(self):
+        if self._buckets is None:
+            self._buckets = SharedBuckets()
+        return self._buckets
+
+    def _count(self, name, n=1):
+        with self._lock:
+            self._stats[name] += n
+
+    def breaker(self, model):
+        return get_breaker(f"groq:{model}", limits_for(model)["slow_call"])
+
+    def _semaphore(self, model):
+        if model not in self._semaphores:
+            self._semaphores[model] = asyncio.Semaphore(limits_for(model)["concurrency"])
+        return self._semaphores[model]
+
+    async def _acquire_quota(self, model, tokens, deadline):
+        limits = limits_for(model)
+        with stage("groq.quota_wait", model=model):
+            await self._wait_for_quota(model, tokens, limits, deadline)
+
+    async def _wait_for_quota(self, model, tokens, limits, deadline):
+        while True:
+            wait = await asyncio.to_thread(self.buckets.acquire, model, tokens, limits["rpm"], limits["tpm"])
+            if not wait:
+                return
+            if time.monotonic() + wait > deadline:
+                self._count("shed")
+                raise GroqOverloadedError(f"Groq quota for {model} exhausted (next slot in {wait:.1f}s)")
+            self._count("throttled")
+            await asyncio.sleep(wait + random.uniform(0, 0.05))
+
+    async def call(self, model, request, estimated_tokens=1000, usage_of=None, max_wait=30.0, max_retries=None):
+        """
+        Runs request() (a zero-argument coroutine factory) under the model's quota.
+
+        Args:
+            model (str): Groq model name (selects limits and buckets)
+            request (callable): Returns a new awaitable for each attempt
+            estimated_tokens (int): Tokens charged up front (prompt + max completion)
+            usage_of (callable): Extracts actual total tokens from the response to settle the estimate
+            max_wait (float): Most seconds this call may spend waiting for quota or backoff
+            max_retries (int): Overrides the governor-wide retry count
+
+        Raises:
+            GroqOverloadedError: When the call is shed instead of queued
+            CircuitOpenError: When the model's circuit breaker is open
+        """
+        max_retries = self.max_retries if max_retries is None else max_retries
+        deadline = time.monotonic() + max_wait
+        limits = limits_for(model)
+        breaker = self.breaker(model)
+        retry_after = breaker.retry_after()
+        if retry_after:
+            self._count("short_circuited")
+            raise CircuitOpenError(breaker.name, retry_after)
+
+        with self._lock:
+            if self._waiting.get(model, 0) >= self.max_queue_depth:
+                self._stats["shed"] += 1
+                raise GroqOverloadedError(f"Too many queued Groq calls for {model}")
+            self._waiting[model] = self._waiting.get(model, 0) + 1
+            self._stats["calls"] += 1
+
+        try:
+            attempt = 0
+            while True:
+                # The estimate is charged once per call (settled below); a retry takes only a request slot
+                await self._acquire_quota(model, 0 if attempt else estimated_tokens, deadline)
+                delay = None
+                async with self._semaphore(model):
+                    if not breaker.allow():
+                        self._count("short_circuited")
+                        raise CircuitOpenError(breaker.name, breaker.retry_after())
+                    started, failed, timed_out = time.monotonic(), False, True
+                    try:
+                        response = await request()
+                        timed_out = False
+                    except Exception as e:
+                        timed_out = False
+                        status = getattr(e, "status_code", None)
+                        # APITimeoutError is an APIConnectionError, so timeouts are retried too
+                        retryable = status in RETRYABLE_STATUS or isinstance(e, groq.APIConnectionError)
+                        # 429 is our quota, not an outage; 4xx is the request's fault
+                        failed = (retryable and status != 429) or isinstance(e, groq.APITimeoutError)
+                        if status == 429:
+                            self._count("rate_limited")
+                        if not retryable or attempt >= max_retries:
+                            self._count("errors")
+                            raise
+                        delay = max(_retry_after(e) or 0, self.backoff_base * (2 ** attempt))
+                        delay *= random.uniform(1.0, 1.5)  # jitter so workers don't retry in lockstep
+                        if time.monotonic() + delay > deadline:
+                            self._count("errors")
+                            raise
+                        if status == 429:
+                            # Every worker on the host holds off this model until the cooldown ends
+                            await asyncio.to_thread(self.buckets.set_cooldown, model, delay)
+                        log.warning("Groq %s, retrying in %.1fs", status or type(e).__name__, delay,
+                                    extra={"model": model, "attempt": attempt + 1, "max_retries": max_retries})
+                    finally:
+                        # timed_out: the caller gave up on the attempt (its deadline), counted as slow
+                        breaker.record(time.monotonic() - started, failed=failed, timed_out=timed_out)
+                if delay is None:
+                    break
+                attempt += 1
+                self._count("retries")
+                await asyncio.sleep(delay)
+
+            if usage_of:
+                actual = usage_of(response)
+                if actual:
+                    await asyncio.to_thread(self.buckets.adjust, f"{model}:tokens",
+                                            estimated_tokens - actual, limits["tpm"])
+            return response
+        finally:
+            with self._lock:
+                self._waiting[model] -= 1
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats["waiting"] = dict(self._waiting)
+        return stats
+
+
+governor = GroqGovernor()
+
+
+def get_governor_stats():
+    return governor.stats()
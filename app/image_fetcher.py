@@ -0,0 +1,343 @@
+# Server-side download of image URLs sent in the chat, so they go through the same
+# local-file path (preprocessing, content-hash cache) as uploaded photos.
+import asyncio
+import hashlib
+import ipaddress
+import json
+import os
+import socket
+import time
+from typing import NamedTuple
+from urllib.parse import urljoin, urlsplit
+import httpcore
+import httpx
+from app.config import load_env
+from app.upload_helper import sniff_image_format, MAX_UPLOAD_BYTES, UPLOAD_CHUNK_SIZE, SNIFF_BYTES
+
+load_env()
+
+# Configuration
+IMAGE_FETCH_CACHE_DIR = os.getenv(
+    "IMAGE_FETCH_CACHE_DIR",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "url_cache")
+)
+IMAGE_FETCH_MAX_BYTES = int(os.getenv("IMAGE_FETCH_MAX_BYTES", MAX_UPLOAD_BYTES))
+IMAGE_FETCH_CONNECT_TIMEOUT = float(os.getenv("IMAGE_FETCH_CONNECT_TIMEOUT", 3))
+IMAGE_FETCH_READ_TIMEOUT = float(os.getenv("IMAGE_FETCH_READ_TIMEOUT", 10))  # between chunks
+IMAGE_FETCH_TOTAL_TIMEOUT = float(os.getenv("IMAGE_FETCH_TOTAL_TIMEOUT", 20))  # whole download
+IMAGE_FETCH_MAX_CONNECTIONS = int(os.getenv("IMAGE_FETCH_MAX_CONNECTIONS", 20))
+IMAGE_FETCH_MAX_REDIRECTS = int(os.getenv("IMAGE_FETCH_MAX_REDIRECTS", 3))
+IMAGE_FETCH_FRESH_FOR = float(os.getenv("IMAGE_FETCH_FRESH_FOR", 300))  # seconds a cached copy is used without revalidating
+IMAGE_FETCH_CACHE_TTL = float(os.getenv("IMAGE_FETCH_CACHE_TTL", 7 * 24 * 3600))  # pruned after this
+# Only for local testing (e.g. benchmarks serving images from 127.0.0.1); never in production
+IMAGE_FETCH_ALLOW_PRIVATE = os.getenv("IMAGE_FETCH_ALLOW_PRIVATE", "false").lower() == "true"
+
+
+class ImageFetchError(Exception):
+    """Raised when a URL can't be turned into a local image; retryable marks transient failures."""
+
+    def __init__(self, message, retryable=False):
+        super().__init__(message)
+        self.retryable = retryable
+
+
+class FetchedImage(NamedTuple):
+    path: str
+    sha256: str
+    size: int
+    format: str
+    from_cache: bool
+
+
+# --- Disk cache (one image + one metadata file per URL) ---
+
+def _cache_paths(url):
+    key = hashlib.sha256(url.strip().encode("utf-8")).hexdigest()
+    base = os.path.join(IMAGE_FETCH_CACHE_DIR, key)
+    return f"{base}.img", f"{base}.json"
+
+
+def _read_meta(meta_path, image_path):
+    try:
+        with open(meta_path, "r", encoding="utf-8") as f:
+            meta = json.load(f)
+    except (OSError, ValueError):
+        return None
+    return meta if os.path.exists(image_path) else None
+
+
+def _write_meta(meta_path, meta):
+    part_path = f"{meta_path}.{os.getpid()}.part"
+    with open(part_path, "w", encoding="utf-8") as f:
+        json.dump(meta, f)
+    os.replace(part_path, meta_path)
+
+
+def prune_fetch_cache(max_age=IMAGE_FETCH_CACHE_TTL):
+    """Deletes cached downloads not revalidated for max_age seconds. Blocking."""
+    if not os.path.isdir(IMAGE_FETCH_CACHE_DIR):
+        return 0
+    cutoff = time.time() - max_age
+    removed = 0
+    for entry in os.scandir(IMAGE_FETCH_CACHE_DIR):
+        if entry.is_file() and entry.stat().st_mtime < cutoff:
+            try:
+                os.remove(entry.path)
+                removed += 1
+            except OSError:
+                pass
+    return removed
+
+
+# --- URL validation ---
+
+async def _check_url(url):
+    """
+    Allows only well-formed http(s) URLs. Where the host may point is checked
+    when connecting (PublicAddressBackend), against the addresses actually used.
+    """
+    try:
+        parts = urlsplit(url)
+        hostname, port = parts.hostname, parts.port  # .port raises for out-of-range or malformed ports
+    except ValueError:
+        raise ImageFetchError("Invalid image URL.")
+    if parts.scheme not in ("http", "https") or not hostname:
+        raise ImageFetchError("Only http(s) image URLs are supported.")
+    try:
+        hostname.encode("idna")
+    except UnicodeError:
+        raise ImageFetchError("Invalid image URL.")  # e.g. a host name label longer than 63 characters
+
+
+async def _resolve_public(host, port):
+    """The host's addresses, if every one of them is public (no SSRF into our network)."""
+    try:
+        infos = await asyncio.get_running_loop().getaddrinfo(host, port, type=socket.SOCK_STREAM)
+    except socket.gaierror:
+        raise ImageFetchError(f"Could not resolve {host}.", retryable=True)
+    except UnicodeError:
+        raise ImageFetchError("Invalid image URL.")
+    addresses = [info[4][0] for info in infos]
+    for address in addresses:
+        if not ipaddress.ip_address(address.split("%")[0]).is_global:
+            raise ImageFetchError("Image URL points to a non-public address.")
+    return addresses
+
+
+class PublicAddressBackend(httpcore.AsyncNetworkBackend):
+    """
+    httpcore network backend that resolves the host itself, checks the
+    addresses and connects to one of those same addresses. A host that
+    re-resolves to a private address between a check and the connect
+    (DNS rebinding) can't slip through, on the first request or any redirect
+    hop. The Host header and TLS SNI/certificate check still use the URL's
+    host name, which httpcore takes from the request, not from the socket.
+    """
+
+    def __init__(self, allow_private=IMAGE_FETCH_ALLOW_PRIVATE):
+        self.allow_private = allow_private
+        self._backend = httpcore.AnyIOBackend()
+
+    async def connect_tcp(self, host, port, timeout=None, local_address=None, socket_options=None):
+        if self.allow_private:
+            addresses = [host]
+        else:
+            addresses = await _resolve_public(host, port)
+        error = None
+        for address in addresses:
+            try:
+                return await self._backend.connect_tcp(address, port, timeout=timeout, local_address=local_address,
+                                                       socket_options=socket_options)
+            except (httpcore.ConnectError, httpcore.ConnectTimeout) as e:
+                error = e
+        raise error
+
+    async def connect_unix_socket(self, path, timeout=None, socket_options=None):
+        raise ImageFetchError("Image URLs can't use unix sockets.")
+
+    async def sleep(self, seconds):
+        await self._backend.sleep(seconds)
+
+
+# --- Fetcher ---
+
+class ImageFetcher:
+    """
+    Downloads image URLs with one pooled keep-alive client.
+
+    Responses are streamed to disk with a size cap, a magic-byte format
+    check and an incremental SHA-256. Downloads are cached per URL with their
+    ETag / Last-Modified, so a repeat fetch is a conditional GET (304 reuses
+    the cached file), or no request at all within fresh_for seconds.
+    Concurrent fetches of the same URL share one download (single-flight).
+    """
+
+    def __init__(self, max_bytes=IMAGE_FETCH_MAX_BYTES, fresh_for=IMAGE_FETCH_FRESH_FOR):
+        self.max_bytes = max_bytes
+        self.fresh_for = fresh_for
+        self._client = None
+        self._inflight = {}  # url -> asyncio.Task
+        self._stats = {"downloads": 0, "revalidated": 0, "fresh_hits": 0, "shared": 0, "errors": 0, "bytes": 0}
+
+    @property
+    def client(self):
+        if self._client is None:
+            transport = httpx.AsyncHTTPTransport(limits=httpx.Limits(
+                max_connections=IMAGE_FETCH_MAX_CONNECTIONS, max_keepalive_connections=IMAGE_FETCH_MAX_CONNECTIONS
+            ))
+            # httpx has no public option for the network backend; every new connection goes through it
+            transport._pool._network_backend = PublicAddressBackend()
+            self._client = httpx.AsyncClient(
+                transport=transport,
+                timeout=httpx.Timeout(IMAGE_FETCH_READ_TIMEOUT, connect=IMAGE_FETCH_CONNECT_TIMEOUT),
+                follow_redirects=False,  # redirects are followed by hand so every hop is validated
+                headers={"User-Agent": "InsuranceClaimAgent/1.0", "Accept": "image/jpeg,image/png,image/webp"},
+            )
+        return self._client
+
+    async def close(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    async def fetch(self, url):
+        """
+        Returns the image behind url as a local file.
+
+        Raises:
+            ImageFetchError: Invalid/blocked URL, HTTP error, unsupported format or too large
+        """
+        task = self._inflight.get(url)
+        if task is None:
+            task = asyncio.create_task(self._fetch(url))
+            self._inflight[url] = task
+            task.add_done_callback(lambda _: self._inflight.pop(url, None))
+        else:
+            self._stats["shared"] += 1
+        # shield: one caller giving up (e.g. its webhook deadline) doesn't cancel the shared download
+        return await asyncio.shield(task)
+
+    async def _fetch(self, url):
+        image_path, meta_path = _cache_paths(url)
+        meta = await asyncio.to_thread(_read_meta, meta_path, image_path)
+        if meta and time.time() - meta["checked_at"] < self.fresh_for:
+            self._stats["fresh_hits"] += 1
+            return FetchedImage(image_path, meta["sha256"], meta["size"], meta["format"], from_cache=True)
+
+        try:
+            result = await asyncio.wait_for(self._download(url, image_path, meta_path, meta),
+                                            IMAGE_FETCH_TOTAL_TIMEOUT)
+        except asyncio.TimeoutError:
+            self._stats["errors"] += 1
+            raise ImageFetchError(f"Image download took longer than {IMAGE_FETCH_TOTAL_TIMEOUT:.0f}s.", retryable=True)
+        except (httpx.InvalidURL, httpx.UnsupportedProtocol) as e:
+            self._stats["errors"] += 1
+            raise ImageFetchError(f"Invalid image URL: {e}")
+        except httpx.HTTPError as e:
+            self._stats["errors"] += 1
+            raise ImageFetchError(f"Image download failed: {type(e).__name__}", retryable=True)
+        except ImageFetchError:
+            self._stats["errors"] += 1
+            raise
+        return result
+
+    async def _download(self, url, image_path, meta_path, meta):
+        headers = {}
+        if meta:
+            if meta.get("etag"):
+                headers["If-None-Match"] = meta["etag"]
+            if meta.get("last_modified"):
+                headers["If-Modified-Since"] = meta["last_modified"]
+
+        target = url
+        for _ in range(IMAGE_FETCH_MAX_REDIRECTS + 1):
+            await _check_url(target)
+            async with self.client.stream("GET", target, headers=headers) as response:
+                if response.has_redirect_location:
+                    target = urljoin(target, response.headers.get("location", ""))
+                    continue
+
+                if response.status_code == 304 and meta:
+                    self._stats["revalidated"] += 1
+                    meta["checked_at"] = time.time()
+                    await asyncio.to_thread(_write_meta, meta_path, meta)
+                    await asyncio.to_thread(os.utime, image_path)
+                    return FetchedImage(image_path, meta["sha256"], meta["size"], meta["format"], from_cache=True)
+
+                if response.status_code != 200:
+                    retryable = response.status_code == 429 or response.status_code >= 500
+                    raise ImageFetchError(f"Image URL returned HTTP {response.status_code}.", retryable=retryable)
+
+                declared = response.headers.get("content-length")
+                if declared and declared.isdigit() and int(declared) > self.max_bytes:
+                    raise ImageFetchError(f"Image too large. Maximum size is {self.max_bytes // (1024 * 1024)}MB.")
+
+                sha256, size, image_format = await self._stream_to_file(response, image_path)
+                new_meta = {
+                    "url": url, "sha256": sha256, "size": size, "format": image_format,
+                    "etag": response.headers.get("etag"),
+                    "last_modified": response.headers.get("last-modified"),
+                    "checked_at": time.time(),
+                }
+                await asyncio.to_thread(_write_meta, meta_path, new_meta)
+                self._stats["downloads"] += 1
+                self._stats["bytes"] += size
+                return FetchedImage(image_path, sha256, size, image_format, from_cache=False)
+
+        raise ImageFetchError(f"Too many redirects (more than {IMAGE_FETCH_MAX_REDIRECTS}).")
+
+    async def _stream_to_file(self, response, image_path):
+        """Writes the body to image_path via a '.part' file; returns (sha256, size, format)."""
+        os.makedirs(IMAGE_FETCH_CACHE_DIR, exist_ok=True)
+        part_path = f"{image_path}.{os.getpid()}.part"  # unique per gunicorn worker
+        hasher = hashlib.sha256()
+        size = 0
+        header = b""
+        image_format = None
+
+        out = await asyncio.to_thread(open, part_path, "wb")
+        try:
+            async for chunk in response.aiter_bytes(UPLOAD_CHUNK_SIZE):
+                if image_format is None:
+                    header += chunk[:SNIFF_BYTES - len(header)]
+                    if len(header) >= SNIFF_BYTES:
+                        image_format = sniff_image_format(header)
+                        if image_format is None:
+                            raise ImageFetchError("URL does not point to a JPEG, PNG or WEBP image.")
+
+                size += len(chunk)
+                if size > self.max_bytes:
+                    raise ImageFetchError(f"Image too large. Maximum size is {self.max_bytes // (1024 * 1024)}MB.")
+
+                hasher.update(chunk)
+                await asyncio.to_thread(out.write, chunk)
+
+            if image_format is None:
+                image_format = sniff_image_format(header)
+                if image_format is None:
+                    raise ImageFetchError("URL does not point to a JPEG, PNG or WEBP image.")
+
+            await asyncio.to_thread(out.close)
+            await asyncio.to_thread(os.replace, part_path, image_path)
+        except BaseException:
+            out.close()
+            try:
+                os.remove(part_path)
+            except OSError:
+                pass
+            raise
+        return hasher.hexdigest(), size, image_format
+
+    def stats(self):
+        return {**self._stats, "inflight": len(self._inflight)}
+
+
+image_fetcher = ImageFetcher()
+
+
+async def fetch_image(url):
+    return await image_fetcher.fetch(url)
+
+
+def get_fetch_stats():
+    return image_fetcher.stats()
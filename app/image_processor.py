@@ -1,91 +1,405 @@
+import asyncio
 import base64
+import json
 import os
-from groq import Groq
-from dotenv import load_dotenv
-from PIL import Image
+import threading
+import time
+from io import BytesIO
+from typing import NamedTuple, Optional
+from app.config import load_env, lazy, get_settings
+from PIL import Image, ImageOps
+from app.vision_cache import vision_cache, hash_bytes
+from app.groq_governor import governor
+from app.metrics import stage
+from app.schemas import DamageReport
+from app.damage_report import parse_damage_report, format_damage_report
+from app.logger import get_logger
+from app.storage import storage, key_from_ref, STORAGE_REF_PREFIX
 
-# Load environment variables (API Key)
-load_dotenv()
+# Load environment variables
+load_env()
 
-client = Groq(api_key=os.getenv("GROQ_API_KEY"))
+log = get_logger(__name__)
+
+@lazy
+def get_vision_client():
+    """Groq SDK client, built on first use (importing groq is a large share of cold start)."""
+    from groq import AsyncGroq
+    settings = get_settings()
+    # Retries are owned by the governor (Retry-After aware, shared quota), not the SDK
+    return AsyncGroq(api_key=settings.groq_api_key, base_url=settings.groq_base_url, max_retries=0)
 
 # Configuration
 MAX_FILE_SIZE_MB = 10
 ALLOWED_FORMATS = {'JPEG', 'JPG', 'PNG', 'WEBP'}
 
-def analyze_car_damage(image_input):
+# Preprocessing (trade payload size / latency against OCR accuracy for plate extraction)
+VISION_MAX_DIMENSION = int(os.getenv("VISION_MAX_DIMENSION", 1536))  # longest edge in pixels
+VISION_OUTPUT_FORMAT = os.getenv("VISION_OUTPUT_FORMAT", "JPEG").upper().replace("JPG", "JPEG")  # JPEG or WEBP
+VISION_IMAGE_QUALITY = int(os.getenv("VISION_IMAGE_QUALITY", 85))
+VISION_MAX_TOKENS = 512
+VISION_ESTIMATED_IMAGE_TOKENS = int(os.getenv("VISION_ESTIMATED_IMAGE_TOKENS", 1500))  # charged up front, settled from usage
+MIME_TYPES = {'JPEG': 'image/jpeg', 'JPG': 'image/jpeg', 'PNG': 'image/png', 'WEBP': 'image/webp'}
+EXIF_ORIENTATION_TAG = 0x0112
+
+VISION_MODEL = "meta-llama/llama-4-scout-17b-16e-instruct" # Updated to 2026 stable Llama 4 Vision model
+# Bump PROMPT_VERSION whenever VISION_PROMPT changes so cached results are not reused
+PROMPT_VERSION = "v2"
+VISION_PROMPT = (
+    "Analyze this vehicle incident photo for an insurance claim. "
+    "1. Extract the License Plate number if visible. "
+    "2. Rate the damage severity as Low, Medium, or High. "
+    "3. Provide a concise technical description of the visible damage. "
+    "Respond with a JSON object only, with the keys: "
+    '"license_plate" (string, or null if not visible), "severity" ("Low", "Medium" or "High"), '
+    '"description" (string) and "confidence" (number from 0 to 1 for your overall certainty).'
+)
+# Cache entries are also scoped by the preprocessing settings, since they change what the model sees
+CACHE_VARIANT = f"{PROMPT_VERSION}:{VISION_OUTPUT_FORMAT.lower()}{VISION_MAX_DIMENSION}q{VISION_IMAGE_QUALITY}"
+
+# Packed requests: several photos of one claim in a single vision call (see app/claim_analysis.py)
+VISION_PACK_MAX_DIMENSION = int(os.getenv("VISION_PACK_MAX_DIMENSION", 768))  # smaller, so N images cost less than N calls
+VISION_PACKED_PROMPT = (
+    "These are {count} photos of the same vehicle incident for an insurance claim. For each photo, in order: "
+    "1. Extract the License Plate number if visible. "
+    "2. Rate the damage severity as Low, Medium, or High. "
+    "3. Provide a concise technical description of the visible damage. "
+    'Respond with a JSON object only: {{"photos": [...]}} with exactly {count} entries, one per photo in the '
+    'order given, each with the keys "license_plate" (string, or null if not visible), '
+    '"severity" ("Low", "Medium" or "High"), "description" (string) and "confidence" (number from 0 to 1).'
+)
+PACKED_CACHE_VARIANT = f"{PROMPT_VERSION}p:{VISION_OUTPUT_FORMAT.lower()}{VISION_PACK_MAX_DIMENSION}q{VISION_IMAGE_QUALITY}"
+
+def is_failed_analysis(result):
+    """True for the error strings analyze_car_damage returns instead of an analysis."""
+    return not result or result.startswith("Error:") or result.startswith("Analysis failed")
+
+def _load_local_image(image_path):
     """
-    Sends a car incident photo to Groq's Llama Vision model.
-    Supports either a local file path or a public image URL.
+    Reads a local image into memory (the only read of the file).
+    Blocking, so callers run it off the event loop.
+
+    Returns:
+        tuple: (raw_bytes, error_message) - exactly one of them is None
+    """
+    # Check file size (max 10MB)
+    file_size_mb = os.path.getsize(image_path) / (1024 * 1024)
+    if file_size_mb > MAX_FILE_SIZE_MB:
+        return None, f"Error: Image too large ({file_size_mb:.1f}MB). Maximum size is {MAX_FILE_SIZE_MB}MB."
+
+    with open(image_path, "rb") as image_file:
+        return image_file.read(), None
+
+async def read_image(image_input):
+    """Raw bytes of a local file or a 'storage://' object; returns (raw_bytes, error_message)."""
+    if image_input.startswith(STORAGE_REF_PREFIX):
+        key = key_from_ref(image_input)
+        path = storage.local_path(key) if key else None
+        if path is None:
+            raw = await storage.read(key) if key else None
+            return (raw, None) if raw is not None else (None, "Error: Image file not found.")
+        image_input = path
+    return await asyncio.to_thread(_load_local_image, image_input)
+
+# --- Preprocessing ---
+
+_payload_lock = threading.Lock()
+_payload_stats = {"images": 0, "bytes_in": 0, "bytes_out": 0, "reencoded": 0, "passthrough": 0}
+
+def _record_payload(bytes_in, bytes_out, reencoded):
+    with _payload_lock:
+        _payload_stats["images"] += 1
+        _payload_stats["bytes_in"] += bytes_in
+        _payload_stats["bytes_out"] += bytes_out
+        _payload_stats["reencoded" if reencoded else "passthrough"] += 1
+
+def get_payload_stats():
+    """Returns cumulative vision payload sizes before and after preprocessing."""
+    with _payload_lock:
+        stats = dict(_payload_stats)
+    stats["reduction_ratio"] = round(1 - stats["bytes_out"] / stats["bytes_in"], 4) if stats["bytes_in"] else 0.0
+    return stats
+
+def preprocess_image(raw, max_dimension=VISION_MAX_DIMENSION, output_format=VISION_OUTPUT_FORMAT,
+                     quality=VISION_IMAGE_QUALITY):
+    """
+    Prepares raw image bytes for the vision model with a single decode:
+    validates the format, applies the EXIF orientation, downscales to
+    max_dimension and re-encodes to a quality-tuned JPEG or WEBP.
+    The original bytes are kept when they are already small enough,
+    upright and in the output format.
+    Blocking (decode + encode), so callers run it off the event loop.
+
+    Returns:
+        tuple: (payload_bytes, mime_type, error_message) - error_message is None on success.
+            A corrupt or truncated file gives a permanent 'Error:' message.
     """
-    is_url = image_input.startswith("http://") or image_input.startswith("https://")
-    
-    if not is_url and not os.path.exists(image_input):
-        return "Error: Image file not found."
-    
+    output_format = output_format.upper().replace("JPG", "JPEG")  # Pillow only knows 'JPEG'
     try:
-        if is_url:
-            image_url_content = image_input
-            print(f"🔍 Analyzing image URL with Groq Vision API...")
+        return _preprocess(raw, max_dimension, output_format, quality)
+    except (OSError, SyntaxError, ValueError, Image.DecompressionBombError) as e:
+        # UnidentifiedImageError and "image file is truncated" are OSErrors; some plugins raise SyntaxError
+        log.warning("Image could not be decoded: %s - %s", type(e).__name__, e)
+        return None, None, "Error: The image could not be decoded (corrupt or unsupported file)."
+
+def _preprocess(raw, max_dimension, output_format, quality):
+    started = time.perf_counter()
+    with Image.open(BytesIO(raw)) as img:
+        source_format = (img.format or "").upper()
+        if source_format not in ALLOWED_FORMATS:
+            return None, None, f"Error: Unsupported format '{img.format}'. Allowed: {', '.join(ALLOWED_FORMATS)}"
+
+        source_size = img.size
+        orientation = img.getexif().get(EXIF_ORIENTATION_TAG, 1)
+        needs_resize = max(source_size) > max_dimension
+        needs_rotate = orientation not in (None, 1)
+
+        if not needs_resize and not needs_rotate and source_format == output_format:
+            _record_payload(len(raw), len(raw), reencoded=False)
+            return raw, MIME_TYPES[source_format], None
+
+        if needs_resize and source_format == 'JPEG':
+            # Let libjpeg decode at a reduced scale instead of full resolution
+            img.draft('RGB', (max_dimension, max_dimension))
+
+        processed = ImageOps.exif_transpose(img)
+        processed.thumbnail((max_dimension, max_dimension), Image.LANCZOS)
+        if processed.mode not in ('RGB', 'L'):
+            processed = processed.convert('RGB')
+
+        buffer = BytesIO()
+        save_options = {"quality": quality}
+        if output_format == 'JPEG':
+            save_options.update(optimize=True, progressive=True)
         else:
-            # Check file size (max 10MB)
-            file_size_mb = os.path.getsize(image_input) / (1024 * 1024)
-            if file_size_mb > MAX_FILE_SIZE_MB:
-                return f"Error: Image too large ({file_size_mb:.1f}MB). Maximum size is {MAX_FILE_SIZE_MB}MB."
-            
-            # Validate image format
-            with Image.open(image_input) as img:
-                if img.format.upper() not in ALLOWED_FORMATS:
-                    return f"Error: Unsupported format '{img.format}'. Allowed: {', '.join(ALLOWED_FORMATS)}"
-            
-            # Encode image to base64
-            with open(image_input, "rb") as image_file:
-                encoded_image = base64.b64encode(image_file.read()).decode('utf-8')
-            image_url_content = f"data:image/jpeg;base64,{encoded_image}"
-            print(f"🔍 Analyzing local image with Groq Vision API...")
-        
-        completion = client.chat.completions.create(
-            model="meta-llama/llama-4-scout-17b-16e-instruct", # Updated to 2026 stable Llama 4 Vision model
-            messages=[
-                {
-                    "role": "user",
-                    "content": [
-                        {
-                            "type": "text", 
-                            "text": (
-                                "Analyze this vehicle incident photo for an insurance claim. "
-                                "1. Extract the License Plate number if visible. "
-                                "2. Rate the damage severity as Low, Medium, or High. "
-                                "3. Provide a concise technical description of the visible damage."
-                            )
-                        },
-                        {
-                            "type": "image_url",
-                            "image_url": {
-                                "url": image_url_content,
-                            },
-                        },
-                    ],
-                }
-            ],
-            temperature=0.1,
-            max_tokens=512,
-            timeout=30
+            save_options.update(method=4)
+        processed.save(buffer, format=output_format, **save_options)
+        payload = buffer.getvalue()
+
+    if not needs_resize and not needs_rotate and len(payload) >= len(raw):
+        # Re-encoding didn't help (e.g. an already-compressed PNG/WEBP); send the original
+        payload, mime_type, reencoded = raw, MIME_TYPES[source_format], False
+    else:
+        mime_type, reencoded = MIME_TYPES[output_format], True
+
+    _record_payload(len(raw), len(payload), reencoded)
+    elapsed_ms = (time.perf_counter() - started) * 1000
+    log.debug("Vision payload %.0fKB -> %.0fKB", len(raw) / 1024, len(payload) / 1024, extra={
+        "source": f"{source_format} {source_size[0]}x{source_size[1]}", "mime_type": mime_type,
+        "elapsed_ms": round(elapsed_ms),
+    })
+    return payload, mime_type, None
+
+class VisionResult(NamedTuple):
+    text: str  # display text (damage_report), or an error string
+    total_tokens: int = 0
+    cached: bool = False
+    report: Optional[DamageReport] = None  # structured fields, None on failure
+
+def _result_from_report(report, **kwargs):
+    return VisionResult(format_damage_report(report), report=report, **kwargs)
+
+async def _resolve_input(image_input, image_hash=None):
+    """
+    URL -> downloaded local file; storage ref -> its hash (from the key).
+
+    Returns:
+        tuple: (image_input, image_hash, error_result) - error_result is a VisionResult or None
+    """
+    if image_input.startswith("http://") or image_input.startswith("https://"):
+        # Download first, so URLs take the same path as uploads (preprocessing, content-hash cache)
+        from app.image_fetcher import fetch_image, ImageFetchError
+        try:
+            with stage("vision.fetch"):
+                fetched = await fetch_image(image_input)
+        except ImageFetchError as e:
+            log.warning("Could not fetch image URL: %s", e, extra={"retryable": e.retryable})
+            return None, None, VisionResult(f"Analysis failed (Fetch): {e}" if e.retryable else f"Error: {e}")
+        image_input, image_hash = fetched.path, fetched.sha256
+
+    if image_input.startswith(STORAGE_REF_PREFIX):
+        # Stored objects are named by their SHA-256: the cache can be checked without reading
+        key = key_from_ref(image_input)
+        image_hash = image_hash or (key.split(".")[0] if key else None)
+    elif not os.path.exists(image_input):
+        return None, None, VisionResult("Error: Image file not found.")
+    return image_input, image_hash, None
+
+async def _vision_completion(prompt, images, max_tokens, estimated_tokens):
+    """One governed Groq vision call: the prompt followed by images [(payload, mime_type)]."""
+    content = [{"type": "text", "text": prompt}]
+    for payload, mime_type in images:
+        # Encode image to base64
+        encoded_image = base64.b64encode(payload).decode('utf-8')
+        content.append({"type": "image_url", "image_url": {"url": f"data:{mime_type};base64,{encoded_image}"}})
+    messages = [{"role": "user", "content": content}]
+    with stage("vision.groq"):
+        return await governor.call(
+            VISION_MODEL,
+            lambda: get_vision_client().chat.completions.create(
+                model=VISION_MODEL,
+                messages=messages,
+                temperature=0.1,
+                max_tokens=max_tokens,
+                response_format={"type": "json_object"},
+                timeout=30
+            ),
+            estimated_tokens=estimated_tokens,
+            usage_of=lambda c: getattr(getattr(c, 'usage', None), 'total_tokens', None)
+        )
+
+async def analyze_car_damage(image_input, image_hash=None):
+    """
+    Sends a car incident photo to Groq's Llama Vision model.
+    Supports a local file path, a stored photo ('storage://<key>', see
+    app.storage) or a public image URL (downloaded by app.image_fetcher,
+    then handled like a local file).
+    For local files, a precomputed SHA-256 (image_hash) lets cache hits skip reading the file.
+    """
+    result = await analyze_car_damage_detailed(image_input, image_hash=image_hash)
+    return result.text
+
+async def analyze_car_damage_detailed(image_input, image_hash=None):
+    """
+    Same as analyze_car_damage, but returns a VisionResult that also carries
+    the Groq token usage, whether the answer came from the cache and the
+    structured DamageReport (cached as its validated JSON).
+    """
+    image_input, image_hash, failed = await _resolve_input(image_input, image_hash)
+    if failed:
+        return failed
+
+    try:
+        raw = None
+        if image_hash is None:
+            raw, error = await read_image(image_input)
+            if error:
+                return VisionResult(error)
+            image_hash = hash_bytes(raw)
+        cached = await vision_cache.get(VISION_MODEL, CACHE_VARIANT, image_hash=image_hash)
+        if cached is not None:
+            log.debug("Vision cache hit", extra={"image_hash": image_hash[:12]})
+            return _result_from_report(parse_damage_report(cached), cached=True)
+
+        if raw is None:
+            raw, error = await read_image(image_input)
+            if error:
+                return VisionResult(error)
+
+        with stage("vision.preprocess"):
+            payload, mime_type, error = await asyncio.to_thread(preprocess_image, raw)
+        if error:
+            return VisionResult(error)
+
+        completion = await _vision_completion(
+            VISION_PROMPT, [(payload, mime_type)], VISION_MAX_TOKENS,
+            estimated_tokens=VISION_ESTIMATED_IMAGE_TOKENS + len(VISION_PROMPT) // 4 + VISION_MAX_TOKENS
         )
-        
-        # Log the full response for debugging
-        print(f"DEBUG: Groq Response Status: {completion.id if hasattr(completion, 'id') else 'N/A'}")
         
         analysis_result = completion.choices[0].message.content
-        print(f"✅ Analysis complete: {len(analysis_result)} characters")
-        print(f"Groq Analysis Result Snippet: {analysis_result[:100]}...")
-        return analysis_result
+        usage = getattr(completion, 'usage', None)
+        total_tokens = getattr(usage, 'total_tokens', 0) or 0
+        log.info("Vision analysis complete", extra={
+            "completion_id": getattr(completion, 'id', None), "chars": len(analysis_result), "tokens": total_tokens,
+        })
+        if is_failed_analysis(analysis_result):
+            return VisionResult(analysis_result, total_tokens=total_tokens)
+
+        report = parse_damage_report(analysis_result)
+        await vision_cache.set(report.model_dump_json(), VISION_MODEL, CACHE_VARIANT, image_hash=image_hash)
+        return _result_from_report(report, total_tokens=total_tokens)
 
     except Exception as e:
         # Check for specific Groq API errors
         status_code = getattr(e, 'status_code', 'N/A')
-        error_msg = f"❌ Groq Vision Error (Status: {status_code}): {type(e).__name__} - {str(e)}"
-        print(error_msg)
-        return f"Analysis failed (Status: {status_code}): {str(e)}"
+        log.error("Groq vision error: %s - %s", type(e).__name__, e, extra={"status_code": status_code})
+        return VisionResult(f"Analysis failed (Status: {status_code}): {str(e)}")
 
 
+
+async def analyze_car_damage_packed(image_inputs, image_hashes=None):
+    """
+    Analyses several photos of one claim in a single vision request (each
+    downscaled to VISION_PACK_MAX_DIMENSION), saving the per-call overhead
+    and most of the per-image tokens. Cached photos are not sent again.
+
+    Returns:
+        list or None: One VisionResult per input, in order; None when the
+            reply did not cover every photo (analyse them one by one instead)
+    """
+    image_hashes = image_hashes or [None] * len(image_inputs)
+    results = [None] * len(image_inputs)
+    pending = []  # (index, image_input, image_hash)
+    for index, (image_input, image_hash) in enumerate(zip(image_inputs, image_hashes)):
+        image_input, image_hash, failed = await _resolve_input(image_input, image_hash)
+        if failed:
+            results[index] = failed
+            continue
+        raw = None
+        if image_hash is None:
+            raw, error = await read_image(image_input)
+            if error:
+                results[index] = VisionResult(error)
+                continue
+            image_hash = hash_bytes(raw)
+        for variant in (CACHE_VARIANT, PACKED_CACHE_VARIANT):
+            cached = await vision_cache.get(VISION_MODEL, variant, image_hash=image_hash)
+            if cached is not None:
+                results[index] = _result_from_report(parse_damage_report(cached), cached=True)
+                break
+        else:
+            pending.append((index, image_input, image_hash))
+    if not pending:
+        return results
+
+    async def prepare(image_input):
+        raw, error = await read_image(image_input)
+        if error:
+            return None, None, error
+        return await asyncio.to_thread(preprocess_image, raw, max_dimension=VISION_PACK_MAX_DIMENSION)
+
+    with stage("vision.preprocess"):
+        prepared = await asyncio.gather(*[prepare(image_input) for _, image_input, _ in pending])
+    sendable = []
+    for (index, _, image_hash), (payload, mime_type, error) in zip(pending, prepared):
+        if error:
+            results[index] = VisionResult(error)
+        else:
+            sendable.append((index, image_hash, payload, mime_type))
+    if not sendable:
+        return results
+
+    count = len(sendable)
+    prompt = VISION_PACKED_PROMPT.format(count=count)
+    try:
+        completion = await _vision_completion(
+            prompt, [(payload, mime_type) for _, _, payload, mime_type in sendable],
+            min(VISION_MAX_TOKENS * count, 2048),
+            estimated_tokens=count * VISION_ESTIMATED_IMAGE_TOKENS // 2 + len(prompt) // 4 + VISION_MAX_TOKENS * count
+        )
+    except Exception as e:
+        status_code = getattr(e, 'status_code', 'N/A')
+        log.error("Groq vision error: %s - %s", type(e).__name__, e, extra={"status_code": status_code, "photos": count})
+        failed = VisionResult(f"Analysis failed (Status: {status_code}): {str(e)}")
+        for index, *_ in sendable:
+            results[index] = failed
+        return results
+
+    analysis_result = completion.choices[0].message.content or ""
+    total_tokens = getattr(getattr(completion, 'usage', None), 'total_tokens', 0) or 0
+    try:
+        photos = json.loads(analysis_result).get("photos")
+    except (ValueError, AttributeError):
+        photos = None
+    if not isinstance(photos, list) or len(photos) != count:
+        log.warning("Packed vision reply did not cover every photo", extra={"photos": count})
+        return None
+    log.info("Packed vision analysis complete", extra={
+        "completion_id": getattr(completion, 'id', None), "photos": count, "tokens": total_tokens,
+    })
+
+    for (index, image_hash, _, _), photo in zip(sendable, photos):
+        report = parse_damage_report(json.dumps(photo) if isinstance(photo, dict) else str(photo))
+        await vision_cache.set(report.model_dump_json(), VISION_MODEL, PACKED_CACHE_VARIANT, image_hash=image_hash)
+        results[index] = _result_from_report(report, total_tokens=total_tokens // count)
+    return results
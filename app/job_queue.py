@@ -0,0 +1,350 @@
+import asyncio
+import os
+import random
+from uuid import uuid4
+from app.config import load_env
+from app.db_helper import run_db, DatabaseUnavailableError
+from app.image_processor import is_failed_analysis, VISION_MODEL
+from app.groq_governor import governor
+from app.claim_analysis import analyze_claim_photos, save_claim_analysis
+from app.logger import get_logger
+
+load_env()
+
+log = get_logger(__name__)
+
+# Configuration
+VISION_JOB_WORKERS = int(os.getenv("VISION_JOB_WORKERS", 4))
+VISION_JOB_QUEUE_SIZE = int(os.getenv("VISION_JOB_QUEUE_SIZE", 100))
+VISION_JOB_MAX_ATTEMPTS = int(os.getenv("VISION_JOB_MAX_ATTEMPTS", 3))
+VISION_JOB_BACKOFF = float(os.getenv("VISION_JOB_BACKOFF", 2))  # seconds, doubled per attempt
+VISION_JOB_STALE_AFTER = int(os.getenv("VISION_JOB_STALE_AFTER", 300))  # seconds before a 'running' job is reclaimed
+VISION_JOB_SWEEP_INTERVAL = float(os.getenv("VISION_JOB_SWEEP_INTERVAL", 60))  # seconds between stale-job sweeps
+
+
+class JobQueueFullError(Exception):
+    """Raised when the in-process queue has no room for another job."""
+
+
+# --- DB Work (vision_jobs table, see sql/schema.sql) ---
+
+def _insert_job(conn, job_id, session_id, image_ref, image_hash):
+    with conn.cursor() as cursor:
+        cursor.execute(
+            "INSERT INTO vision_jobs (job_id, session_id, image_ref, image_hash, status) "
+            "VALUES (%s, %s, %s, %s, 'queued')",
+            (job_id, session_id, image_ref, image_hash)
+        )
+    conn.commit()
+
+def _claim_job(conn, job_id):
+    """Atomically moves a queued job to running; returns the row or None if another worker has it."""
+    with conn.cursor() as cursor:
+        cursor.execute(
+            "UPDATE vision_jobs SET status = 'running', attempts = attempts + 1 "
+            "WHERE job_id = %s AND status = 'queued'",
+            (job_id,)
+        )
+        conn.commit()
+        if cursor.rowcount != 1:
+            return None
+        cursor.execute(
+            "SELECT job_id, session_id, image_ref, image_hash, attempts FROM vision_jobs WHERE job_id = %s",
+            (job_id,)
+        )
+        return cursor.fetchone()
+
+def _complete_job(conn, job_id, session_id, photos):
+    """Saves the per-photo results and the claim's aggregate; returns the claim's report text."""
+    result, _ = save_claim_analysis(conn, session_id, photos)  # idempotent, so a crash before the job update is safe
+    with conn.cursor() as cursor:
+        cursor.execute(
+            "UPDATE vision_jobs SET status = 'done', result = %s, error = NULL WHERE job_id = %s",
+            (result, job_id)
+        )
+    conn.commit()
+    return result
+
+def _fail_job(conn, job_id, error, retry):
+    with conn.cursor() as cursor:
+        cursor.execute(
+            "UPDATE vision_jobs SET status = %s, error = %s WHERE job_id = %s",
+            ('queued' if retry else 'failed', error, job_id)
+        )
+    conn.commit()
+
+def _recoverable_jobs(conn, stale_after):
+    """Queued jobs plus 'running' jobs whose worker died (no update for stale_after seconds)."""
+    with conn.cursor() as cursor:
+        cursor.execute(
+            "UPDATE vision_jobs SET status = 'queued' "
+            "WHERE status = 'running' AND updated_at < NOW() - INTERVAL %s SECOND",
+            (stale_after,)
+        )
+        conn.commit()
+        cursor.execute("SELECT job_id FROM vision_jobs WHERE status = 'queued' ORDER BY created_at")
+        return [row["job_id"] for row in cursor.fetchall()]
+
+def _reclaim_stale_jobs(conn, stale_after):
+    """Moves 'running' jobs with no update for stale_after seconds back to queued; returns their ids."""
+    with conn.cursor() as cursor:
+        cursor.execute(
+            "SELECT job_id FROM vision_jobs WHERE status = 'running' AND updated_at < NOW() - INTERVAL %s SECOND",
+            (stale_after,)
+        )
+        job_ids = [row["job_id"] for row in cursor.fetchall()]
+        for job_id in job_ids:
+            cursor.execute("UPDATE vision_jobs SET status = 'queued' WHERE job_id = %s AND status = 'running'",
+                           (job_id,))
+    conn.commit()
+    return job_ids
+
+def _select_job(conn, job_id):
+    with conn.cursor() as cursor:
+        cursor.execute(
+            "SELECT job_id, session_id, status, attempts, result, error, created_at, updated_at "
+            "FROM vision_jobs WHERE job_id = %s",
+            (job_id,)
+        )
+        return cursor.fetchone()
+
+def _select_latest_session_job(conn, session_id):
+    with conn.cursor() as cursor:
+        cursor.execute(
+            "SELECT job_id, status, attempts, result, error FROM vision_jobs "
+            "WHERE session_id = %s ORDER BY created_at DESC LIMIT 1",
+            (session_id,)
+        )
+        return cursor.fetchone()
+
+
+class JobQueue:
+    """
+    In-process worker pool for vision analysis jobs.
+
+    Jobs are persisted to vision_jobs before they are queued, so queued and
+    interrupted work is picked up again on restart. Workers claim a job with
+    an atomic status update (safe with several gunicorn workers), analyse its
+    photo(s) (app.claim_analysis) and write the per-photo results and the
+    claim's aggregate report. Failed
+    analyses (and attempts that crash) are retried with exponential backoff
+    up to max_attempts. While the vision model's circuit breaker is open,
+    jobs wait in the queue. Jobs left 'running' by a dead worker are swept
+    back into the queue every sweep_interval seconds.
+    """
+
+    def __init__(self, workers=VISION_JOB_WORKERS, max_queue=VISION_JOB_QUEUE_SIZE,
+                 max_attempts=VISION_JOB_MAX_ATTEMPTS, backoff=VISION_JOB_BACKOFF,
+                 stale_after=VISION_JOB_STALE_AFTER, sweep_interval=VISION_JOB_SWEEP_INTERVAL):
+        self.workers = workers
+        self.max_queue = max_queue
+        self.max_attempts = max_attempts
+        self.backoff = backoff
+        self.stale_after = stale_after
+        self.sweep_interval = sweep_interval
+        self._queue = None
+        self._tasks = []
+        self._completion_hooks = []
+        self._ingest_hooks = []
+        self._hook_tasks = set()
+        self._waiters = {}  # job_id -> futures resolved with the finished job
+
+    def add_completion_hook(self, hook):
+        """Registers hook(session_id, result), called after a job's result is saved."""
+        self._completion_hooks.append(hook)
+
+    def add_ingest_hook(self, hook):
+        """
+        Registers async hook(session_id, image_ref, image_hash), run in the
+        background alongside a job's first analysis attempt.
+        """
+        self._ingest_hooks.append(hook)
+
+    async def start(self):
+        """Spawns the workers and re-queues persisted jobs left over from a previous run."""
+        if self._tasks:
+            return
+        self._queue = asyncio.Queue(maxsize=self.max_queue)
+        self._tasks = [asyncio.create_task(self._worker(i)) for i in range(self.workers)]
+        self._tasks.append(asyncio.create_task(self._recover()))
+        self._tasks.append(asyncio.create_task(self._sweep()))
+        log.info("Vision job queue started", extra={"workers": self.workers, "queue_size": self.max_queue})
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    async def _recover(self):
+        try:
+            job_ids = await run_db(_recoverable_jobs, self.stale_after, max_retries=1)
+        except Exception as e:
+            log.warning("Could not recover vision jobs: %s - %s", type(e).__name__, e)
+            return
+        if job_ids:
+            log.info("Re-queueing %s persisted vision job(s)", len(job_ids))
+        for job_id in job_ids:
+            await self._queue.put(job_id)  # waits for room instead of dropping recovered work
+
+    async def _sweep(self):
+        """Periodically re-queues jobs whose worker died mid-run (the startup recovery only runs once)."""
+        while True:
+            await asyncio.sleep(self.sweep_interval)
+            try:
+                job_ids = await run_db(_reclaim_stale_jobs, self.stale_after, max_retries=1)
+            except Exception as e:
+                log.warning("Could not sweep stale vision jobs: %s - %s", type(e).__name__, e)
+                continue
+            if job_ids:
+                log.warning("Re-queueing %s stale vision job(s)", len(job_ids))
+            for job_id in job_ids:
+                await self._queue.put(job_id)
+
+    async def submit(self, session_id, image_ref, image_hash=None, deadline=None):
+        """
+        Persists and queues a vision job.
+        image_hash is the SHA-256 of a local file when the caller already has it.
+        deadline bounds the DB insert (see db_helper.run_db).
+
+        Returns:
+            str: The new job id
+
+        Raises:
+            JobQueueFullError: If the queue is full (nothing is persisted)
+        """
+        if self._queue is None:
+            raise RuntimeError("Vision job queue is not running")
+        if self._queue.full():
+            raise JobQueueFullError(f"Vision job queue is full ({self.max_queue} jobs waiting)")
+
+        job_id = str(uuid4())
+        await run_db(_insert_job, job_id, session_id, image_ref, image_hash, deadline=deadline)
+        try:
+            self._queue.put_nowait(job_id)
+        except asyncio.QueueFull:
+            # Row stays 'queued' and is recovered on the next restart
+            raise JobQueueFullError(f"Vision job queue is full ({self.max_queue} jobs waiting)")
+        return job_id
+
+    async def get_job(self, job_id, deadline=None):
+        return await run_db(_select_job, job_id, deadline=deadline)
+
+    async def latest_job_for_session(self, session_id, deadline=None):
+        return await run_db(_select_latest_session_job, session_id, deadline=deadline)
+
+    async def wait_for_result(self, job_id, deadline):
+        """
+        Waits within the request deadline for a job to finish.
+        Jobs run by this process resolve as soon as they finish; jobs owned by
+        another worker are only seen through the DB check on entry.
+
+        Returns:
+            dict or None: {"status": "done"/"failed", "result"/"error": ...}, or None if still pending
+        """
+        future = asyncio.get_running_loop().create_future()
+        self._waiters.setdefault(job_id, []).append(future)  # registered first so no completion is missed
+        try:
+            job = await self.get_job(job_id, deadline=deadline)
+            if job and job["status"] in ("done", "failed"):
+                return {"status": job["status"], "result": job["result"], "error": job["error"]}
+            return await deadline.run(asyncio.shield(future), stage="vision")
+        except (asyncio.TimeoutError, DatabaseUnavailableError):
+            return None
+        finally:
+            waiters = self._waiters.get(job_id, [])
+            if future in waiters:
+                waiters.remove(future)
+            if not waiters:
+                self._waiters.pop(job_id, None)
+
+    def _resolve_waiters(self, job_id, outcome):
+        for future in self._waiters.pop(job_id, []):
+            if not future.done():
+                future.set_result(outcome)
+
+    def _retry_later(self, job_id, attempts):
+        delay = self.backoff * (2 ** (attempts - 1)) + random.uniform(0, self.backoff)
+        log.warning("Retrying vision job in %.1fs", delay,
+                    extra={"job_id": job_id, "attempt": attempts, "max_attempts": self.max_attempts})
+        asyncio.get_running_loop().call_later(delay, self._requeue, job_id)
+
+    def paused_for(self):
+        """Seconds until jobs run again (0 unless the vision model's circuit breaker is open)."""
+        return governor.breaker(VISION_MODEL).retry_after()
+
+    def _requeue(self, job_id):
+        try:
+            self._queue.put_nowait(job_id)
+        except asyncio.QueueFull:
+            asyncio.get_running_loop().call_later(self.backoff, self._requeue, job_id)
+
+    async def _worker(self, index):
+        while True:
+            job_id = await self._queue.get()
+            try:
+                retry_in = self.paused_for()
+                if retry_in:
+                    # Vision circuit open: the job stays queued, without using up an attempt
+                    asyncio.get_running_loop().call_later(retry_in + random.uniform(0, self.backoff),
+                                                          self._requeue, job_id)
+                    continue
+                await self._run_job(job_id)
+            except Exception:
+                log.exception("Vision job crashed", extra={"job_id": job_id, "worker": index})
+            finally:
+                self._queue.task_done()
+
+    async def _run_job(self, job_id):
+        job = await run_db(_claim_job, job_id)
+        if job is None:
+            return  # Already taken by another worker or process
+        try:
+            await self._analyse(job)
+        except Exception as e:
+            # Don't leave the row 'running' (and its waiters pending) until the next sweep
+            await self._fail(job, f"Analysis failed: {type(e).__name__}", job["attempts"] < self.max_attempts)
+            raise
+
+    async def _analyse(self, job):
+        job_id, session_id = job["job_id"], job["session_id"]
+        log.info("Running vision job", extra={"job_id": job_id, "session_id": session_id, "attempt": job["attempts"]})
+        if job["attempts"] == 1:
+            for hook in self._ingest_hooks:
+                task = asyncio.create_task(hook(session_id, job["image_ref"], job["image_hash"]))
+                self._hook_tasks.add(task)
+                task.add_done_callback(self._hook_tasks.discard)
+        analysis = await analyze_claim_photos(job["image_ref"], image_hash=job["image_hash"])
+        result = analysis.result.text
+
+        if is_failed_analysis(result):
+            await self._fail(job, result, job["attempts"] < self.max_attempts and not result.startswith("Error:"))
+            return
+
+        result = await run_db(_complete_job, job_id, session_id, analysis.photos)
+        self._resolve_waiters(job_id, {"status": "done", "result": result, "error": None})
+        for hook in self._completion_hooks:
+            hook(session_id, result)
+
+    async def _fail(self, job, error, retry):
+        """Records a failed attempt: re-queued with backoff, or failed for good (and its waiters told)."""
+        job_id = job["job_id"]
+        try:
+            await run_db(_fail_job, job_id, error, retry)
+        finally:
+            if not retry:
+                log.error("Vision job failed: %s", error, extra={"job_id": job_id, "session_id": job["session_id"]})
+                self._resolve_waiters(job_id, {"status": "failed", "result": None, "error": error})
+        if retry:
+            self._retry_later(job_id, job["attempts"])
+
+    def stats(self):
+        return {
+            "workers": self.workers,
+            "queued": self._queue.qsize() if self._queue else 0,
+            "max_queue": self.max_queue,
+            "paused_for": round(self.paused_for(), 1),
+        }
+
+
+vision_jobs = JobQueue()
@@ -1,26 +1,65 @@
-import os
-from dotenv import load_dotenv
-from langchain_groq import ChatGroq
-from langchain_core.messages import SystemMessage, HumanMessage
+from app.config import load_env, lazy, get_settings
+from app.prompt_engine import fallback_prompt, record_llm_fallback
+from app.groq_governor import governor
+from app.metrics import stage
+from app.logger import get_logger
 
-load_dotenv()
+load_env()
 
-llm = ChatGroq(
-    model_name="llama-3.1-8b-instant",
-    groq_api_key=os.getenv("GROQ_API_KEY"),
-    request_timeout=4.0,
-    temperature=0
-)
+log = get_logger(__name__)
 
-def chat_with_groq(user_message: str, claim_data: dict):
+CHAT_MODEL = "llama-3.1-8b-instant"
+CHAT_ESTIMATED_COMPLETION_TOKENS = 100
+
+@lazy
+def get_chat_llm():
+    """ChatGroq model, built on first use (langchain imports dominate cold start otherwise)."""
+    from langchain_groq import ChatGroq
+    settings = get_settings()
+    # Retries are owned by the governor (Retry-After aware, shared quota), not the SDK
+    return ChatGroq(
+        model_name=CHAT_MODEL,
+        groq_api_key=settings.groq_api_key,
+        base_url=settings.groq_base_url,
+        request_timeout=settings.chat_request_timeout,
+        max_retries=0,
+        temperature=0
+    )
+
+def _total_tokens(message):
+    usage = getattr(message, "usage_metadata", None) or {}
+    return usage.get("total_tokens")
+
+async def _invoke(messages, max_wait):
+    """Runs the chat model through the shared Groq governor (messages are (role, content) tuples)."""
+    prompt_chars = sum(len(content) for _, content in messages)
+    with stage("chat.groq"):
+        return await governor.call(
+            CHAT_MODEL,
+            lambda: get_chat_llm().ainvoke(messages),
+            estimated_tokens=prompt_chars // 4 + CHAT_ESTIMATED_COMPLETION_TOKENS,
+            usage_of=_total_tokens,
+            max_wait=max_wait,
+            max_retries=1
+        )
+
+FIELD_LABELS = {
+    "policy_number": "Policy Number",
+    "date_time_of_incident": "Incident Date",
+    "vehicle_info": "Vehicle Info",
+    "incident_description": "Description",
+    "claimant_name": "Claimant Name",
+}
+
+async def chat_with_groq(user_message: str, claim_data: dict, language_code: str = None, deadline=None):
+    """
+    LLM reply for turns the prompt engine can't classify.
+    Falls back to the template question on any error, or when the request
+    deadline (app.deadline.Deadline) runs out first.
+    """
+    record_llm_fallback()
     try:
-        status = {
-            "Policy Number": claim_data.get('policy_number'),
-            "Incident Date": claim_data.get('date_time_of_incident'),
-            "Vehicle Info": claim_data.get('vehicle_info'),
-            "Description": claim_data.get('incident_description'),
-            "Claimant Name": claim_data.get('claimant_name') # <--- Add this
-        }
+        status = {label: claim_data.get(field) for field, label in FIELD_LABELS.items()}
 
         missing_items = [k for k, v in status.items() if not v]
 
@@ -36,8 +75,31 @@ RULES:
 2. Ask for exactly ONE missing item.
 3. Keep it under 2 sentences. No small talk."""
 
-        messages = [SystemMessage(content=system_content), HumanMessage(content=user_message)]
-        response = llm.invoke(messages)
+        messages = [("system", system_content), ("human", user_message)]
+        # Webhook path: never queue long for quota, the template fallback is instant
+        if deadline is None:
+            response = await _invoke(messages, max_wait=1.0)
+        else:
+            response = await deadline.run(_invoke(messages, max_wait=min(1.0, deadline.remaining())), stage="chat")
         return response.content
     except Exception as e:
-        return "I've noted that. Could you please provide your policy number?"
\ No newline at end of file
+        log.warning("Groq chat fallback to template: %s - %s", type(e).__name__, e)
+        return fallback_prompt(claim_data, language_code)
+
+async def phrase_question(missing_fields: list, language: str = "en"):
+    """Asks the LLM to phrase the question for the first missing field (offline precomputation only)."""
+    labels = [FIELD_LABELS[f] for f in missing_fields]
+    system_content = f"""You are a professional insurance claim assistant.
+
+STILL NEEDED: {', '.join(labels)}
+
+RULES:
+1. Ask for the {labels[0]} only.
+2. One short, polite sentence. Reply in language code '{language}'.
+3. Output only the question."""
+    try:
+        response = await _invoke([("system", system_content)], max_wait=60.0)
+        return response.content.strip()
+    except Exception as e:
+        log.warning("Could not phrase question for %s: %s - %s", labels[0], type(e).__name__, e)
+        return None
\ No newline at end of file
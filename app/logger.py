@@ -0,0 +1,215 @@
+# Structured logging: records are queued on the calling thread and formatted/written
+# by a background listener thread, so the event loop never blocks on stdout.
+import atexit
+import contextvars
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import re
+import sys
+import threading
+import time
+from app.config import load_env
+
+load_env()
+
+# Configuration
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+LOG_FORMAT = os.getenv("LOG_FORMAT", "json").lower()  # json | text
+LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", 10000))  # records beyond this are dropped, never waited on
+# Fraction of records kept per level, e.g. "DEBUG=0.01,INFO=1" keeps 1% of payload dumps
+LOG_SAMPLE_RATES = os.getenv("LOG_SAMPLE_RATES", "DEBUG=0.01")
+# Field names whose values are claimant PII (matched case-insensitively, at any depth)
+LOG_REDACT_KEYS = os.getenv(
+    "LOG_REDACT_KEYS",
+    "claimant_name,person,name,given-name,last-name,policy_number,number,email,phone,"
+    "license_plate,queryText,user_input,fulfillmentText,incident_description"
+)
+
+REDACTED = "[REDACTED]"
+REDACT_KEYS = {k.strip().lower() for k in LOG_REDACT_KEYS.split(",") if k.strip()}
+# PII that shows up inside free text (messages and string values): (pattern, replacement)
+REDACT_PATTERNS = [
+    (re.compile(r"[\w.+-]+@[\w-]+\.[\w.-]+"), REDACTED),  # email
+    (re.compile(r"(?<![\w-])\+?\d{1,3}[ -]?\(?\d{3}\)?[ -]?\d{3}[ -]?\d{4}(?![\w-])"), REDACTED),  # phone number
+    # Policy numbers have no fixed prefix (POL_AG_123, CAR-5500, ABC-9O81): anything after a
+    # "policy (number)" label, and unlabelled letter-prefix ids
+    (re.compile(r"(\bpolicy(?:[ _-]?(?:number|num|no\.?|#))?\s*(?:is\s+|[:=#]\s*)?)[A-Z0-9][\w-]*\d[\w-]*",
+                re.IGNORECASE), rf"\1{REDACTED}"),
+    (re.compile(r"\bPOL[_-][A-Z0-9_-]+\b", re.IGNORECASE), REDACTED),
+    (re.compile(r"\b[A-Z]{2,5}(?:[_-][A-Z]{1,5})*[_-]\d[A-Z0-9_-]{2,}\b"), REDACTED),
+]
+
+request_id_var = contextvars.ContextVar("request_id", default=None)
+session_id_var = contextvars.ContextVar("session_id", default=None)
+
+# Attributes every LogRecord has; anything else on a record came from extra={...}
+_RECORD_ATTRS = set(vars(logging.LogRecord("", 0, "", 0, "", None, None))) | {"message", "asctime"}
+
+
+def _parse_rates(spec):
+    rates = {}
+    for part in spec.split(","):
+        level, _, rate = part.partition("=")
+        if level.strip() and rate.strip():
+            rates[logging.getLevelName(level.strip().upper())] = float(rate)
+    return rates
+
+
+def redact(value, key=None):
+    """Copy of value with PII fields and PII-looking substrings replaced."""
+    if key is not None and str(key).lower() in REDACT_KEYS and value not in (None, "", [], {}):
+        return REDACTED
+    if isinstance(value, dict):
+        return {k: redact(v, k) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [redact(v) for v in value]
+    if isinstance(value, str):
+        for pattern, replacement in REDACT_PATTERNS:
+            value = pattern.sub(replacement, value)
+    return value
+
+
+def bind(request_id=None, session_id=None):
+    """Attaches ids to every record logged from the current request/task."""
+    if request_id is not None:
+        request_id_var.set(request_id)
+    if session_id is not None:
+        session_id_var.set(session_id)
+
+
+class SamplingFilter(logging.Filter):
+    """Keeps a per-level fraction of records (cheap: runs on the caller before anything is formatted)."""
+
+    def __init__(self, rates):
+        super().__init__()
+        self.rates = rates
+
+    def filter(self, record):
+        rate = self.rates.get(record.levelno, 1.0)
+        if rate >= 1.0 or random.random() < rate:
+            return True
+        _count("sampled_out")
+        return False
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line: time, level, logger, message, ids and redacted extra fields."""
+
+    def format(self, record):
+        entry = {
+            "ts": time.strftime("%Y-%m-%dT%H:%M:%S", time.gmtime(record.created)) + f".{int(record.msecs):03d}Z",
+            "level": record.levelname,
+            "logger": record.name,
+            "message": redact(record.getMessage()),
+        }
+        for field in ("request_id", "session_id"):
+            if getattr(record, field, None):
+                entry[field] = record.__dict__[field]
+        for key, value in record.__dict__.items():
+            if key not in _RECORD_ATTRS and key not in ("request_id", "session_id"):
+                entry[key] = redact(value, key)
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            entry["exc"] = record.exc_text
+        return json.dumps(entry, default=str, ensure_ascii=False)
+
+
+class TextFormatter(logging.Formatter):
+    """Human-readable single line for local development (still redacted)."""
+
+    def format(self, record):
+        extras = {k: redact(v, k) for k, v in record.__dict__.items()
+                  if k not in _RECORD_ATTRS and k not in ("request_id", "session_id")}
+        ids = " ".join(f"{f}={record.__dict__[f]}" for f in ("request_id", "session_id") if getattr(record, f, None))
+        line = (f"{time.strftime('%H:%M:%S', time.localtime(record.created))} {record.levelname:<7} "
+                f"{record.name}: {redact(record.getMessage())}")
+        if ids:
+            line += f" [{ids}]"
+        if extras:
+            line += " " + json.dumps(extras, default=str, ensure_ascii=False)
+        if record.exc_info or record.exc_text:
+            line += "\n" + (record.exc_text or self.formatException(record.exc_info))
+        return line
+
+
+class ContextQueueHandler(logging.handlers.QueueHandler):
+    """
+    Enqueues without blocking. Unlike the stdlib handler it does not format
+    on the caller: it only stamps the context ids and renders the traceback
+    (frames can't cross threads); JSON encoding happens on the listener.
+    """
+
+    def prepare(self, record):
+        # Render the message now: args may be mutable objects that change before the listener gets to them
+        record.msg = record.getMessage()
+        record.args = None
+        record.request_id = request_id_var.get()
+        record.session_id = record.__dict__.get("session_id") or session_id_var.get()
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+            _count("queued")
+        except queue.Full:
+            _count("dropped")
+
+
+_stats = {"queued": 0, "dropped": 0, "sampled_out": 0}
+_stats_lock = threading.Lock()  # records are logged from the event loop and from to_thread workers
+
+
+def _count(name):
+    with _stats_lock:
+        _stats[name] += 1
+_listener = None
+
+
+def setup_logging(level=LOG_LEVEL, fmt=LOG_FORMAT, stream=None):
+    """Routes the 'app' logger through the background queue (idempotent)."""
+    global _listener
+    root = logging.getLogger("app")
+    if _listener is not None:
+        return root
+
+    output = logging.StreamHandler(stream or sys.stdout)
+    output.setFormatter(JsonFormatter() if fmt == "json" else TextFormatter())
+    log_queue = queue.Queue(LOG_QUEUE_SIZE)
+    handler = ContextQueueHandler(log_queue)
+    handler.addFilter(SamplingFilter(_parse_rates(LOG_SAMPLE_RATES)))
+
+    root.setLevel(level)
+    root.handlers = [handler]
+    root.propagate = False
+    _listener = logging.handlers.QueueListener(log_queue, output, respect_handler_level=True)
+    _listener.start()
+    atexit.register(shutdown_logging)
+    return root
+
+
+def shutdown_logging():
+    """Flushes queued records and stops the listener thread."""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+
+def get_logger(name):
+    """Logger for a module (pass __name__); all of them share the 'app' queue."""
+    setup_logging()
+    return logging.getLogger(name if name.startswith("app") else f"app.{name}")
+
+
+def get_log_stats():
+    with _stats_lock:
+        counts = dict(_stats)
+    return {**counts, "backlog": _listener.queue.qsize() if _listener else 0}
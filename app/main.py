@@ -1,11 +1,39 @@
-from fastapi import FastAPI, Depends
+from fastapi import FastAPI, Depends, Request
+from fastapi.responses import PlainTextResponse
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
-from app.routes import router as webhook_router
-from app.db_helper import get_db_connection
+from app.routes import router as webhook_router, is_admin
+from app.db_helper import run_db, db_pool, db_breaker, shutdown_db, get_pool_stats, DatabaseUnavailableError
+from app.vision_cache import get_cache_stats
+from app.image_processor import get_payload_stats
+from app.job_queue import vision_jobs
+from app.prompt_engine import get_prompt_stats
+from app.groq_governor import get_governor_stats
+from app.image_fetcher import image_fetcher, prune_fetch_cache, get_fetch_stats
+from app.storage import get_storage_stats
+from app.photo_index import photo_index, get_photo_index_stats
+from app.policy_index import policy_index, get_policy_index_stats
+from app.webhook_dedup import get_webhook_dedup_stats
+from app.circuit_breaker import get_breaker_stats, get_breaker_gauges
+from app.image_processor import get_vision_client
+from app.langchain_helper import get_chat_llm
+from app.logger import get_logger, bind, get_log_stats
+from app.metrics import (
+    http_duration, webhook_duration, register_gauges, render_metrics, SamplingProfiler
+)
+import asyncio
 import os
+import threading
+import time
+from uuid import uuid4
 from datetime import datetime
 
+log = get_logger(__name__)
+
+# Build the Groq/LangChain clients in a background thread once the app is serving,
+# so neither startup nor the first chat/vision request pays for their imports
+WARM_CLIENTS_ON_STARTUP = os.getenv("WARM_CLIENTS_ON_STARTUP", "true").lower() == "true"
+
 app = FastAPI(
     title="Insurance Claim Processing Agent",
     description="Backend for Dialogflow NLU and Groq Vision analysis.",
@@ -21,7 +49,7 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# 2. Static File Mounting (Claim Photos)
+# 2. Static File Mounting (legacy claim photos; new uploads are served from /photos/{key}, see app/storage.py)
 # Using absolute path to ensure Render finds it correctly
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 UPLOAD_DIR = os.path.join(BASE_DIR, "data", "uploads")
@@ -31,6 +59,79 @@ app.mount("/uploads", StaticFiles(directory=UPLOAD_DIR), name="uploads")
 # 3. Include Routers
 app.include_router(webhook_router)
 
+# Request Timing (and per-request profiling with X-Profile: 1 plus a valid X-Admin-Token)
+@app.middleware("http")
+async def record_request_metrics(request: Request, call_next):
+    request_id = request.headers.get("x-request-id") or uuid4().hex[:16]
+    bind(request_id=request_id)
+    profiler = None
+    if request.headers.get("x-profile") == "1" and is_admin(request.headers.get("x-admin-token")):
+        profiler = SamplingProfiler(threading.get_ident()).start()
+
+    started = time.perf_counter()
+    status = 500
+    try:
+        response = await call_next(request)
+        status = response.status_code
+    finally:
+        elapsed = time.perf_counter() - started
+        if profiler:
+            profiler.stop()  # also when call_next raised, or the sampler thread would run forever
+        route = request.scope.get("route")
+        endpoint = getattr(route, "path", "unmatched")
+        http_duration.observe(elapsed, endpoint=endpoint, method=request.method, status=status)
+        intent = getattr(request.state, "intent", None)
+        if intent:
+            webhook_duration.observe(elapsed, intent=intent)
+
+    response.headers["X-Request-ID"] = request_id
+    if profiler:
+        name = f"{time.strftime('%Y%m%d-%H%M%S')}-{uuid4().hex[:8]}"
+        path = await asyncio.to_thread(profiler.save, name)
+        response.headers["X-Profile-File"] = os.path.basename(path)
+        log.info("Profiled %s %s", request.method, request.url.path,
+                 extra={"samples": sum(profiler.samples.values()), "profile": path})
+    return response
+
+register_gauges("db_pool", get_pool_stats)
+register_gauges("vision_jobs", lambda: vision_jobs.stats())
+register_gauges("vision_cache", get_cache_stats)
+register_gauges("groq_governor", get_governor_stats)
+register_gauges("image_fetch", get_fetch_stats)
+register_gauges("logging", get_log_stats)
+register_gauges("storage", get_storage_stats)
+register_gauges("photo_index", get_photo_index_stats)
+register_gauges("policy_index", get_policy_index_stats)
+register_gauges("webhook_dedup", get_webhook_dedup_stats)
+register_gauges("circuit", get_breaker_gauges)
+
+def _warm_up_clients():
+    try:
+        get_chat_llm()
+        get_vision_client()
+    except Exception as e:
+        log.warning("Client warm-up failed (will retry on first use): %s - %s", type(e).__name__, e)
+
+# DB Pool & Vision Job Lifecycle
+@app.on_event("startup")
+async def start_background_services():
+    if WARM_CLIENTS_ON_STARTUP:
+        asyncio.get_running_loop().run_in_executor(None, _warm_up_clients)
+    await asyncio.to_thread(db_pool.warm_up)
+    await vision_jobs.start()
+    asyncio.create_task(photo_index.load())  # screening waits for it; requests don't
+    policy_index.start()  # policy numbers are accepted unchecked until it is loaded
+    removed = await asyncio.to_thread(prune_fetch_cache)
+    if removed:
+        log.info("Pruned %s expired file(s) from the image URL cache", removed)
+
+@app.on_event("shutdown")
+async def stop_background_services():
+    await vision_jobs.stop()
+    await policy_index.stop()
+    await image_fetcher.close()
+    shutdown_db()
+
 # 4. Root / Health Endpoint
 @app.get("/", tags=["Health"])
 async def root():
@@ -38,31 +139,49 @@ async def root():
         "status": "online",
         "message": "Insurance Claim Agent is Live!",
         "system_time": datetime.now().strftime("%Y-%m-%d %H:%M:%S"), # Works on both Windows & Linux
-        "docs": "/docs"
+        "docs": "/docs",
+        "vision_cache": get_cache_stats(),
+        "vision_payload": get_payload_stats(),
+        "image_fetch": get_fetch_stats(),
+        "storage": get_storage_stats(),
+        "photo_index": get_photo_index_stats(),
+        "policy_index": get_policy_index_stats(),
+        "webhook_dedup": get_webhook_dedup_stats(),
+        "circuit_breakers": get_breaker_stats(),
+        "vision_jobs": vision_jobs.stats(),
+        "prompts": get_prompt_stats(),
+        "groq": get_governor_stats()
     }
 
-# 5. DB Connectivity Check
+# 5. Prometheus Metrics
+@app.get("/metrics", tags=["Health"], response_class=PlainTextResponse)
+async def metrics():
+    return PlainTextResponse(render_metrics(), media_type="text/plain; version=0.0.4")
+
+# 6. DB Connectivity Check
+def _fetch_server_version(conn):
+    # Get server info using a query since get_server_info() may not be available
+    with conn.cursor() as cursor:
+        cursor.execute("SELECT VERSION()")
+        return cursor.fetchone()
+
 @app.get("/check-db", tags=["Health"])
 async def check_db():
     try:
-        conn = get_db_connection()
-        if conn and conn.open:
-            # Get server info using a query since get_server_info() may not be available
-            cursor = conn.cursor()
-            cursor.execute("SELECT VERSION()")
-            db_version = cursor.fetchone()
-            cursor.close()
-            conn.close()
-            return {
-                "status": "success", 
-                "message": "Connected to Aiven MySQL successfully.",
-                "server_version": db_version.get('VERSION()') if db_version else 'unknown'
-            }
-        return {"status": "error", "message": "Database connection failed check."}
+        db_version = await run_db(_fetch_server_version, max_retries=1)
+        return {
+            "status": "success", 
+            "message": "Connected to Aiven MySQL successfully.",
+            "server_version": db_version.get('VERSION()') if db_version else 'unknown',
+            "pool": get_pool_stats(),
+            "circuit": db_breaker.stats()
+        }
+    except DatabaseUnavailableError as e:
+        return {"status": "error", "message": f"Database connection failed check: {e}", "pool": get_pool_stats(),
+                "circuit": db_breaker.stats()}
     except Exception as e:
-        import traceback
-        traceback.print_exc()
-        return {"status": "error", "message": f"Connection Exception: {str(e)}"}
+        log.exception("DB check failed")
+        return {"status": "error", "message": f"Connection Exception: {str(e)}", "circuit": db_breaker.stats()}
 
 if __name__ == "__main__":
     import uvicorn
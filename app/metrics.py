@@ -0,0 +1,227 @@
+# Lightweight latency histograms, error/timeout counters and an on-demand sampling
+# profiler, rendered in the Prometheus text format by GET /metrics (app/main.py).
+import asyncio
+import functools
+import os
+import sys
+import threading
+import time
+from collections import Counter as StackCounter
+from contextlib import contextmanager
+from app.config import load_env
+from app.logger import get_logger
+
+load_env()
+
+log = get_logger(__name__)
+
+# Configuration
+PROFILE_DIR = os.getenv(
+    "PROFILE_DIR",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "profiles")
+)
+PROFILE_INTERVAL = float(os.getenv("PROFILE_INTERVAL", 0.005))  # seconds between stack samples
+MAX_LABEL_LENGTH = 64  # bounds label cardinality for free-form values such as intent names
+
+# Seconds; covers template replies (ms) up to slow vision calls (tens of seconds)
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+def _escape(value):
+    return str(value)[:MAX_LABEL_LENGTH].replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in labels) + "}"
+
+
+class Counter:
+    def __init__(self, name, help_text):
+        self.name = name
+        self.help = help_text
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_format_labels(key)} {value}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name, help_text, buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.buckets = buckets
+        self._series = {}  # labels -> [bucket counts..., sum, count]
+        self._lock = threading.Lock()
+
+    def observe(self, seconds, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [0] * len(self.buckets) + [0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if seconds <= bound:
+                    series[i] += 1
+            series[-2] += seconds
+            series[-1] += 1
+
+    def summary(self):
+        """{labels: {"count", "sum"}} per series, e.g. for benchmark reports."""
+        with self._lock:
+            return {key: {"count": series[-1], "sum": series[-2]} for key, series in self._series.items()}
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for key, series in sorted(self._series.items()):
+                for bound, count in zip(self.buckets, series):
+                    lines.append(f"{self.name}_bucket{_format_labels(key + (('le', bound),))} {count}")
+                lines.append(f"{self.name}_bucket{_format_labels(key + (('le', '+Inf'),))} {series[-1]}")
+                lines.append(f"{self.name}_sum{_format_labels(key)} {series[-2]:.6f}")
+                lines.append(f"{self.name}_count{_format_labels(key)} {series[-1]}")
+        return lines
+
+
+stage_duration = Histogram("stage_duration_seconds", "Time spent per processing stage")
+stage_errors = Counter("stage_errors_total", "Exceptions raised per processing stage")
+stage_timeouts = Counter("stage_timeouts_total", "Timeouts per processing stage")
+http_duration = Histogram("http_request_duration_seconds", "HTTP request latency by endpoint")
+webhook_duration = Histogram("webhook_turn_duration_seconds", "Dialogflow webhook latency by intent")
+
+_METRICS = [stage_duration, stage_errors, stage_timeouts, http_duration, webhook_duration]
+_gauge_sources = []  # (prefix, callable returning a flat dict of numbers)
+
+
+def _is_timeout(error):
+    return isinstance(error, (TimeoutError, asyncio.TimeoutError)) or "Timeout" in type(error).__name__
+
+
+@contextmanager
+def stage(name, **labels):
+    """
+    Times a block as stage `name`. Exceptions are counted (timeouts separately)
+    and re-raised. Works in sync code, executor threads and around awaits.
+    """
+    started = time.perf_counter()
+    try:
+        yield
+    except Exception as e:
+        if _is_timeout(e):
+            stage_timeouts.inc(stage=name)
+        stage_errors.inc(stage=name, error=type(e).__name__)
+        raise
+    finally:
+        stage_duration.observe(time.perf_counter() - started, stage=name, **labels)
+
+
+def timed(name):
+    """Decorator form of stage() for sync and async functions."""
+    def decorator(fn):
+        if asyncio.iscoroutinefunction(fn):
+            @functools.wraps(fn)
+            async def async_wrapper(*args, **kwargs):
+                with stage(name):
+                    return await fn(*args, **kwargs)
+            return async_wrapper
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with stage(name):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def register_metric(metric):
+    """Adds a module's own Counter/Histogram to /metrics and returns it."""
+    _METRICS.append(metric)
+    return metric
+
+
+def observe_stage(name, seconds, **labels):
+    """Records a duration measured elsewhere (e.g. a pool wait)."""
+    stage_duration.observe(seconds, stage=name, **labels)
+
+
+def register_gauges(prefix, source):
+    """Exposes the numeric values of source() (e.g. get_pool_stats) as {prefix}_{key} gauges."""
+    _gauge_sources.append((prefix, source))
+
+
+def render_metrics():
+    """All metrics in the Prometheus text exposition format."""
+    lines = []
+    for metric in _METRICS:
+        lines.extend(metric.render())
+    for prefix, source in _gauge_sources:
+        try:
+            values = source()
+        except Exception as e:
+            log.warning("Gauge source %s failed: %s - %s", prefix, type(e).__name__, e)
+            continue
+        for key, value in values.items():
+            if isinstance(value, bool) or not isinstance(value, (int, float)):
+                continue
+            lines.append(f"# TYPE {prefix}_{key} gauge")
+            lines.append(f"{prefix}_{key} {value}")
+    return "\n".join(lines) + "\n"
+
+
+# --- On-demand sampling profiler ---
+
+class SamplingProfiler:
+    """
+    Samples one thread's Python stack every `interval` seconds and counts
+    collapsed stacks (flamegraph "folded" format). Pointed at the event loop
+    thread, it sees everything that runs on the loop while it is active,
+    including other concurrent requests.
+    """
+
+    def __init__(self, thread_id, interval=PROFILE_INTERVAL):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.samples = StackCounter()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _sample(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{os.path.basename(code.co_filename)}:{code.co_name}")
+                frame = frame.f_back
+            if stack:
+                self.samples[";".join(reversed(stack))] += 1
+
+    def start(self):
+        self._thread = threading.Thread(target=self._sample, name="profiler", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+        return self.samples
+
+    def save(self, name):
+        """Writes the folded stacks to PROFILE_DIR and returns the file path."""
+        os.makedirs(PROFILE_DIR, exist_ok=True)
+        path = os.path.join(PROFILE_DIR, f"{name}.folded")
+        with open(path, "w", encoding="utf-8") as f:
+            for stack, count in self.samples.most_common():
+                f.write(f"{stack} {count}\n")
+        return path
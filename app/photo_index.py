@@ -0,0 +1,366 @@
+# Near-duplicate photo screening: every claim photo gets a 64-bit perceptual hash (pHash, with a
+# dHash as a second opinion), and new photos are matched against all earlier ones in memory.
+# A recompressed, resized or lightly cropped copy of a photo lands within a few bits of the
+# original, so reuse across claims shows up without a vision call.
+import asyncio
+import math
+import os
+import time
+from array import array
+from functools import lru_cache
+from io import BytesIO
+from itertools import combinations
+from PIL import Image, ImageOps
+from app.config import load_env
+from app.db_helper import run_db
+from app.logger import get_logger
+
+load_env()
+
+log = get_logger(__name__)
+
+# Configuration
+PHOTO_INDEX_ENABLED = os.getenv("PHOTO_INDEX_ENABLED", "true").lower() == "true"
+PHOTO_DUP_MAX_DISTANCE = int(os.getenv("PHOTO_DUP_MAX_DISTANCE", 8))  # pHash bits that may differ
+PHOTO_DUP_MAX_DHASH_DISTANCE = int(os.getenv("PHOTO_DUP_MAX_DHASH_DISTANCE", 14))  # confirmation
+PHOTO_INDEX_CHUNKS = int(os.getenv("PHOTO_INDEX_CHUNKS", 3))  # fewer, wider chunks: faster at scale, more memory
+PHOTO_INDEX_LOAD_BATCH = 10000  # fingerprints per query when loading the index
+# Ids re-read on every refresh: AUTO_INCREMENT ids are allocated at insert but become visible at
+# commit, so a concurrent insert can commit id N after N+1 was already read
+PHOTO_INDEX_REFRESH_OVERLAP = int(os.getenv("PHOTO_INDEX_REFRESH_OVERLAP", 256))
+
+HASH_BITS = 64
+_DCT_SIZE = 32  # pHash: DCT of a 32x32 thumbnail, keeping the 8x8 lowest frequencies
+_DCT_BASIS = [[math.cos(math.pi * (2 * x + 1) * u / (2 * _DCT_SIZE)) for x in range(_DCT_SIZE)] for u in range(8)]
+
+
+# --- Perceptual hashes ---
+
+def _bits_to_int(bits):
+    value = 0
+    for bit in bits:
+        value = (value << 1) | bool(bit)
+    return value
+
+
+def _phash(img):
+    pixels = list(img.resize((_DCT_SIZE, _DCT_SIZE), Image.LANCZOS).getdata())
+    rows = [pixels[y * _DCT_SIZE:(y + 1) * _DCT_SIZE] for y in range(_DCT_SIZE)]
+    # Separable 2-D DCT-II, computing only the 8 lowest frequencies in each direction
+    row_freqs = [[sum(b * p for b, p in zip(basis, row)) for basis in _DCT_BASIS] for row in rows]
+    coefficients = [sum(basis[y] * row_freqs[y][v] for y in range(_DCT_SIZE))
+                    for basis in _DCT_BASIS for v in range(8)]
+    median = sorted(coefficients)[len(coefficients) // 2]
+    return _bits_to_int(c > median for c in coefficients)
+
+
+def _dhash(img):
+    pixels = list(img.resize((9, 8), Image.LANCZOS).getdata())
+    return _bits_to_int(pixels[y * 9 + x] > pixels[y * 9 + x + 1] for y in range(8) for x in range(8))
+
+
+def compute_hashes(raw):
+    """
+    (phash, dhash) of raw image bytes, both unsigned 64-bit ints.
+    Blocking (decode), so callers run it off the event loop.
+    """
+    with Image.open(BytesIO(raw)) as img:
+        img.draft("L", (128, 128))  # JPEG: decode at a reduced scale, the hashes only need 32x32
+        gray = ImageOps.exif_transpose(img).convert("L")
+    return _phash(gray), _dhash(gray)
+
+
+def hamming(a, b):
+    return (a ^ b).bit_count()
+
+
+def to_signed(value):
+    """Unsigned 64-bit hash -> the signed BIGINT it is stored as."""
+    return value - (1 << 64) if value >= 1 << 63 else value
+
+
+def to_unsigned(value):
+    return value + (1 << 64) if value < 0 else value
+
+
+# --- In-memory index ---
+
+@lru_cache(maxsize=None)
+def _flip_masks(bits, radius):
+    """Every bits-wide XOR mask with at most radius bits set."""
+    masks = [0]
+    for r in range(1, radius + 1):
+        masks.extend(sum(1 << i for i in flipped) for flipped in combinations(range(bits), r))
+    return tuple(masks)
+
+
+class MultiIndexHashTable:
+    """
+    Multi-index hashing over 64-bit hashes.
+
+    Each hash is split into `chunks` substrings (22/21/21 bits by default) and
+    filed under each of them in a separate table. Two hashes within distance r
+    differ in at most r // chunks bits on at least one chunk (pigeonhole), so a
+    query probes the buckets within that radius of each of its chunks and checks
+    only the hashes found there. With ~21-bit chunks buckets stay near-empty up to
+    millions of entries, so lookup cost hardly grows with the index.
+
+    Buckets are linked lists threaded through flat arrays (a head per chunk
+    value, a next link per entry): a fixed 4 bytes per possible chunk value
+    plus 4 bytes per entry and table, instead of a dict entry per bucket.
+    The head arrays (~32 MB with 3 chunks) are allocated on the first add.
+    """
+
+    def __init__(self, chunks=PHOTO_INDEX_CHUNKS):
+        self.chunks = chunks
+        self._layout = []  # (shift, width) of each chunk
+        shift = 0
+        for i in range(chunks):
+            width = HASH_BITS // chunks + (i < HASH_BITS % chunks)
+            self._layout.append((shift, width))
+            shift += width
+        self._heads = None  # per chunk: chunk value -> newest position + 1 (allocated on first add)
+        self._next = [array("I") for _ in self._layout]  # position -> previous position + 1 in the bucket
+        self._ids = array("Q")
+        self._phashes = array("Q")
+        self._dhashes = array("Q")
+
+    def __len__(self):
+        return len(self._ids)
+
+    def add(self, row_id, phash, dhash):
+        if self._heads is None:
+            self._heads = [array("I", bytes(4 << width)) for _, width in self._layout]
+        position = len(self._ids)
+        self._ids.append(row_id)
+        self._phashes.append(phash)
+        self._dhashes.append(dhash)
+        for (shift, width), heads, links in zip(self._layout, self._heads, self._next):
+            chunk = (phash >> shift) & ((1 << width) - 1)
+            links.append(heads[chunk])
+            heads[chunk] = position + 1
+
+    def search(self, phash, dhash, max_distance=PHOTO_DUP_MAX_DISTANCE,
+               max_dhash_distance=PHOTO_DUP_MAX_DHASH_DISTANCE):
+        """
+        Stored hashes within max_distance of phash whose dHash is also within
+        max_dhash_distance of dhash.
+
+        Returns:
+            list: (row_id, phash_distance, dhash_distance), closest first
+        """
+        if self._heads is None:
+            return []
+        radius = max_distance // self.chunks
+        phashes = self._phashes
+        found = {}
+        for (shift, width), heads, links in zip(self._layout, self._heads, self._next):
+            chunk = (phash >> shift) & ((1 << width) - 1)
+            for mask in _flip_masks(width, radius):
+                link = heads[chunk ^ mask]
+                while link:
+                    position = link - 1
+                    link = links[position]
+                    distance = (phash ^ phashes[position]).bit_count()
+                    if distance <= max_distance and position not in found:
+                        found[position] = distance
+        matches = []
+        for position, distance in found.items():
+            dhash_distance = (dhash ^ self._dhashes[position]).bit_count()
+            if dhash_distance <= max_dhash_distance:
+                matches.append((self._ids[position], distance, dhash_distance))
+        matches.sort(key=lambda match: (match[1], match[2]))
+        return matches
+
+
+# --- DB Work (photo_fingerprints table, see sql/schema.sql) ---
+
+def _fingerprints_after(conn, last_id, limit):
+    with conn.cursor() as cursor:
+        cursor.execute(
+            "SELECT id, phash, dhash FROM photo_fingerprints WHERE id > %s ORDER BY id LIMIT %s",
+            (last_id, limit)
+        )
+        return cursor.fetchall()
+
+
+def _fingerprint_owners(conn, row_ids):
+    if not row_ids:
+        return {}
+    with conn.cursor() as cursor:
+        cursor.execute(
+            f"SELECT id, session_id, image_hash FROM photo_fingerprints WHERE id IN ({', '.join(['%s'] * len(row_ids))})",
+            tuple(row_ids)
+        )
+        return {row["id"]: row for row in cursor.fetchall()}
+
+
+def _session_fingerprints(conn, session_id):
+    with conn.cursor() as cursor:
+        cursor.execute(
+            "SELECT image_hash, phash, dhash FROM photo_fingerprints WHERE session_id = %s ORDER BY id",
+            (session_id,)
+        )
+        return cursor.fetchall()
+
+
+def _record_fingerprint(conn, session_id, image_hash, phash, dhash, candidates):
+    """
+    Stores a photo's hashes and flags the session with its closest match in
+    another session. Idempotent (a retried job re-records the same row).
+
+    Returns:
+        list: Matches in other sessions, closest first
+    """
+    owners = _fingerprint_owners(conn, [row_id for row_id, _, _ in candidates])
+    matches = []
+    for row_id, distance, dhash_distance in candidates:
+        owner = owners.get(row_id)
+        if owner and owner["session_id"] != session_id:
+            matches.append({"session_id": owner["session_id"], "image_hash": owner["image_hash"],
+                            "distance": distance, "dhash_distance": dhash_distance})
+
+    with conn.cursor() as cursor:
+        cursor.execute(
+            "INSERT INTO photo_fingerprints (session_id, image_hash, phash, dhash) VALUES (%s, %s, %s, %s) "
+            "ON DUPLICATE KEY UPDATE phash = VALUES(phash), dhash = VALUES(dhash)",
+            (session_id, image_hash, to_signed(phash), to_signed(dhash))
+        )
+        if matches:
+            best = matches[0]
+            cursor.execute(
+                "UPDATE insurance_sessions SET near_duplicate_of = %s, near_duplicate_distance = %s "
+                "WHERE session_id = %s AND (near_duplicate_distance IS NULL OR near_duplicate_distance > %s)",
+                (best["session_id"], best["distance"], session_id, best["distance"])
+            )
+    conn.commit()
+    return matches
+
+
+class PhotoIndex:
+    """
+    Every stored fingerprint, searchable in memory (see MultiIndexHashTable).
+
+    The table is the source of truth: the index loads it at startup and pulls
+    rows added since (by any worker process) before each lookup, so several
+    gunicorn workers see each other's photos. Each pull starts
+    PHOTO_INDEX_REFRESH_OVERLAP ids below the highest id seen, so rows that
+    committed out of id order are still picked up; ids in that window that
+    are already indexed are skipped.
+    """
+
+    def __init__(self, overlap=PHOTO_INDEX_REFRESH_OVERLAP):
+        self._table = MultiIndexHashTable()
+        self.overlap = overlap
+        self._last_id = 0
+        self._recent_ids = set()  # indexed ids within the overlap window below _last_id
+        self._refresh_lock = asyncio.Lock()
+        self._stats = {"screened": 0, "near_duplicates": 0, "errors": 0, "late_rows": 0}
+
+    async def refresh(self):
+        """Loads fingerprints added since the last refresh."""
+        async with self._refresh_lock:
+            after = max(self._last_id - self.overlap, 0)
+            while True:
+                rows = await run_db(_fingerprints_after, after, PHOTO_INDEX_LOAD_BATCH, max_retries=1)
+                for row in rows:
+                    if row["id"] in self._recent_ids:
+                        continue
+                    if row["id"] < self._last_id:
+                        self._stats["late_rows"] += 1  # committed after a higher id was read
+                    self._table.add(row["id"], to_unsigned(row["phash"]), to_unsigned(row["dhash"]))
+                    self._recent_ids.add(row["id"])
+                    self._last_id = max(self._last_id, row["id"])
+                floor = self._last_id - self.overlap
+                self._recent_ids = {row_id for row_id in self._recent_ids if row_id > floor}
+                if len(rows) < PHOTO_INDEX_LOAD_BATCH:
+                    return
+                after = rows[-1]["id"]
+
+    async def load(self):
+        """Startup: builds the index from photo_fingerprints (failures are logged, screening retries)."""
+        started = time.perf_counter()
+        try:
+            await self.refresh()
+        except Exception as e:
+            log.warning("Could not load the photo index: %s - %s", type(e).__name__, e)
+            return
+        log.info("Photo index loaded", extra={"entries": len(self._table),
+                                              "elapsed_ms": round((time.perf_counter() - started) * 1000)})
+
+    async def screen(self, session_id, image_ref, image_hash=None):
+        """
+        Fingerprints a vision job's photo(s) (stored objects, local files or
+        URLs) and flags the session if one is a near-duplicate of a photo from
+        another session. Never raises: screening must not hold up the claim.
+
+        Returns:
+            list: Matches in other sessions, closest first
+        """
+        if not PHOTO_INDEX_ENABLED:
+            return []
+        from app.claim_analysis import split_refs
+        refs = split_refs(image_ref)
+        matches = []
+        for ref in refs:
+            matches.extend(await self._screen_photo(session_id, ref, image_hash if len(refs) == 1 else None))
+        return sorted(matches, key=lambda match: match["distance"])
+
+    async def _screen_photo(self, session_id, image_ref, image_hash):
+        from app.image_processor import read_image
+        try:
+            if image_ref.startswith("http://") or image_ref.startswith("https://"):
+                from app.image_fetcher import fetch_image
+                fetched = await fetch_image(image_ref)  # shared with the vision job's download
+                image_ref, image_hash = fetched.path, fetched.sha256
+            raw, error = await read_image(image_ref)
+            if error:
+                log.warning("Photo not screened: %s", error, extra={"session_id": session_id})
+                return []
+            if image_hash is None:
+                from app.vision_cache import hash_bytes
+                image_hash = hash_bytes(raw)
+            phash, dhash = await asyncio.to_thread(compute_hashes, raw)
+
+            await self.refresh()
+            candidates = self._table.search(phash, dhash)
+            matches = await run_db(_record_fingerprint, session_id, image_hash, phash, dhash, candidates)
+        except Exception as e:
+            self._stats["errors"] += 1
+            log.warning("Photo screening failed: %s - %s", type(e).__name__, e, extra={"session_id": session_id})
+            return []
+
+        self._stats["screened"] += 1
+        if matches:
+            self._stats["near_duplicates"] += 1
+            log.warning("Near-duplicate claim photo", extra={
+                "session_id": session_id, "matches": [m["session_id"] for m in matches[:5]],
+                "distance": matches[0]["distance"],
+            })
+        return matches
+
+    async def similar_to_session(self, session_id):
+        """Photos in other sessions that are near-duplicates of this session's photos."""
+        await self.refresh()
+        rows = await run_db(_session_fingerprints, session_id)
+        found = []
+        for row in rows:
+            candidates = self._table.search(to_unsigned(row["phash"]), to_unsigned(row["dhash"]))
+            owners = await run_db(_fingerprint_owners, [row_id for row_id, _, _ in candidates]) if candidates else {}
+            for row_id, distance, dhash_distance in candidates:
+                owner = owners.get(row_id)
+                if owner and owner["session_id"] != session_id:
+                    found.append({"image_hash": row["image_hash"], "session_id": owner["session_id"],
+                                  "matched_image_hash": owner["image_hash"], "distance": distance,
+                                  "dhash_distance": dhash_distance})
+        return found
+
+    def stats(self):
+        return {"entries": len(self._table), **self._stats}
+
+
+photo_index = PhotoIndex()
+
+
+def get_photo_index_stats():
+    return photo_index.stats()
@@ -0,0 +1,283 @@
+# Policy-number validation on the webhook path without a DB round trip: the known policies are held
+# in memory (exact hash lookup) together with a single-deletion index for "did you mean" answers to
+# one-character typing/OCR errors. Loaded at startup and refreshed in the background.
+import asyncio
+import os
+import re
+import time
+from array import array
+from bisect import bisect_left
+from typing import NamedTuple, Optional, Tuple
+from app.config import load_env
+from app.db_helper import run_db
+from app.logger import get_logger
+
+load_env()
+
+log = get_logger(__name__)
+
+# Configuration
+POLICY_INDEX_SOURCE = os.getenv("POLICY_INDEX_SOURCE", "db")  # db (policies table) | file | off
+POLICY_FILE = os.getenv("POLICY_FILE", os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "policies.txt"))
+POLICY_REFRESH_INTERVAL = float(os.getenv("POLICY_REFRESH_INTERVAL", 60))  # seconds between change checks
+POLICY_LOAD_BATCH = 10000
+
+# Characters that OCR and quick typing swap for one another; a correction through one of them is
+# accepted without asking when it is the only candidate
+CONFUSABLE = {frozenset(pair) for pair in ("0O", "0D", "1I", "1L", "5S", "8B", "2Z", "6G")}
+
+
+def normalize_policy(value):
+    """Lookup key: uppercase alphanumerics only ('pol 1234' and 'POL-1234' are the same policy)."""
+    return re.sub(r"[^A-Z0-9]", "", str(value).upper())
+
+
+def _deletions(key):
+    return {key[:i] + key[i + 1:] for i in range(len(key))}
+
+
+def _edit(a, b):
+    """
+    The single edit turning a into b: ('substitute', x, y), ('delete'/'insert', ch),
+    ('transpose',) - or None when they are more than one edit apart.
+    """
+    if len(a) == len(b):
+        diffs = [i for i in range(len(a)) if a[i] != b[i]]
+        if len(diffs) == 1:
+            return ("substitute", a[diffs[0]], b[diffs[0]])
+        if len(diffs) == 2 and diffs[1] == diffs[0] + 1 and a[diffs[0]] == b[diffs[1]] and a[diffs[1]] == b[diffs[0]]:
+            return ("transpose",)
+        return None
+    if abs(len(a) - len(b)) != 1:
+        return None
+    shorter, longer = (a, b) if len(a) < len(b) else (b, a)
+    for i in range(len(shorter) + 1):
+        if longer[:i] + longer[i + 1:] == shorter:
+            return ("insert" if len(a) < len(b) else "delete", longer[i])
+    return None
+
+
+class PolicyCheck(NamedTuple):
+    status: str  # valid | corrected | suggest | invalid | unknown (no index loaded)
+    policy_number: Optional[str] = None  # canonical number when valid or corrected
+    suggestions: Tuple[str, ...] = ()
+
+
+class PolicySnapshot:
+    """
+    Immutable index over a set of policies (rebuilt off the event loop and
+    swapped in whole, so lookups never see a half-applied refresh).
+
+    Exact lookups go to a dict. The fuzzy index is symmetric-delete: every
+    policy is filed under itself and each of its single-character deletions,
+    so any policy within one edit of a query shares a variant with the query
+    or one of its deletions. Variants are kept as sorted 64-bit hashes with a
+    parallel array of positions (12 bytes per variant), not as strings.
+    """
+
+    def __init__(self, policies):
+        self.policies = policies  # normalized key -> canonical policy number
+        self.keys = sorted(policies)
+        # (hash, position) packed into one int, so the sort compares ints rather than tuples
+        packed = [hash(variant) << 32 | position for position, key in enumerate(self.keys)
+                  for variant in _deletions(key) | {key}]
+        packed.sort()
+        self._hashes = array("q", [v >> 32 for v in packed])
+        self._positions = array("I", [v & 0xFFFFFFFF for v in packed])
+
+    def __len__(self):
+        return len(self.policies)
+
+    def _candidates(self, variant):
+        h = hash(variant)
+        i = bisect_left(self._hashes, h)
+        while i < len(self._hashes) and self._hashes[i] == h:
+            yield self.keys[self._positions[i]]
+            i += 1
+
+    def check(self, value):
+        key = normalize_policy(value)
+        if not key:
+            return PolicyCheck("invalid")
+        canonical = self.policies.get(key)
+        if canonical is not None:
+            return PolicyCheck("valid", canonical)
+
+        close = {}
+        for variant in _deletions(key) | {key}:
+            for candidate in self._candidates(variant):
+                if candidate not in close:
+                    close[candidate] = _edit(key, candidate)  # verifies (hash collisions, 2-edit pairs)
+        close = {candidate: edit for candidate, edit in close.items() if edit is not None}
+        if not close:
+            return PolicyCheck("invalid")
+
+        confusable = [c for c, edit in close.items() if edit[0] == "substitute" and frozenset(edit[1:]) in CONFUSABLE]
+        if len(close) == 1 and confusable:
+            return PolicyCheck("corrected", self.policies[confusable[0]])
+        ranked = sorted(close, key=lambda c: (c not in confusable, c))
+        return PolicyCheck("suggest", suggestions=tuple(self.policies[c] for c in ranked[:3]))
+
+
+# --- Sources ---
+
+def _active_policies(conn, after, limit):
+    with conn.cursor() as cursor:
+        cursor.execute(
+            "SELECT policy_number FROM policies WHERE active = TRUE AND policy_number > %s "
+            "ORDER BY policy_number LIMIT %s",
+            (after, limit)
+        )
+        return [row["policy_number"] for row in cursor.fetchall()]
+
+
+def _policy_changes(conn, since):
+    """Rows added, re-activated or deactivated at or after `since` (idx_policies_updated)."""
+    with conn.cursor() as cursor:
+        cursor.execute(
+            "SELECT policy_number, active, updated_at FROM policies WHERE updated_at >= %s ORDER BY updated_at",
+            (since,)
+        )
+        return cursor.fetchall()
+
+
+def _latest_change(conn):
+    with conn.cursor() as cursor:
+        cursor.execute("SELECT MAX(updated_at) AS latest FROM policies")
+        row = cursor.fetchone()
+        return row["latest"] if row else None
+
+
+def read_policy_file(path):
+    """One policy number per line (a CSV's first column works too); '#' starts a comment."""
+    policies = []
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            value = line.split("#", 1)[0].split(",", 1)[0].strip()
+            if value:
+                policies.append(value)
+    return policies
+
+
+class PolicyIndex:
+    """
+    The current PolicySnapshot plus its refresh loop.
+
+    Source 'db' loads the active rows of the policies table, then applies
+    rows whose updated_at moved (new, re-activated or deactivated policies)
+    every POLICY_REFRESH_INTERVAL seconds. Source 'file' reloads POLICY_FILE
+    when its modification time changes. Until a non-empty snapshot is
+    loaded, check() answers 'unknown' and callers accept the number as before.
+    """
+
+    def __init__(self, source=POLICY_INDEX_SOURCE, path=POLICY_FILE, interval=POLICY_REFRESH_INTERVAL):
+        self.source = source
+        self.path = path
+        self.interval = interval
+        self._snapshot = None
+        self._since = None  # db: updated_at high-water mark
+        self._file_mtime = None
+        self._task = None
+        self._stats = {"valid": 0, "corrected": 0, "suggest": 0, "invalid": 0, "unknown": 0,
+                       "refreshes": 0, "refresh_errors": 0}
+        self._loaded_at = None
+
+    def check(self, value):
+        """Validates a policy number against the in-memory index (no I/O)."""
+        snapshot = self._snapshot
+        result = snapshot.check(value) if snapshot else PolicyCheck("unknown")
+        self._stats[result.status] += 1
+        return result
+
+    async def _swap(self, policies):
+        started = time.perf_counter()
+        snapshot = await asyncio.to_thread(PolicySnapshot, policies)
+        self._snapshot = snapshot if len(snapshot) else None
+        self._loaded_at = time.time()
+        log.info("Policy index built", extra={"source": self.source, "policies": len(snapshot),
+                                              "elapsed_ms": round((time.perf_counter() - started) * 1000)})
+
+    async def load(self):
+        """Full (re)load from the source."""
+        if self.source == "file":
+            self._file_mtime = os.path.getmtime(self.path)
+            values = await asyncio.to_thread(read_policy_file, self.path)
+        elif self.source == "db":
+            self._since = await run_db(_latest_change, max_retries=1)
+            values, after = [], ""
+            while True:
+                batch = await run_db(_active_policies, after, POLICY_LOAD_BATCH, max_retries=1)
+                values.extend(batch)
+                if len(batch) < POLICY_LOAD_BATCH:
+                    break
+                after = batch[-1]
+        else:
+            return
+        await self._swap({normalize_policy(value): value for value in values if normalize_policy(value)})
+
+    async def refresh(self):
+        """Applies changes since the last load/refresh; returns True when the index changed."""
+        if self._snapshot is None and self._loaded_at is None:
+            await self.load()
+            return True
+        if self.source == "file":
+            if os.path.getmtime(self.path) == self._file_mtime:
+                return False
+            await self.load()
+            return True
+        if self.source != "db":
+            return False
+
+        if self._since is None:
+            # The table was empty at load time: anything in it now is new
+            if await run_db(_latest_change, max_retries=1) is None:
+                return False
+            await self.load()
+            return True
+        current = dict(self._snapshot.policies) if self._snapshot else {}
+        changed = False
+        for row in await run_db(_policy_changes, self._since, max_retries=1):
+            key = normalize_policy(row["policy_number"])
+            value = row["policy_number"] if row["active"] else None
+            if current.get(key) != value:
+                changed = True
+                if value is None:
+                    current.pop(key, None)
+                else:
+                    current[key] = value
+            self._since = max(self._since, row["updated_at"])
+        if changed:
+            await self._swap(current)
+        return changed
+
+    async def _refresh_loop(self):
+        while True:
+            try:
+                if await self.refresh():
+                    self._stats["refreshes"] += 1
+            except Exception as e:
+                self._stats["refresh_errors"] += 1
+                log.warning("Policy index refresh failed: %s - %s", type(e).__name__, e)
+            await asyncio.sleep(self.interval)
+
+    def start(self):
+        """Loads the index and keeps it fresh in the background (no-op with source 'off')."""
+        if self.source in ("db", "file") and self._task is None:
+            self._task = asyncio.create_task(self._refresh_loop())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    def stats(self):
+        return {"source": self.source, "policies": len(self._snapshot) if self._snapshot else 0,
+                "loaded_at": self._loaded_at, **self._stats}
+
+
+policy_index = PolicyIndex()
+
+
+def get_policy_index_stats():
+    return policy_index.stats()
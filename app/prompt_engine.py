@@ -0,0 +1,238 @@
+# Deterministic "next missing field" prompts for the claim conversation.
+# The LLM (langchain_helper.chat_with_groq) is only used for turns this engine can't classify.
+import json
+import os
+import random
+import threading
+from itertools import combinations
+from app.config import load_env
+from app.logger import get_logger
+
+load_env()
+
+log = get_logger(__name__)
+
+# Configuration
+PROMPT_PHRASINGS_FILE = os.getenv(
+    "PROMPT_PHRASINGS_FILE",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "prompt_phrasings.json")
+)
+DEFAULT_LANGUAGE = "en"
+
+# Order in which missing details are asked for
+FIELD_ORDER = ["policy_number", "date_time_of_incident", "vehicle_info", "incident_description", "claimant_name"]
+
+# Intents whose turn the engine can answer on its own, and the field each one fills
+INTENT_FIELDS = {
+    "provide_policy_number": "policy_number",
+    "provide_date_time": "date_time_of_incident",
+    "provide_vehicle_info": "vehicle_info",
+    "describe_incident": "incident_description",
+    "provide_name": "claimant_name",
+}
+GREETING_INTENTS = {"Default Welcome Intent", "report_claim"}
+
+TEMPLATES = {
+    "en": {
+        "greeting": "Hi! I'll help you report your claim.",
+        "ack": {
+            "policy_number": "Thanks, I've noted your policy number.",
+            "date_time_of_incident": "Got it, thanks for the date and time.",
+            "vehicle_info": "Thanks, I've noted your vehicle details.",
+            "incident_description": "Thank you for describing what happened.",
+            "claimant_name": "Thanks, {claimant_name}.",
+        },
+        "missed": {
+            "policy_number": "Sorry, I couldn't read a policy number there.",
+            "date_time_of_incident": "Sorry, I couldn't pick out a date there.",
+            "vehicle_info": "Sorry, I didn't catch the vehicle details.",
+            "incident_description": "Sorry, I didn't catch what happened.",
+            "claimant_name": "Sorry, I didn't catch your name.",
+        },
+        "ask": {
+            "policy_number": "Could you please provide your policy number?",
+            "date_time_of_incident": "When did the incident happen (date and time)?",
+            "vehicle_info": "What vehicle was involved (make, model and year)?",
+            "incident_description": "Could you briefly describe what happened?",
+            "claimant_name": "What is your full name?",
+        },
+    },
+    "es": {
+        "greeting": "¡Hola! Le ayudaré a registrar su reclamación.",
+        "ack": {
+            "policy_number": "Gracias, he anotado su número de póliza.",
+            "date_time_of_incident": "Entendido, gracias por la fecha y la hora.",
+            "vehicle_info": "Gracias, he anotado los datos del vehículo.",
+            "incident_description": "Gracias por describir lo ocurrido.",
+            "claimant_name": "Gracias, {claimant_name}.",
+        },
+        "missed": {
+            "policy_number": "Lo siento, no pude leer un número de póliza.",
+            "date_time_of_incident": "Lo siento, no pude identificar una fecha.",
+            "vehicle_info": "Lo siento, no entendí los datos del vehículo.",
+            "incident_description": "Lo siento, no entendí lo ocurrido.",
+            "claimant_name": "Lo siento, no entendí su nombre.",
+        },
+        "ask": {
+            "policy_number": "¿Podría indicarme su número de póliza?",
+            "date_time_of_incident": "¿Cuándo ocurrió el incidente (fecha y hora)?",
+            "vehicle_info": "¿Qué vehículo estuvo involucrado (marca, modelo y año)?",
+            "incident_description": "¿Podría describir brevemente lo ocurrido?",
+            "claimant_name": "¿Cuál es su nombre completo?",
+        },
+    },
+}
+
+_stats_lock = threading.Lock()
+_stats = {"template_replies": 0, "phrasing_cache_replies": 0, "llm_fallbacks": 0}
+
+
+def _count(name):
+    with _stats_lock:
+        _stats[name] += 1
+
+
+def get_prompt_stats():
+    """Returns how turns were answered (template, cached phrasing, LLM)."""
+    with _stats_lock:
+        return dict(_stats)
+
+
+def record_llm_fallback():
+    _count("llm_fallbacks")
+
+
+def normalize_language(language_code):
+    """Maps a Dialogflow languageCode such as 'en-US' to a template language."""
+    language = (language_code or DEFAULT_LANGUAGE).split("-")[0].lower()
+    return language if language in TEMPLATES else DEFAULT_LANGUAGE
+
+
+def missing_fields(session):
+    return [field for field in FIELD_ORDER if not session.get(field)]
+
+
+def next_missing_field(session):
+    missing = missing_fields(session)
+    return missing[0] if missing else None
+
+
+def phrasing_key(missing):
+    """Cache key for a set of missing fields (order-independent)."""
+    return ",".join(sorted(missing))
+
+
+# --- Precomputed LLM phrasings ---
+
+def _load_phrasings(path=PROMPT_PHRASINGS_FILE):
+    if not os.path.exists(path):
+        return {}
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError) as e:
+        log.warning("Could not load prompt phrasings from %s: %s", path, e)
+        return {}
+
+
+_phrasings = _load_phrasings()
+
+
+def _cached_phrasing(language, missing):
+    options = _phrasings.get(language, {}).get(phrasing_key(missing))
+    return random.choice(options) if options else None
+
+
+def ask_for_next(session, language=DEFAULT_LANGUAGE):
+    """Question for the next missing field, preferring a precomputed LLM phrasing."""
+    missing = missing_fields(session)
+    if not missing:
+        return None
+    phrasing = _cached_phrasing(language, missing)
+    if phrasing:
+        _count("phrasing_cache_replies")
+        return phrasing
+    _count("template_replies")
+    return TEMPLATES[language]["ask"][missing[0]]
+
+
+def render_prompt(session, intent_name, extracted, language_code=None):
+    """
+    Builds the reply for an incomplete session without calling the LLM.
+
+    Args:
+        session (dict): Merged session state after this turn
+        intent_name (str): Dialogflow intent display name
+        extracted (dict): Fields extracted from this turn (values may be None)
+        language_code (str): Dialogflow languageCode
+
+    Returns:
+        str or None: The reply, or None when the turn can't be classified
+        and the LLM should answer instead
+    """
+    language = normalize_language(language_code)
+    templates = TEMPLATES[language]
+
+    if intent_name in GREETING_INTENTS:
+        opener = templates["greeting"]
+    elif intent_name in INTENT_FIELDS:
+        field = INTENT_FIELDS[intent_name]
+        if extracted.get(field):
+            opener = templates["ack"][field].format(claimant_name=session.get("claimant_name") or "")
+        elif not session.get(field):
+            # Nothing usable extracted: ask for the same detail again
+            _count("template_replies")
+            return f"{templates['missed'][field]} {templates['ask'][field]}"
+        else:
+            opener = templates["missed"][field]
+    else:
+        return None
+
+    question = ask_for_next(session, language)
+    return f"{opener} {question}" if question else opener
+
+
+def fallback_prompt(session, language_code=None):
+    """Template question used when the LLM call fails or times out."""
+    language = normalize_language(language_code)
+    return ask_for_next(session, language) or TEMPLATES[language]["ask"][FIELD_ORDER[0]]
+
+
+# --- Offline precomputation ---
+
+async def precompute_phrasings(path=PROMPT_PHRASINGS_FILE, variants=3, languages=("en",)):
+    """
+    Asks the LLM for a few phrasings of the next question for every set of
+    missing fields and saves them to path. Run offline, never on the webhook path.
+    """
+    from app.langchain_helper import phrase_question
+
+    phrasings = {}
+    for language in languages:
+        phrasings[language] = {}
+        for size in range(1, len(FIELD_ORDER) + 1):
+            for missing in combinations(FIELD_ORDER, size):
+                options = []
+                for _ in range(variants):
+                    text = await phrase_question(list(missing), language)
+                    if text and text not in options:
+                        options.append(text)
+                phrasings[language][phrasing_key(missing)] = options
+                log.info("%s [%s]: %s phrasing(s)", language, phrasing_key(missing), len(options))
+
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(phrasings, f, ensure_ascii=False, indent=2)
+    log.info("Saved prompt phrasings to %s", path)
+
+
+if __name__ == "__main__":
+    import argparse
+    import asyncio
+
+    parser = argparse.ArgumentParser(description="Precompute LLM phrasings for missing-field prompts.")
+    parser.add_argument("--out", default=PROMPT_PHRASINGS_FILE)
+    parser.add_argument("--variants", type=int, default=3)
+    parser.add_argument("--languages", default="en", help="comma-separated, e.g. en,es")
+    args = parser.parse_args()
+    asyncio.run(precompute_phrasings(args.out, args.variants, tuple(args.languages.split(","))))
@@ -1,13 +1,36 @@
-from fastapi import APIRouter, Request, UploadFile, File
-from fastapi.responses import JSONResponse, HTMLResponse
+from fastapi import APIRouter, Request, UploadFile, File, Header
+from fastapi.responses import JSONResponse, HTMLResponse, Response, StreamingResponse
 from uuid import uuid4
-from app.db_helper import get_db_connection
+from app.db_helper import run_db, DatabaseUnavailableError
+from app.session_store import upsert_session
 from app.langchain_helper import chat_with_groq
+from app.prompt_engine import render_prompt, fallback_prompt
+from app.deadline import Deadline
+from app.job_queue import vision_jobs, JobQueueFullError
+from app.upload_helper import stream_upload_to_disk, discard_upload, UploadRejectedError
+from app.storage import storage, record_photos, object_ref, OBJECT_KEY_RE, content_type_of
+from app.claim_analysis import photo_reports, join_refs, CLAIM_MAX_PHOTOS
+from app.batch_analyzer import run_batch, BatchProgress, BATCH_CONCURRENCY, BATCH_RPM
+from app.damage_report import find_claims_by_severity, find_claims_by_plate, parse_damage_report
+from app.photo_index import photo_index
+from app.policy_index import policy_index
+from app.webhook_dedup import webhook_dedup
+from app.claims_export import stream_export, export_filename, ExportBusyError, EXPORT_FORMATS
+from app.claims_query import (
+    list_claims, get_claim, parse_fields, serialize_claim, InvalidQueryError, CLAIM_FIELDS, MAX_PAGE_SIZE
+)
+from app.schemas import SEVERITY_LEVELS
+from app.metrics import stage
+from app.logger import get_logger, bind
+from datetime import date, datetime
+from typing import List
+import asyncio
+import hmac
 import os
 import re
-from .image_processor import analyze_car_damage
 
 router = APIRouter()
+log = get_logger(__name__)
 
 # --- Helpers ---
 
@@ -15,9 +38,10 @@ REQUIRED_FIELDS = ["date_time_of_incident", "policy_number", "vehicle_info", "in
 
 def send_claim_summary(session_id, analysis_text):
     """Generates the final report log."""
-    # Log to terminal (Replace with actual SMTP logic if needed)
-    print(f"📧 EMAIL REPORT GENERATED for Session {session_id}")
-    print(f"Analysis: {analysis_text}")
+    # Log only (Replace with actual SMTP logic if needed); the report text holds the plate, so it isn't logged
+    report = parse_damage_report(analysis_text)
+    log.info("Email report generated", extra={"session_id": session_id, "severity": report.severity if report else None,
+                                               "chars": len(analysis_text or "")})
 
 def clean_extract(keys, param_dict):
     """Safely extracts strings from Dialogflow's mixed-type parameters."""
@@ -32,118 +56,432 @@ def clean_extract(keys, param_dict):
                 return str(val).strip()
     return None
 
+def is_admin(token):
+    """Checks the X-Admin-Token header against ADMIN_API_TOKEN (admin routes are off when it is unset)."""
+    expected = os.getenv("ADMIN_API_TOKEN")
+    return bool(expected and token and hmac.compare_digest(token, expected))
+
+# Dialogflow follow-up event: the interim reply asks Dialogflow to re-invoke the webhook
+# right away (fresh ~5s budget) so a slow vision result is still delivered on this turn.
+# The agent needs an intent with this event and webhook fulfillment enabled.
+FOLLOWUP_EVENT = os.getenv("WEBHOOK_FOLLOWUP_EVENT", "claim_followup")
+MAX_FOLLOWUPS = int(os.getenv("WEBHOOK_MAX_FOLLOWUPS", 2))
+STILL_ANALYZING = "I'm still analyzing your photo. Send me any message in a moment and I'll share the results."
+PHOTO_RECEIVED = ("Thanks, I've received your photo and I'm analyzing it now. "
+                  "Send me any message in a moment and I'll share the results.")
+
+def followup_reply(language_code, attempt):
+    """Interim reply that triggers FOLLOWUP_EVENT instead of showing text."""
+    return {
+        "followupEventInput": {
+            "name": FOLLOWUP_EVENT,
+            "languageCode": language_code or "en-US",
+            "parameters": {"followup_attempt": attempt},
+        }
+    }
+
+def report_reply(claimant_name, damage_report):
+    return {
+        "fulfillmentText": (f"Thank you, {claimant_name or 'there'}. I have analyzed your photo. "
+                            f"Analysis: {damage_report}. Your claim is now being processed."),
+        "endInteraction": True
+    }
+
+async def collect_vision_result(job_id, claimant_name, deadline, language_code, attempt, pending_text=STILL_ANALYZING):
+    """Waits for a vision job within the budget; hands over to a follow-up event if it isn't done yet."""
+    if vision_jobs.paused_for():
+        return {"fulfillmentText": pending_text}  # vision circuit open: the job waits in the queue
+    outcome = await vision_jobs.wait_for_result(job_id, deadline)
+    if outcome and outcome["status"] == "done":
+        return report_reply(claimant_name, outcome["result"])
+    if outcome:
+        return {"fulfillmentText": "Sorry, I couldn't analyze that photo. Could you send another one?"}
+    if attempt < MAX_FOLLOWUPS:
+        return followup_reply(language_code, attempt + 1)
+    return {"fulfillmentText": pending_text}
+
+# Completed vision jobs trigger the claim report
+vision_jobs.add_completion_hook(send_claim_summary)
+# Every new photo (upload or URL) is fingerprinted and screened for reuse across claims
+vision_jobs.add_ingest_hook(photo_index.screen)
+
+# Single in-process bulk analysis run (started via /admin/reanalyze)
+batch_state = {"task": None, "progress": None}
+
 # --- Routes ---
 
 @router.get("/upload-image/{session_id}")
 async def upload_page(session_id: str):
     html = f"""
     <html><body style='font-family: sans-serif; text-align: center; padding: 50px;'>
-        <h3>Upload Damage Photo</h3>
+        <h3>Upload Damage Photos</h3>
         <p>Session ID: {session_id}</p>
+        <p>Select up to {CLAIM_MAX_PHOTOS} photos (different angles, close-ups, the license plate).</p>
         <form action='/upload-image/{session_id}' method='post' enctype='multipart/form-data'>
-            <input type='file' name='file' accept='image/*' required><br><br>
-            <input type='submit' value='Upload Photo' style='padding: 10px 20px;'>
+            <input type='file' name='files' accept='image/*' multiple required><br><br>
+            <input type='submit' value='Upload Photos' style='padding: 10px 20px;'>
         </form>
     </body></html>
     """
     return HTMLResponse(content=html)
 
 @router.post("/upload-image/{session_id}")
-async def process_upload(session_id: str, file: UploadFile = File(...)):
-    conn = None
+async def process_upload(session_id: str, files: List[UploadFile] = File(None), file: UploadFile = File(None)):
+    bind(session_id=session_id)
+    uploads = [f for f in (files or []) + ([file] if file else []) if f.filename]  # 'file': single-photo form
+    if not uploads:
+        return JSONResponse(status_code=400, content={"error": "No photo uploaded"})
+    if len(uploads) > CLAIM_MAX_PHOTOS:
+        return JSONResponse(status_code=400, content={"error": f"At most {CLAIM_MAX_PHOTOS} photos per upload"})
     try:
-        # 1. Save file using absolute path
-        BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
-        UPLOAD_DIR = os.path.join(BASE_DIR, "app", "data", "uploads")
-        os.makedirs(UPLOAD_DIR, exist_ok=True)
-        
-        path = os.path.join(UPLOAD_DIR, f"{session_id}_{file.filename}")
-        with open(path, "wb") as f:
-            f.write(await file.read())
-        
-        # 2. Vision Analysis
-        print(f"--- 🔍 Starting Analysis for Session: {session_id} ---")
-        damage_report = analyze_car_damage(path)
-        
-        # 3. Trigger Report
-        send_claim_summary(session_id, damage_report)
+        # 1. Stream each photo to a staging file. All of them are checked before any is stored, so a
+        #    rejected photo leaves nothing of the upload behind (stored objects can't be deleted: the
+        #    store is content-addressed and another claim may share the object)
+        staged = []
+        photos = []
+        try:
+            for upload_file in uploads:
+                try:
+                    with stage("upload.write"):
+                        upload = await stream_upload_to_disk(upload_file, storage.staging_path())
+                except UploadRejectedError as reject:
+                    log.warning("Upload rejected: %s", reject, extra={"upload_filename": upload_file.filename})
+                    return JSONResponse(status_code=reject.status_code,
+                                        content={"error": f"{upload_file.filename}: {reject}"})
+                staged.append((upload, os.path.basename(upload_file.filename or "")))
+
+            # 2. Move them into the content-addressed store (named by their hash, so the client's
+            #    filename is only kept as metadata and duplicates are stored once)
+            with stage("upload.store"):
+                while staged:
+                    upload, filename = staged.pop(0)  # put_file consumes the staging file either way
+                    photos.append((await storage.put_file(upload.path, upload.sha256, upload.format, upload.size),
+                                   filename))
+        finally:
+            for upload, _ in staged:
+                await discard_upload(upload)
+        await run_db(record_photos, session_id, photos)
+        log.info("Stored %s photo(s)", len(photos), extra={
+            "object_keys": [stored.key for stored, _ in photos],
+            "deduplicated": sum(stored.deduplicated for stored, _ in photos),
+        })
         
-        # 4. Update DB
-        conn = get_db_connection()
-        if conn:
-            cursor = conn.cursor()
-            cursor.execute("UPDATE insurance_sessions SET photo_uploaded = TRUE WHERE session_id = %s", (session_id,))
-            conn.commit()
+        # 3. Queue Vision Analysis: one job for the whole upload, so its photos are analysed
+        #    together (app/claim_analysis.py) and written to claim_photos and insurance_sessions
+        refs = list(dict.fromkeys(object_ref(stored.key) for stored, _ in photos))
+        try:
+            job_id = await vision_jobs.submit(session_id, join_refs(refs),
+                                              image_hash=photos[0][0].sha256 if len(refs) == 1 else None)
+        except JobQueueFullError as queue_err:
+            log.warning("%s", queue_err)
+            return JSONResponse(status_code=503, content={"error": "Too many photos are being analyzed. Please try again shortly."})
+        log.info("Queued vision job", extra={"job_id": job_id, "photos": len(refs)})
         
         return HTMLResponse(content=f"""
             <html><body style='font-family: Arial; text-align: center; padding: 100px;'>
                 <h1 style='color: green;'>Upload Successful! ✅</h1>
-                <p><strong>AI Analysis:</strong> {damage_report}</p>
+                <p>{'Your photo is' if len(refs) == 1 else f'Your {len(refs)} photos are'} being analyzed (job <a href='/jobs/{job_id}'>{job_id}</a>).</p>
                 <p>You can now close this tab and return to the chat.</p>
             </body></html>
-        """)
+        """, status_code=202)
 
+    except DatabaseUnavailableError:
+        return JSONResponse(status_code=503, content={"error": "Database connection error. Please try again later."})
     except Exception as e:
-        print(f"❌ Error in process_upload: {e}")
-        import traceback
-        traceback.print_exc()
+        log.exception("Error in process_upload")
         return JSONResponse(status_code=500, content={"error": str(e)})
-    finally:
-        if conn and conn.open:
-            conn.close()
+
+# Objects never change (the key is their hash): cache forever, revalidate never
+PHOTO_CACHE_CONTROL = "public, max-age=31536000, immutable"
+
+def parse_byte_range(header, size):
+    """
+    Single 'bytes=' range -> (start, end) inclusive; None means serve the whole object.
+
+    Raises:
+        ValueError: Unsatisfiable range (answer 416)
+    """
+    if not header or not header.startswith("bytes=") or "," in header:
+        return None  # absent, other units or multiple ranges: a full 200 response is allowed
+    first, _, last = header[6:].strip().partition("-")
+    try:
+        if first:
+            start = int(first)
+            end = min(int(last), size - 1) if last else size - 1
+        elif last:
+            start, end = max(size - int(last), 0), size - 1  # suffix: the last N bytes
+        else:
+            return None
+    except ValueError:
+        return None
+    if start >= size or start > end:
+        raise ValueError(header)
+    return start, end
+
+@router.api_route("/photos/{key}", methods=["GET", "HEAD"])
+async def serve_photo(key: str, request: Request):
+    """Stored claim photo with a strong ETag, immutable caching and byte-range support."""
+    match = OBJECT_KEY_RE.match(key)
+    size = await storage.size(key) if match else None
+    if size is None:
+        return JSONResponse(status_code=404, content={"error": "Photo not found"})
+
+    etag = f'"{match.group(1)}"'
+    headers = {"ETag": etag, "Cache-Control": PHOTO_CACHE_CONTROL, "Accept-Ranges": "bytes"}
+    if etag in [tag.strip() for tag in request.headers.get("if-none-match", "").split(",")]:
+        return Response(status_code=304, headers=headers)
+
+    byte_range = None
+    if request.headers.get("if-range", etag) == etag:
+        try:
+            byte_range = parse_byte_range(request.headers.get("range"), size)
+        except ValueError:
+            return Response(status_code=416, headers={**headers, "Content-Range": f"bytes */{size}"})
+
+    start, end = byte_range or (0, size - 1)
+    headers["Content-Length"] = str(end - start + 1)
+    status = 200
+    if byte_range:
+        status = 206
+        headers["Content-Range"] = f"bytes {start}-{end}/{size}"
+    if request.method == "HEAD" or size == 0:
+        return Response(status_code=status, headers=headers, media_type=content_type_of(key))
+    return StreamingResponse(storage.iter_range(key, start, end), status_code=status,
+                             headers=headers, media_type=content_type_of(key))
+
+@router.get("/jobs/{job_id}")
+async def job_status(job_id: str):
+    try:
+        job = await vision_jobs.get_job(job_id)
+    except DatabaseUnavailableError:
+        return JSONResponse(status_code=503, content={"error": "Database connection error. Please try again later."})
+    if not job:
+        return JSONResponse(status_code=404, content={"error": f"Job {job_id} not found"})
+    return {
+        "job_id": job["job_id"],
+        "session_id": job["session_id"],
+        "status": job["status"],
+        "attempts": job["attempts"],
+        "result": job["result"],
+        "error": job["error"],
+        "created_at": str(job["created_at"]),
+        "updated_at": str(job["updated_at"]),
+    }
+
+@router.post("/admin/reanalyze")
+async def start_reanalysis(request: Request, x_admin_token: str = Header(None)):
+    if not is_admin(x_admin_token):
+        return JSONResponse(status_code=403, content={"error": "Forbidden"})
+    task = batch_state["task"]
+    if task and not task.done():
+        return JSONResponse(status_code=409, content={"error": "A bulk analysis is already running",
+                                                      "progress": batch_state["progress"].snapshot()})
+
+    try:
+        options = await request.json() if await request.body() else {}
+        concurrency = int(options.get("concurrency", BATCH_CONCURRENCY))
+        rpm = float(options.get("rpm", BATCH_RPM))
+    except (ValueError, TypeError, AttributeError):
+        return JSONResponse(status_code=400, content={"error": "Body must be a JSON object with numeric "
+                                                               "concurrency / rpm"})
+    progress = BatchProgress()
+    batch_state["progress"] = progress
+    batch_state["task"] = asyncio.create_task(run_batch(
+        concurrency=concurrency,
+        rpm=rpm,
+        force=bool(options.get("force", False)),
+        run_id=options.get("run_id"),
+        progress=progress
+    ))
+    log.info("Bulk vision analysis started", extra={"options": options})
+    return JSONResponse(status_code=202, content={"status": "started", "progress": progress.snapshot()})
+
+@router.get("/admin/reanalyze")
+async def reanalysis_status(x_admin_token: str = Header(None)):
+    if not is_admin(x_admin_token):
+        return JSONResponse(status_code=403, content={"error": "Forbidden"})
+    if batch_state["progress"] is None:
+        return {"status": "idle"}
+    return {"status": "running" if batch_state["progress"].running else "finished",
+            "progress": batch_state["progress"].snapshot()}
+
+@router.get("/claims")
+async def claims_page(policy_number: str = None, complete: bool = None, fields: str = None, cursor: str = None,
+                      limit: int = 50, x_admin_token: str = Header(None)):
+    """
+    Claims, newest first, one page at a time. Pass the returned next_cursor
+    to get the following page; fields=a,b,c picks columns (the large TEXT
+    ones are left out unless named).
+    """
+    if not is_admin(x_admin_token):
+        return JSONResponse(status_code=403, content={"error": "Forbidden"})
+    try:
+        columns = parse_fields(fields)
+        rows, next_cursor = await run_db(list_claims, columns, policy_number, complete, cursor,
+                                         min(max(limit, 1), MAX_PAGE_SIZE))
+    except InvalidQueryError as e:
+        return JSONResponse(status_code=400, content={"error": str(e)})
+    except DatabaseUnavailableError:
+        return JSONResponse(status_code=503, content={"error": "Database connection error. Please try again later."})
+    return {"count": len(rows), "claims": [serialize_claim(row) for row in rows], "next_cursor": next_cursor}
+
+@router.get("/claims/{session_id}")
+async def claim_detail(session_id: str, fields: str = None, x_admin_token: str = Header(None)):
+    """One claim with every column (or just fields=a,b,c)."""
+    if not is_admin(x_admin_token):
+        return JSONResponse(status_code=403, content={"error": "Forbidden"})
+    try:
+        row = await run_db(get_claim, session_id, parse_fields(fields, default=CLAIM_FIELDS))
+    except InvalidQueryError as e:
+        return JSONResponse(status_code=400, content={"error": str(e)})
+    except DatabaseUnavailableError:
+        return JSONResponse(status_code=503, content={"error": "Database connection error. Please try again later."})
+    if row is None:
+        return JSONResponse(status_code=404, content={"error": "Claim not found"})
+    return serialize_claim(row)
+
+@router.get("/claims/{session_id}/photos")
+async def claim_photos(session_id: str, x_admin_token: str = Header(None)):
+    """Each photo of a claim with its own analysis (the claim's report is their aggregate)."""
+    if not is_admin(x_admin_token):
+        return JSONResponse(status_code=403, content={"error": "Forbidden"})
+    try:
+        rows = await run_db(photo_reports, session_id)
+    except DatabaseUnavailableError:
+        return JSONResponse(status_code=503, content={"error": "Database connection error. Please try again later."})
+    photos = [{**serialize_claim(row), "url": f"/photos/{row['object_key']}"} for row in rows]
+    return {"session_id": session_id, "count": len(photos), "photos": photos}
+
+@router.get("/admin/export/claims")
+async def export_claims(format: str = "ndjson", since: str = None, until: str = None, gzip: bool = False,
+                        fields: str = None, x_admin_token: str = Header(None)):
+    """Streams every claim created in [since, until) as NDJSON or CSV, optionally gzipped."""
+    if not is_admin(x_admin_token):
+        return JSONResponse(status_code=403, content={"error": "Forbidden"})
+    if format not in EXPORT_FORMATS:
+        return JSONResponse(status_code=400, content={"error": f"format must be one of: {', '.join(EXPORT_FORMATS)}"})
+    try:
+        since_date = datetime.fromisoformat(since) if since else None
+        until_date = datetime.fromisoformat(until) if until else None
+        columns = parse_fields(fields, default=CLAIM_FIELDS)
+    except ValueError as e:  # includes InvalidQueryError
+        return JSONResponse(status_code=400, content={"error": f"Invalid parameter: {e}"})
+
+    stream = stream_export(columns, since_date, until_date, format, gzip)
+    try:
+        # Prime the stream so a busy or unreachable DB is a clean error, not a truncated 200
+        first = await stream.__anext__()
+    except StopAsyncIteration:
+        first = b""
+    except ExportBusyError as e:
+        return JSONResponse(status_code=429, content={"error": str(e)})
+    except DatabaseUnavailableError:
+        return JSONResponse(status_code=503, content={"error": "Database connection error. Please try again later."})
+
+    async def body():
+        yield first
+        try:
+            async for chunk in stream:
+                yield chunk
+        except Exception:
+            log.exception("Claims export failed mid-stream")  # the client sees a truncated file
+
+    filename = export_filename(format, since_date, until_date, gzip)
+    return StreamingResponse(body(), media_type="application/gzip" if gzip else EXPORT_FORMATS[format],
+                             headers={"Content-Disposition": f'attachment; filename="{filename}"'})
+
+@router.get("/admin/photos/near-duplicates/{session_id}")
+async def near_duplicate_photos(session_id: str, x_admin_token: str = Header(None)):
+    """Photos in other claims that look like this claim's photos (perceptual-hash distance)."""
+    if not is_admin(x_admin_token):
+        return JSONResponse(status_code=403, content={"error": "Forbidden"})
+    try:
+        matches = await photo_index.similar_to_session(session_id)
+    except DatabaseUnavailableError:
+        return JSONResponse(status_code=503, content={"error": "Database connection error. Please try again later."})
+    return {"session_id": session_id, "count": len(matches), "matches": matches}
+
+@router.get("/admin/triage")
+async def triage_claims(severity: str = None, plate: str = None, since: str = None, limit: int = 100,
+                        x_admin_token: str = Header(None)):
+    """Claims by damage severity (created since a date, default today) or by license plate."""
+    if not is_admin(x_admin_token):
+        return JSONResponse(status_code=403, content={"error": "Forbidden"})
+    limit = min(max(limit, 1), 500)
+    try:
+        if plate:
+            rows = await run_db(find_claims_by_plate, plate, limit)
+        elif severity and severity.capitalize() in SEVERITY_LEVELS:
+            try:
+                since_date = datetime.fromisoformat(since) if since else datetime.combine(date.today(), datetime.min.time())
+            except ValueError:
+                return JSONResponse(status_code=400, content={"error": "since must be an ISO date, e.g. 2026-01-20"})
+            rows = await run_db(find_claims_by_severity, severity.capitalize(), since_date, limit)
+        else:
+            return JSONResponse(status_code=400, content={"error": f"Pass plate, or severity ({', '.join(SEVERITY_LEVELS)})"})
+    except DatabaseUnavailableError:
+        return JSONResponse(status_code=503, content={"error": "Database connection error. Please try again later."})
+    claims = [{**row, "damage_confidence": float(row["damage_confidence"]) if row["damage_confidence"] is not None else None,
+               "created_at": str(row["created_at"])} for row in rows]
+    return {"count": len(claims), "claims": claims}
 
 @router.post("/webhook")
 async def dialogflow_webhook(request: Request):
-    conn = None
+    deadline = Deadline()
     try:
         payload = await request.json()
-        print(f"DEBUG: Full Dialogflow Payload: {payload}")
-        
+        request.state.intent = payload.get('queryResult', {}).get('intent', {}).get('displayName') or "unknown"
+        response_id = payload.get('responseId')
+    except Exception:
+        log.exception("Webhook error")
+        return {"fulfillmentText": "I'm having a technical issue. Can we try that again?"}
+    # Dialogflow retries slow fulfillment with the same responseId: each turn is handled once
+    return await webhook_dedup.run(response_id, lambda: handle_webhook_turn(payload, deadline))
+
+
+async def handle_webhook_turn(payload, deadline):
+    try:
         session_path = payload.get('session', '')
         session_id = session_path.split('/')[-1] if session_path else str(uuid4())
+        bind(session_id=session_id)
+        log.debug("Dialogflow payload", extra={"payload": payload})  # sampled, PII redacted
         
         query_result = payload.get('queryResult', {})
         user_input = query_result.get('queryText', '')
         intent_name = query_result.get('intent', {}).get('displayName', '')
         parameters = query_result.get('parameters', {})
-
-        conn = get_db_connection()
-        if conn is None:
-            return {"fulfillmentText": "Database connection error. Please try again later."}
-            
-        cursor = conn.cursor()
-
-        # Ensure Session Exists
-        cursor.execute("SELECT * FROM insurance_sessions WHERE session_id = %s", (session_id,))
-        existing_row = cursor.fetchone()
-        if not existing_row:
-            cursor.execute("INSERT INTO insurance_sessions (session_id) VALUES (%s)", (session_id,))
-            conn.commit()
-            existing_row = {f: None for f in REQUIRED_FIELDS}
+        language_code = query_result.get('languageCode')
+        followup_attempt = 0
+        if FOLLOWUP_EVENT in (intent_name, user_input) or parameters.get("followup_attempt"):
+            followup_attempt = int(float(parameters.get("followup_attempt") or 1))
+            user_input = ""  # the event name, not something the user said
 
         # Parameter Extraction
         new_data = {}
         
         # Global URL Detection (Works across any intent)
+        photo_url = None
         url_match = re.search(r'(https?://\S+\.(?:png|jpg|jpeg|webp|gif))', user_input)
         if url_match:
             photo_url = url_match.group(0)
-            print(f"📸 Detected Image URL in user input: {photo_url}")
-            try:
-                damage_report = analyze_car_damage(photo_url)
-                print(f"Groq Analysis Result: {damage_report}")
-                new_data["damage_report"] = damage_report
-                new_data["photo_uploaded"] = True
-            except Exception as vision_err:
-                print(f"❌ Vision Analysis Error: {vision_err}")
-                new_data["damage_report"] = f"Vision analysis failed: {vision_err}"
-
+            log.info("Detected image URL in user input", extra={"url": photo_url})
 
         if intent_name == "provide_policy_number":
             extracted = clean_extract(["policy_number", "number"], parameters)
             if not extracted:
                 match = re.search(r'([A-Z0-9-]{4,15})', user_input.upper())
                 extracted = match.group(0) if match else None
+            if extracted:
+                # In-memory index: unknown numbers are answered here, before any DB or LLM call
+                check = policy_index.check(extracted)
+                if check.status == "suggest":
+                    return {"fulfillmentText": f"I couldn't find policy number {extracted}. "
+                                               f"Did you mean {' or '.join(check.suggestions)}?"}
+                if check.status == "invalid":
+                    return {"fulfillmentText": f"I couldn't find policy number {extracted}. "
+                                               "Please check it and send it again."}
+                if check.policy_number:  # valid, or a one-character OCR/typing slip corrected
+                    extracted = check.policy_number
             new_data["policy_number"] = extracted
         elif intent_name == "provide_date_time":
             new_data["date_time_of_incident"] = clean_extract(["date", "date-time", "time"], parameters)
@@ -152,25 +490,43 @@ async def dialogflow_webhook(request: Request):
         elif intent_name == "provide_name":
             new_data["claimant_name"] = clean_extract(["claimant_name", "person", "name"], parameters)
         elif intent_name == "describe_incident":
-            if "damage_report" not in new_data:
+            if not photo_url:
                 new_data["incident_description"] = user_input
 
 
-        # Database Update
-        updates = [f"{field} = %s" for field, val in new_data.items() if val is not None]
-        vals = [val for val in new_data.values() if val is not None]
-        if updates:
-            sql = f"UPDATE insurance_sessions SET {', '.join(updates)} WHERE session_id = %s"
-            vals.append(session_id)
-            cursor.execute(sql, tuple(vals))
-            conn.commit()
+        # Database Sync (runs on the DB executor, off the event loop)
+        try:
+            with stage("webhook.session_sync"):
+                full_session = await run_db(upsert_session, session_id, new_data, deadline=deadline)
+        except DatabaseUnavailableError:
+            return {"fulfillmentText": "Database connection error. Please try again later."}
 
-        # Fetch State
-        cursor.execute("SELECT * FROM insurance_sessions WHERE session_id = %s", (session_id,))
-        full_session = cursor.fetchone()
+        # Queue Vision Analysis (answered within the budget if it is fast, else via follow-up events)
+        if photo_url:
+            try:
+                job_id = await vision_jobs.submit(session_id, photo_url, deadline=deadline)
+                log.info("Queued vision job", extra={"job_id": job_id})
+            except JobQueueFullError as queue_err:
+                log.warning("%s", queue_err)
+                return {"fulfillmentText": "We're analyzing a lot of photos right now. Please send the link again in a minute."}
+            except DatabaseUnavailableError:
+                return {"fulfillmentText": "Database connection error. Please try again later."}
+            return await collect_vision_result(job_id, full_session.get('claimant_name'), deadline,
+                                               language_code, followup_attempt, pending_text=PHOTO_RECEIVED)
 
         # Check Completion
         is_complete = all(full_session.get(f) for f in REQUIRED_FIELDS)
+
+        if (is_complete or followup_attempt) and not full_session.get('damage_report'):
+            try:
+                latest_job = await vision_jobs.latest_job_for_session(session_id, deadline=deadline)
+            except DatabaseUnavailableError:
+                latest_job = None
+            if latest_job and latest_job["status"] in ("queued", "running"):
+                return await collect_vision_result(latest_job["job_id"], full_session.get('claimant_name'),
+                                                   deadline, language_code, followup_attempt)
+            if latest_job and latest_job["status"] == "done" and latest_job["result"]:
+                return report_reply(full_session.get('claimant_name'), latest_job["result"])
         
         if is_complete or full_session.get('damage_report'):
             # Detect Public URL (Render) or fallback to localhost
@@ -189,16 +545,15 @@ async def dialogflow_webhook(request: Request):
                 "endInteraction": True
             }
 
-        # Not complete? Get next question from AI
-        ai_reply = chat_with_groq(user_input, full_session)
-        return {"fulfillmentText": ai_reply}
+        # Not complete? Ask for the next missing field (template fast path, LLM only for unclassified turns)
+        if followup_attempt:
+            return {"fulfillmentText": fallback_prompt(full_session, language_code)}
+        reply = render_prompt(full_session, intent_name, new_data, language_code)
+        if reply is None:
+            reply = await chat_with_groq(user_input, full_session, language_code, deadline=deadline)
+        return {"fulfillmentText": reply}
 
 
-    except Exception as e:
-        print(f"❌ Webhook Error: {e}")
-        import traceback
-        traceback.print_exc()
-        return {"fulfillmentText": "I'm having a technical issue. Can we try that again?"}
-    finally:
-        if conn and conn.open:
-            conn.close()
\ No newline at end of file
+    except Exception:
+        log.exception("Webhook error")
+        return {"fulfillmentText": "I'm having a technical issue. Can we try that again?"}
\ No newline at end of file
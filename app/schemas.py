@@ -1,6 +1,7 @@
 # Pydantic Schemas
-from pydantic import BaseModel
-from typing import Optional, Dict, Any
+import re
+from pydantic import BaseModel, Field, field_validator
+from typing import Optional, Dict, Any, Literal
 
 # Schema for the Dialogflow Webhook Request
 class DialogflowRequest(BaseModel):
@@ -10,4 +11,41 @@ class DialogflowRequest(BaseModel):
 
 # Schema for the JSON we send back to Dialogflow
 class DialogflowResponse(BaseModel):
-    fulfillmentMessages: list
\ No newline at end of file
+    fulfillmentMessages: list
+
+# Structured output of the vision model (see app/damage_report.py)
+SEVERITY_LEVELS = ("Low", "Medium", "High")
+PLATE_PLACEHOLDERS = {"NONE", "NA", "NULL", "UNKNOWN", "NOTVISIBLE"}
+
+class DamageReport(BaseModel):
+    license_plate: Optional[str] = None
+    severity: Optional[Literal["Low", "Medium", "High"]] = None
+    description: str = ""
+    confidence: float = Field(default=0.0, ge=0.0, le=1.0)
+
+    @field_validator("license_plate", mode="before")
+    @classmethod
+    def normalize_plate(cls, value):
+        """Uppercase alphanumerics only, so plate lookups are exact index matches."""
+        if value is None:
+            return None
+        plate = re.sub(r"[^A-Z0-9]", "", str(value).upper())
+        if len(plate) < 2 or plate in PLATE_PLACEHOLDERS:
+            return None
+        return plate[:20]
+
+    @field_validator("severity", mode="before")
+    @classmethod
+    def normalize_severity(cls, value):
+        if value is None:
+            return None
+        value = str(value).strip().capitalize()
+        return value if value in SEVERITY_LEVELS else None
+
+    @field_validator("confidence", mode="before")
+    @classmethod
+    def clamp_confidence(cls, value):
+        try:
+            return min(max(float(value), 0.0), 1.0)
+        except (TypeError, ValueError):
+            return 0.0
@@ -0,0 +1,86 @@
+# Session-state data access for insurance_sessions
+# Functions here are blocking and take a pymysql connection; run them through db_helper.run_db.
+
+# Columns a webhook turn may write (guards the dynamic SQL below)
+WRITABLE_COLUMNS = {
+    "policy_number", "claimant_name", "date_time_of_incident", "vehicle_info",
+    "incident_description", "photo_uploaded", "damage_report",
+}
+
+SESSION_DEFAULTS = {
+    "policy_number": None,
+    "claimant_name": None,
+    "date_time_of_incident": None,
+    "vehicle_info": None,
+    "incident_description": None,
+    "photo_uploaded": False,
+    "damage_report": None,
+    "license_plate": None,
+    "damage_severity": None,
+    "damage_confidence": None,
+    "near_duplicate_of": None,
+    "near_duplicate_distance": None,
+    "created_at": None,
+    "updated_at": None,
+}
+
+
+def _changed_fields(row, new_data):
+    """Non-empty values in new_data that differ from the stored row."""
+    changes = {}
+    for field, val in new_data.items():
+        if val is None:
+            continue
+        if field not in WRITABLE_COLUMNS:
+            raise ValueError(f"Unknown session column: {field}")
+        if row is None or row.get(field) != val:
+            changes[field] = val
+    return changes
+
+
+def upsert_session(conn, session_id, new_data):
+    """
+    Applies one webhook turn to a session and returns the merged session state.
+
+    Reads the row once, merges new_data in memory and, only when something
+    changed (or the session is new), writes it with a single
+    INSERT ... ON DUPLICATE KEY UPDATE. Only the changed columns are written,
+    so concurrent writes to other columns (e.g. a vision job saving
+    damage_report) are preserved.
+
+    Round trips per turn: 2 when nothing changed (SELECT, ROLLBACK), 3 otherwise
+    (SELECT, upsert, COMMIT). Either way no transaction is left open.
+
+    Args:
+        conn (pymysql.Connection): Connection with a DictCursor
+        session_id (str): Dialogflow session id
+        new_data (dict): Column values extracted this turn (None values are ignored)
+
+    Returns:
+        dict: The session row as it is after this turn
+    """
+    with conn.cursor() as cursor:
+        cursor.execute("SELECT * FROM insurance_sessions WHERE session_id = %s", (session_id,))
+        row = cursor.fetchone()
+
+        changes = _changed_fields(row, new_data)
+        if row is not None and not changes:
+            conn.rollback()  # ends the read's transaction (and its snapshot) right away
+            return row
+
+        columns = ["session_id"] + list(changes)
+        placeholders = ", ".join(["%s"] * len(columns))
+        if changes:
+            assignments = ", ".join(f"{field} = VALUES({field})" for field in changes)
+        else:
+            assignments = "session_id = session_id"
+        cursor.execute(
+            f"INSERT INTO insurance_sessions ({', '.join(columns)}) VALUES ({placeholders}) "
+            f"ON DUPLICATE KEY UPDATE {assignments}",
+            (session_id, *changes.values())
+        )
+    conn.commit()
+
+    merged = dict(row) if row is not None else {"session_id": session_id, **SESSION_DEFAULTS}
+    merged.update(changes)
+    return merged
@@ -0,0 +1,281 @@
+# Content-addressed photo storage: objects are named by their SHA-256, so identical photos
+# are stored once however many sessions upload them; claim_photos maps sessions to objects.
+import asyncio
+import os
+import re
+import tempfile
+import threading
+from typing import NamedTuple, Optional
+from uuid import uuid4
+from app.config import load_env
+from app.logger import get_logger
+
+load_env()
+
+log = get_logger(__name__)
+
+# Configuration
+STORAGE_BACKEND = os.getenv("STORAGE_BACKEND", "local")  # local | memory (tests, benchmarks)
+STORAGE_DIR = os.getenv(
+    "STORAGE_DIR",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "objects")
+)
+STORAGE_READ_CHUNK = 64 * 1024
+
+# Image references in vision_jobs.image_ref / claim photos look like 'storage://<sha256>.<ext>'
+STORAGE_REF_PREFIX = "storage://"
+EXTENSIONS = {"JPEG": "jpg", "PNG": "png", "WEBP": "webp"}
+CONTENT_TYPES = {"jpg": "image/jpeg", "png": "image/png", "webp": "image/webp"}
+OBJECT_KEY_RE = re.compile(r"^([0-9a-f]{64})\.(jpg|png|webp)$")
+
+
+class StoredObject(NamedTuple):
+    key: str
+    sha256: str
+    size: int
+    content_type: str
+    deduplicated: bool  # the object already existed; nothing new was written
+
+
+def object_key(sha256, image_format):
+    return f"{sha256}.{EXTENSIONS[image_format]}"
+
+
+def object_ref(key):
+    return f"{STORAGE_REF_PREFIX}{key}"
+
+
+def key_from_ref(ref):
+    """'storage://<key>' -> '<key>' (None when ref is not a storage reference or the key is malformed)."""
+    if not ref.startswith(STORAGE_REF_PREFIX):
+        return None
+    key = ref[len(STORAGE_REF_PREFIX):]
+    return key if OBJECT_KEY_RE.match(key) else None
+
+
+def content_type_of(key):
+    return CONTENT_TYPES[key.rsplit(".", 1)[1]]
+
+
+class StorageBackend:
+    """
+    Immutable, content-addressed objects. Subclasses implement _store, _size
+    and _read; the rest (dedup accounting, ranged reads) is shared.
+    """
+
+    name = "base"
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._stats = {"objects_written": 0, "deduplicated": 0, "bytes_written": 0, "bytes_served": 0}
+
+    def _count(self, name, amount=1):
+        with self._lock:
+            self._stats[name] += amount
+
+    def staging_path(self):
+        """A fresh local path to stream an upload into before its hash is known."""
+        directory = os.path.join(tempfile.gettempdir(), "claim-uploads")
+        os.makedirs(directory, exist_ok=True)
+        return os.path.join(directory, f"{uuid4().hex}.upload")
+
+    def local_path(self, key) -> Optional[str]:
+        """Filesystem path of an object, for backends that have one (lets readers skip a copy)."""
+        return None
+
+    async def put_file(self, temp_path, sha256, image_format, size) -> StoredObject:
+        """
+        Moves a finished upload into the store (temp_path is consumed either way).
+        An object with the same hash is kept as is and the upload discarded.
+        """
+        key = object_key(sha256, image_format)
+        created = await asyncio.to_thread(self._store, temp_path, key)
+        if created:
+            self._count("objects_written")
+            self._count("bytes_written", size)
+        else:
+            self._count("deduplicated")
+        return StoredObject(key, sha256, size, content_type_of(key), deduplicated=not created)
+
+    async def size(self, key) -> Optional[int]:
+        """Object size in bytes, or None when it does not exist."""
+        return await asyncio.to_thread(self._size, key)
+
+    async def read(self, key, start=0, end=None) -> Optional[bytes]:
+        """Bytes [start, end] (inclusive; end=None reads to the end), or None when missing."""
+        return await asyncio.to_thread(self._read, key, start, end)
+
+    async def iter_range(self, key, start, end, chunk_size=STORAGE_READ_CHUNK):
+        """Streams bytes [start, end] in chunks (for HTTP responses)."""
+        position = start
+        while position <= end:
+            chunk = await self.read(key, position, min(position + chunk_size, end + 1) - 1)
+            if not chunk:
+                return
+            self._count("bytes_served", len(chunk))
+            position += len(chunk)
+            yield chunk
+
+    def stats(self):
+        with self._lock:
+            return {"backend": self.name, **self._stats}
+
+    def _store(self, temp_path, key):
+        raise NotImplementedError
+
+    def _size(self, key):
+        raise NotImplementedError
+
+    def _read(self, key, start, end):
+        raise NotImplementedError
+
+
+class LocalStorage(StorageBackend):
+    """
+    Objects under root/ab/cd/<sha256>.<ext>: two levels of 256-way sharding
+    keep every directory small however many photos are stored.
+    """
+
+    name = "local"
+
+    def __init__(self, root=STORAGE_DIR):
+        super().__init__()
+        self.root = root
+
+    def _path(self, key):
+        return os.path.join(self.root, key[:2], key[2:4], key)
+
+    def staging_path(self):
+        # Same filesystem as the objects, so storing is a rename/link, not a copy
+        directory = os.path.join(self.root, "tmp")
+        os.makedirs(directory, exist_ok=True)
+        return os.path.join(directory, f"{uuid4().hex}.upload")
+
+    def local_path(self, key):
+        path = self._path(key)
+        return path if os.path.exists(path) else None
+
+    def _store(self, temp_path, key):
+        path = self._path(key)
+        try:
+            if os.path.exists(path):
+                return False
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            try:
+                # link() fails if the name exists: create-if-absent without a race
+                # between workers storing the same photo at the same time
+                os.link(temp_path, path)
+            except FileExistsError:
+                return False
+            except OSError:
+                os.replace(temp_path, path)  # filesystems without hard links
+            return True
+        finally:
+            try:
+                os.remove(temp_path)
+            except OSError:
+                pass
+
+    def _size(self, key):
+        try:
+            return os.path.getsize(self._path(key))
+        except OSError:
+            return None
+
+    def _read(self, key, start, end):
+        try:
+            with open(self._path(key), "rb") as f:
+                f.seek(start)
+                return f.read(-1 if end is None else end - start + 1)
+        except OSError:
+            return None
+
+
+class MemoryStorage(StorageBackend):
+    """In-process stand-in for an object store (tests and benchmarks)."""
+
+    name = "memory"
+
+    def __init__(self):
+        super().__init__()
+        self._objects = {}
+
+    def _store(self, temp_path, key):
+        try:
+            with open(temp_path, "rb") as f:
+                data = f.read()
+        finally:
+            os.remove(temp_path)
+        with self._lock:
+            if key in self._objects:
+                return False
+            self._objects[key] = data
+            return True
+
+    def _size(self, key):
+        data = self._objects.get(key)
+        return None if data is None else len(data)
+
+    def _read(self, key, start, end):
+        data = self._objects.get(key)
+        if data is None:
+            return None
+        return data[start:] if end is None else data[start:end + 1]
+
+
+BACKENDS = {"local": LocalStorage, "memory": MemoryStorage}
+
+
+def create_storage(backend=STORAGE_BACKEND):
+    try:
+        return BACKENDS[backend]()
+    except KeyError:
+        raise ValueError(f"Unknown STORAGE_BACKEND '{backend}' (expected one of: {', '.join(BACKENDS)})")
+
+
+storage = create_storage()
+
+
+def get_storage_stats():
+    return storage.stats()
+
+
+# --- Session -> object index (claim_photos) ---
+
+def record_photos(conn, session_id, photos):
+    """
+    Links objects to a session in one statement; photos is [(StoredObject, original_filename)].
+    Idempotent: re-uploading the same photo adds no row.
+    """
+    with conn.cursor() as cursor:
+        cursor.executemany(
+            """
+            INSERT INTO claim_photos (session_id, object_key, original_filename, size_bytes)
+            VALUES (%s, %s, %s, %s)
+            ON DUPLICATE KEY UPDATE original_filename = VALUES(original_filename)
+            """,
+            [(session_id, stored.key, (filename or "")[:255] or None, stored.size) for stored, filename in photos]
+        )
+    conn.commit()
+
+
+def record_photo(conn, session_id, stored, original_filename=None):
+    """Links an object to a session (idempotent: re-uploading the same photo adds no row)."""
+    record_photos(conn, session_id, [(stored, original_filename)])
+
+
+def photos_for_session(conn, session_id):
+    with conn.cursor() as cursor:
+        cursor.execute(
+            "SELECT object_key, original_filename, size_bytes, created_at FROM claim_photos "
+            "WHERE session_id = %s ORDER BY created_at",
+            (session_id,)
+        )
+        return cursor.fetchall()
+
+
+def stored_photo_refs(conn):
+    """(storage ref, session_id) for every indexed photo, oldest first (bulk re-analysis)."""
+    with conn.cursor() as cursor:
+        cursor.execute("SELECT object_key, session_id FROM claim_photos ORDER BY created_at, id")
+        return [(object_ref(row["object_key"]), row["session_id"]) for row in cursor.fetchall()]
@@ -0,0 +1,109 @@
+import asyncio
+import hashlib
+import os
+from typing import NamedTuple, Optional
+from fastapi import UploadFile
+from app.image_processor import MAX_FILE_SIZE_MB
+
+# Configuration
+UPLOAD_CHUNK_SIZE = 64 * 1024
+MAX_UPLOAD_BYTES = MAX_FILE_SIZE_MB * 1024 * 1024
+SNIFF_BYTES = 12
+
+
+class UploadRejectedError(Exception):
+    """Raised when an upload is refused; carries the HTTP status to answer with."""
+
+    def __init__(self, message, status_code):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+class StoredUpload(NamedTuple):
+    path: str
+    sha256: str
+    size: int
+    format: str
+
+
+def sniff_image_format(header: bytes) -> Optional[str]:
+    """Identifies JPEG, PNG and WEBP from their magic bytes."""
+    if header.startswith(b"\xff\xd8\xff"):
+        return "JPEG"
+    if header.startswith(b"\x89PNG\r\n\x1a\n"):
+        return "PNG"
+    if len(header) >= 12 and header[:4] == b"RIFF" and header[8:12] == b"WEBP":
+        return "WEBP"
+    return None
+
+
+def _remove_quietly(path):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+
+async def stream_upload_to_disk(file: UploadFile, dest_path: str, max_bytes=MAX_UPLOAD_BYTES,
+                                chunk_size=UPLOAD_CHUNK_SIZE) -> StoredUpload:
+    """
+    Copies an UploadFile to dest_path in fixed-size chunks.
+
+    The format is sniffed from the first bytes, the size cap is enforced as
+    soon as it is crossed, and the SHA-256 digest is computed while writing,
+    so memory use is constant whatever the file size. Data is written to a
+    '.part' file that only replaces dest_path once the upload is accepted.
+
+    Raises:
+        UploadRejectedError: 413 when over max_bytes, 415 when not a supported image
+    """
+    declared_size = getattr(file, "size", None)
+    if declared_size is not None and declared_size > max_bytes:
+        raise UploadRejectedError(f"Image too large. Maximum size is {max_bytes // (1024 * 1024)}MB.", 413)
+
+    part_path = f"{dest_path}.part"
+    hasher = hashlib.sha256()
+    size = 0
+    header = b""
+    image_format = None
+
+    out = await asyncio.to_thread(open, part_path, "wb")
+    try:
+        while True:
+            chunk = await file.read(chunk_size)
+            if not chunk:
+                break
+
+            if image_format is None:
+                header += chunk[:SNIFF_BYTES - len(header)]
+                if len(header) >= SNIFF_BYTES:
+                    image_format = sniff_image_format(header)
+                    if image_format is None:
+                        raise UploadRejectedError("Unsupported file type. Allowed: JPEG, PNG, WEBP.", 415)
+
+            size += len(chunk)
+            if size > max_bytes:
+                raise UploadRejectedError(f"Image too large. Maximum size is {max_bytes // (1024 * 1024)}MB.", 413)
+
+            hasher.update(chunk)
+            await asyncio.to_thread(out.write, chunk)
+
+        if image_format is None:
+            # Shorter than the sniff window
+            image_format = sniff_image_format(header)
+            if image_format is None:
+                raise UploadRejectedError("Unsupported file type. Allowed: JPEG, PNG, WEBP.", 415)
+
+        await asyncio.to_thread(out.close)
+        await asyncio.to_thread(os.replace, part_path, dest_path)
+    except BaseException:
+        out.close()
+        await asyncio.to_thread(_remove_quietly, part_path)
+        raise
+
+    return StoredUpload(path=dest_path, sha256=hasher.hexdigest(), size=size, format=image_format)
+
+
+async def discard_upload(upload: StoredUpload):
+    """Deletes a staged upload that will not be moved into the store."""
+    await asyncio.to_thread(_remove_quietly, upload.path)
@@ -0,0 +1,167 @@
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+from app.config import load_env
+from app.db_helper import run_db
+from app.logger import get_logger
+
+load_env()
+
+log = get_logger(__name__)
+
+# Configuration
+VISION_CACHE_MAX_ENTRIES = int(os.getenv("VISION_CACHE_MAX_ENTRIES", 1024))
+VISION_CACHE_TTL = float(os.getenv("VISION_CACHE_TTL", 7 * 24 * 3600))  # seconds
+VISION_CACHE_PERSIST = os.getenv("VISION_CACHE_PERSIST", "true").lower() == "true"
+
+
+def hash_bytes(data):
+    """SHA-256 hex digest of raw image bytes (the content address)."""
+    return hashlib.sha256(data).hexdigest()
+
+
+def make_cache_key(content_key, model, prompt_version):
+    """Combines the content address with the model and prompt version."""
+    return hashlib.sha256(f"{model}|{prompt_version}|{content_key}".encode("utf-8")).hexdigest()
+
+
+class LRUCache:
+    """Thread-safe in-memory LRU with a max size and per-entry TTL."""
+
+    def __init__(self, max_entries=VISION_CACHE_MAX_ENTRIES, ttl=VISION_CACHE_TTL):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._data = OrderedDict()  # key -> (value, expires_at)
+        self._lock = threading.Lock()
+        self.evictions = 0
+
+    def get(self, key):
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return None
+            value, expires_at = item
+            if expires_at < time.monotonic():
+                del self._data[key]
+                self.evictions += 1
+                return None
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._data[key] = (value, time.monotonic() + self.ttl)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def __len__(self):
+        return len(self._data)
+
+
+# --- Persistent tier (vision_cache table, see sql/schema.sql) ---
+
+def _select_cached(conn, cache_key, ttl):
+    with conn.cursor() as cursor:
+        cursor.execute(
+            "SELECT result FROM vision_cache WHERE cache_key = %s AND created_at >= NOW() - INTERVAL %s SECOND",
+            (cache_key, int(ttl))
+        )
+        return cursor.fetchone()
+
+
+def _upsert_cached(conn, cache_key, image_hash, model, prompt_version, result):
+    with conn.cursor() as cursor:
+        cursor.execute(
+            "INSERT INTO vision_cache (cache_key, image_hash, model, prompt_version, result) "
+            "VALUES (%s, %s, %s, %s, %s) "
+            "ON DUPLICATE KEY UPDATE result = VALUES(result), created_at = CURRENT_TIMESTAMP",
+            (cache_key, image_hash, model, prompt_version, result)
+        )
+    conn.commit()
+
+
+class VisionCache:
+    """
+    Two-tier cache of vision analysis results.
+
+    Entries are content-addressed by the SHA-256 of the image bytes and scoped
+    by model name and prompt version (URL images are downloaded and hashed
+    first). The in-memory LRU tier is checked first, then the MySQL
+    vision_cache table. Persistence errors are treated as misses so the cache
+    can never fail an analysis.
+    """
+
+    def __init__(self, memory=None, persist=VISION_CACHE_PERSIST, ttl=VISION_CACHE_TTL):
+        self.memory = memory or LRUCache(ttl=ttl)
+        self.persist = persist
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._counters = {"memory_hits": 0, "persistent_hits": 0, "misses": 0, "stores": 0, "persist_errors": 0}
+
+    def _count(self, name):
+        with self._lock:
+            self._counters[name] += 1
+
+    async def get(self, model, prompt_version, image_hash):
+        """
+        Looks up a cached analysis by content hash.
+
+        Returns:
+            str or None: Cached analysis text, or None on a miss
+        """
+        cache_key = make_cache_key(image_hash, model, prompt_version)
+        result = self.memory.get(cache_key)
+        if result is not None:
+            self._count("memory_hits")
+            return result
+
+        if self.persist:
+            try:
+                row = await run_db(_select_cached, cache_key, self.ttl, max_retries=1)
+            except Exception as e:
+                log.warning("Vision cache lookup failed: %s - %s", type(e).__name__, e)
+                self._count("persist_errors")
+                row = None
+            if row:
+                self.memory.set(cache_key, row["result"])
+                self._count("persistent_hits")
+                return row["result"]
+
+        self._count("misses")
+        return None
+
+    async def set(self, result, model, prompt_version, image_hash):
+        """Stores an analysis under its content hash."""
+        cache_key = make_cache_key(image_hash, model, prompt_version)
+        self.memory.set(cache_key, result)
+        self._count("stores")
+
+        if self.persist:
+            try:
+                await run_db(_upsert_cached, cache_key, image_hash, model, prompt_version, result, max_retries=1)
+            except Exception as e:
+                log.warning("Vision cache store failed: %s - %s", type(e).__name__, e)
+                self._count("persist_errors")
+
+    def stats(self):
+        """Returns hit/miss counters and the memory tier size."""
+        with self._lock:
+            counters = dict(self._counters)
+        lookups = counters["memory_hits"] + counters["persistent_hits"] + counters["misses"]
+        hits = counters["memory_hits"] + counters["persistent_hits"]
+        counters["hit_ratio"] = round(hits / lookups, 4) if lookups else 0.0
+        counters["memory_entries"] = len(self.memory)
+        counters["memory_evictions"] = self.memory.evictions
+        return counters
+
+
+vision_cache = VisionCache()
+
+
+def get_cache_stats():
+    """Returns the shared vision cache's hit/miss counters."""
+    return vision_cache.stats()
@@ -0,0 +1,79 @@
+# Idempotent webhook handling: Dialogflow retries fulfillment it considers slow with the same
+# responseId. A retry joins the still-running first attempt or gets its answer from a short-TTL
+# cache, instead of re-running the vision and chat calls behind it.
+import asyncio
+import os
+from app.config import load_env
+from app.vision_cache import LRUCache
+from app.logger import get_logger
+
+load_env()
+
+log = get_logger(__name__)
+
+# Configuration
+WEBHOOK_DEDUP_TTL = float(os.getenv("WEBHOOK_DEDUP_TTL", 300))  # seconds an answer is replayed
+WEBHOOK_DEDUP_MAX_ENTRIES = int(os.getenv("WEBHOOK_DEDUP_MAX_ENTRIES", 10000))
+
+
+class WebhookDeduplicator:
+    """
+    Single-flight plus replay cache for webhook turns, keyed on responseId.
+
+    The first request for a responseId runs the handler as its own task, so
+    it keeps going even if that request is dropped (Dialogflow gave up on
+    it). Duplicates arriving meanwhile wait for the same task; later ones get
+    the cached response for WEBHOOK_DEDUP_TTL seconds.
+    """
+
+    def __init__(self, ttl=WEBHOOK_DEDUP_TTL, max_entries=WEBHOOK_DEDUP_MAX_ENTRIES):
+        self._inflight = {}  # responseId -> asyncio.Task
+        self._responses = LRUCache(max_entries=max_entries, ttl=ttl)
+        self._stats = {"requests": 0, "unkeyed": 0, "joined_inflight": 0, "replayed": 0}
+
+    def _finished(self, response_id, task):
+        self._inflight.pop(response_id, None)
+        if not task.cancelled() and task.exception() is None:
+            self._responses.set(response_id, task.result())
+
+    async def run(self, response_id, handler):
+        """
+        Returns handler()'s response for this responseId, running it at most
+        once per TTL (requests without a responseId always run it).
+
+        Args:
+            response_id (str): Dialogflow responseId (None/empty disables dedup)
+            handler (callable): Zero-argument coroutine function producing the response
+        """
+        self._stats["requests"] += 1
+        if not response_id:
+            self._stats["unkeyed"] += 1
+            return await handler()
+
+        cached = self._responses.get(response_id)
+        if cached is not None:
+            self._stats["replayed"] += 1
+            log.info("Replayed webhook response for a retried request", extra={"response_id": response_id})
+            return cached
+
+        task = self._inflight.get(response_id)
+        if task is None:
+            task = asyncio.create_task(handler())
+            self._inflight[response_id] = task
+            task.add_done_callback(lambda done: self._finished(response_id, done))
+        else:
+            self._stats["joined_inflight"] += 1
+            log.info("Retried webhook request joined the running one", extra={"response_id": response_id})
+        # shield: a request being dropped doesn't cancel the turn the other attempts are waiting on
+        return await asyncio.shield(task)
+
+    def stats(self):
+        return {**self._stats, "duplicates_avoided": self._stats["joined_inflight"] + self._stats["replayed"],
+                "inflight": len(self._inflight), "cached": len(self._responses)}
+
+
+webhook_dedup = WebhookDeduplicator()
+
+
+def get_webhook_dedup_stats():
+    return webhook_dedup.stats()
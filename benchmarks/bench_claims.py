@@ -0,0 +1,98 @@
+"""
+Page latency of the /claims query (app/claims_query.py) deep into a large
+table, keyset cursor vs. the OFFSET pagination it replaces, on the SQLite
+MySQL stand-in (benchmarks/fake_mysql.py).
+
+Seeds --rows claims, walks every page with the cursor and times the pages
+listed in --pages; the OFFSET query is timed at the same depths.
+
+Usage:
+    python -m benchmarks.bench_claims [--rows 200000] [--page-size 20] [--pages 1,10,100,1000,10000]
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+from benchmarks.fake_mysql import make_connect
+
+
+def seed(conn, rows):
+    start = datetime(2025, 1, 1)
+    batch = []
+    for i in range(rows):
+        created = start + timedelta(seconds=i * 30 + random.randint(0, 29))
+        complete = random.random() < 0.6
+        batch.append((f"sess-{i:08d}", f"POL-{random.randint(1, 5000):05d}", f"Claimant {i}",
+                      "2025-01-01 09:00" if complete else None, "Honda Civic", "Rear-ended at a light. " * 20,
+                      "Severity: Medium. " * 30, created.strftime("%Y-%m-%d %H:%M:%S")))
+        if len(batch) == 5000:
+            _insert(conn, batch)
+            batch = []
+    if batch:
+        _insert(conn, batch)
+
+
+def _insert(conn, batch):
+    with conn.cursor() as cursor:
+        cursor.executemany(
+            "INSERT INTO insurance_sessions (session_id, policy_number, claimant_name, date_time_of_incident, "
+            "vehicle_info, incident_description, damage_report, created_at) VALUES (%s, %s, %s, %s, %s, %s, %s, %s)",
+            batch
+        )
+    conn.commit()
+
+
+def offset_page(conn, page, page_size):
+    """The query adjusters ran by hand before: SELECT * with OFFSET."""
+    with conn.cursor() as cursor:
+        cursor.execute("SELECT * FROM insurance_sessions ORDER BY created_at DESC, session_id DESC LIMIT %s OFFSET %s",
+                       (page_size, (page - 1) * page_size))
+        return cursor.fetchall()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=200000)
+    parser.add_argument("--page-size", type=int, default=20)
+    parser.add_argument("--pages", default="1,10,100,1000,10000")
+    args = parser.parse_args()
+    os.environ.setdefault("LOG_LEVEL", "WARNING")
+    from app.claims_query import list_claims
+
+    marks = sorted(int(p) for p in args.pages.split(","))
+    connect, _ = make_connect(os.path.join(tempfile.mkdtemp(prefix="claims-bench-"), "claims.sqlite3"))
+    conn = connect()
+    started = time.perf_counter()
+    seed(conn, args.rows)
+    print(f"Seeded {args.rows} claims in {time.perf_counter() - started:.1f}s")
+
+    keyset = {}
+    cursor, page = None, 0
+    while page < marks[-1]:
+        page += 1
+        t0 = time.perf_counter()
+        rows, cursor = list_claims(conn, cursor=cursor, limit=args.page_size)
+        elapsed = (time.perf_counter() - t0) * 1000
+        if page in marks:
+            keyset[page] = elapsed
+        if cursor is None:
+            break
+
+    print(f"{'page':>8}{'keyset ms':>12}{'offset ms':>12}")
+    for mark in marks:
+        if mark not in keyset:
+            print(f"{mark:>8}  (past the last page)")
+            continue
+        t0 = time.perf_counter()
+        offset_page(conn, mark, args.page_size)
+        offset_ms = (time.perf_counter() - t0) * 1000
+        print(f"{mark:>8}{keyset[mark]:>12.3f}{offset_ms:>12.3f}")
+    conn.close()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,123 @@
+"""
+Near-duplicate photo index (app/photo_index.py): how far edited copies of a
+photo land from the original, and lookup latency as the index grows,
+multi-index hashing vs. comparing against every stored hash.
+
+Robustness uses generated photos (recompressed, resized, cropped and
+brightened copies, plus unrelated photos). Latency uses random 64-bit hashes
+with a planted near-duplicate for every query, so recall is checked too.
+
+Usage:
+    python -m benchmarks.bench_photo_index [--sizes 10000,100000,1000000] [--queries 200]
+"""
+import argparse
+import random
+import statistics
+import sys
+import time
+from io import BytesIO
+
+from PIL import Image, ImageDraw, ImageEnhance
+
+
+def synthetic_photo(seed, size=(1600, 1200)):
+    rng = random.Random(seed)
+    img = Image.new("RGB", size, tuple(rng.randint(0, 255) for _ in range(3)))
+    draw = ImageDraw.Draw(img)
+    for _ in range(40):
+        x0, y0 = rng.randint(0, size[0]), rng.randint(0, size[1])
+        x1, y1 = x0 + rng.randint(50, 600), y0 + rng.randint(50, 400)
+        shape = draw.ellipse if rng.random() < 0.5 else draw.rectangle
+        shape((x0, y0, x1, y1), fill=tuple(rng.randint(0, 255) for _ in range(3)))
+    return img
+
+
+def jpeg(img, quality=90):
+    buffer = BytesIO()
+    img.save(buffer, format="JPEG", quality=quality)
+    return buffer.getvalue()
+
+
+def robustness(compute_hashes, hamming):
+    original = synthetic_photo(1)
+    w, h = original.size
+    variants = {
+        "recompressed q40": jpeg(original, 40),
+        "resized 50%": jpeg(original.resize((w // 2, h // 2))),
+        "cropped 5%": jpeg(original.crop((w // 40, h // 40, w - w // 40, h - h // 40))),
+        "brightness +15%": jpeg(ImageEnhance.Brightness(original).enhance(1.15)),
+        "PNG copy": (lambda b: (original.save(b, format="PNG"), b.getvalue())[1])(BytesIO()),
+        **{f"unrelated #{seed}": jpeg(synthetic_photo(seed)) for seed in (2, 3, 4)},
+    }
+    raw = jpeg(original)
+    started = time.perf_counter()
+    base = compute_hashes(raw)
+    hash_ms = (time.perf_counter() - started) * 1000
+    print(f"Hashing a {w}x{h} JPEG: {hash_ms:.1f} ms")
+    print(f"{'variant':<20}{'pHash dist':>12}{'dHash dist':>12}")
+    for name, data in variants.items():
+        phash, dhash = compute_hashes(data)
+        print(f"{name:<20}{hamming(base[0], phash):>12}{hamming(base[1], dhash):>12}")
+
+
+def flip_bits(value, count, rng):
+    for bit in rng.sample(range(64), count):
+        value ^= 1 << bit
+    return value
+
+
+def latency(sizes, queries, max_distance, linear_queries):
+    from app.photo_index import MultiIndexHashTable
+
+    rng = random.Random(7)
+    print(f"\n{'entries':>10}{'build s':>10}{'lookup p50 us':>16}{'lookup p95 us':>16}{'scan ms':>10}{'recall':>8}")
+    table = MultiIndexHashTable()
+    phashes, dhashes = [], []
+    for size in sorted(sizes):
+        started = time.perf_counter()
+        while len(table) < size:
+            phash, dhash = rng.getrandbits(64), rng.getrandbits(64)
+            table.add(len(table) + 1, phash, dhash)
+            phashes.append(phash)
+            dhashes.append(dhash)
+        build_s = time.perf_counter() - started
+
+        # Each query is a copy of a stored photo with up to max_distance bits changed
+        targets = [rng.randrange(len(phashes)) for _ in range(queries)]
+        probes = [(flip_bits(phashes[t], rng.randint(0, max_distance), rng),
+                   flip_bits(dhashes[t], rng.randint(0, 4), rng)) for t in targets]
+        timings, found = [], 0
+        for target, (phash, dhash) in zip(targets, probes):
+            t0 = time.perf_counter()
+            matches = table.search(phash, dhash, max_distance=max_distance)
+            timings.append((time.perf_counter() - t0) * 1e6)
+            found += any(row_id == target + 1 for row_id, _, _ in matches)
+
+        t0 = time.perf_counter()
+        for phash, _ in probes[:linear_queries]:
+            [i for i, stored in enumerate(phashes) if (phash ^ stored).bit_count() <= max_distance]
+        scan_ms = (time.perf_counter() - t0) * 1000 / min(linear_queries, len(probes))
+
+        p95 = statistics.quantiles(timings, n=20)[-1]
+        print(f"{size:>10}{build_s:>10.1f}{statistics.median(timings):>16.1f}{p95:>16.1f}"
+              f"{scan_ms:>10.1f}{found / queries:>8.0%}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", default="10000,100000,1000000")
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--linear-queries", type=int, default=10, help="queries timed with the full scan")
+    parser.add_argument("--max-distance", type=int, default=None, help="pHash threshold (default: app setting)")
+    args = parser.parse_args()
+    import os
+    os.environ.setdefault("LOG_LEVEL", "WARNING")
+    from app.photo_index import compute_hashes, hamming, PHOTO_DUP_MAX_DISTANCE
+
+    robustness(compute_hashes, hamming)
+    latency([int(s) for s in args.sizes.split(",")], args.queries,
+            args.max_distance if args.max_distance is not None else PHOTO_DUP_MAX_DISTANCE, args.linear_queries)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
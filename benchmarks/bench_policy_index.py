@@ -0,0 +1,87 @@
+"""
+Policy-number index (app/policy_index.py): build time, memory and check()
+latency for valid numbers, one-character slips (OCR confusions and typos)
+and unknown numbers, as the book of policies grows.
+
+Usage:
+    python -m benchmarks.bench_policy_index [--sizes 10000,100000,1000000] [--queries 2000]
+"""
+import argparse
+import random
+import statistics
+import string
+import sys
+import time
+import tracemalloc
+
+ALPHABET = string.ascii_uppercase + string.digits
+
+
+def synthetic_policies(count, rng):
+    policies = set()
+    while len(policies) < count:
+        policies.add(f"{rng.choice(['POL', 'AUT', 'CAR'])}-{rng.randint(0, 10 ** 7 - 1):07d}")
+    return sorted(policies)
+
+
+def slip(policy, rng):
+    """One substitution, deletion, insertion or transposition away from policy."""
+    i = rng.randrange(4, len(policy) - 1)
+    kind = rng.choice(["substitute", "delete", "insert", "transpose"])
+    if kind == "substitute":
+        return policy[:i] + rng.choice(ALPHABET) + policy[i + 1:]
+    if kind == "delete":
+        return policy[:i] + policy[i + 1:]
+    if kind == "insert":
+        return policy[:i] + rng.choice(ALPHABET) + policy[i:]
+    return policy[:i] + policy[i + 1] + policy[i] + policy[i + 2:]
+
+
+def timed(check, values):
+    timings, statuses = [], {}
+    for value in values:
+        t0 = time.perf_counter()
+        result = check(value)
+        timings.append((time.perf_counter() - t0) * 1e6)
+        statuses[result.status] = statuses.get(result.status, 0) + 1
+    return statistics.median(timings), statistics.quantiles(timings, n=20)[-1], statuses
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", default="10000,100000,1000000")
+    parser.add_argument("--queries", type=int, default=2000)
+    args = parser.parse_args()
+    import os
+    os.environ.setdefault("LOG_LEVEL", "WARNING")
+    from app.policy_index import PolicySnapshot, normalize_policy
+
+    rng = random.Random(11)
+    print(f"{'policies':>10}{'build s':>9}{'MB':>7}  {'query':<9}{'p50 us':>8}{'p95 us':>8}  answers")
+    for size in [int(s) for s in args.sizes.split(",")]:
+        policies = synthetic_policies(size, rng)
+        index = {normalize_policy(p): p for p in policies}
+        started = time.perf_counter()
+        snapshot = PolicySnapshot(index)
+        build_s = time.perf_counter() - started
+        del snapshot
+        tracemalloc.start()  # second build, traced: tracing slows it down several times
+        snapshot = PolicySnapshot(index)
+        memory_mb = tracemalloc.get_traced_memory()[0] / 1e6
+        tracemalloc.stop()
+
+        sample = rng.sample(policies, min(args.queries, size))
+        queries = {
+            "valid": [p.lower().replace("-", " ") for p in sample],
+            "slip": [slip(p, rng) for p in sample],
+            "unknown": [f"ZZZ-{rng.randint(0, 10 ** 7 - 1):07d}" for _ in sample],
+        }
+        for i, (name, values) in enumerate(queries.items()):
+            p50, p95, statuses = timed(snapshot.check, values)
+            lead = f"{size:>10}{build_s:>9.1f}{memory_mb:>7.0f}" if i == 0 else " " * 26
+            answers = ", ".join(f"{status} {count}" for status, count in sorted(statuses.items()))
+            print(f"{lead}  {name:<9}{p50:>8.1f}{p95:>8.1f}  {answers}")
+
+
+if __name__ == "__main__":
+    sys.exit(main())
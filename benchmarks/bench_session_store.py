@@ -0,0 +1,151 @@
+"""
+Micro-benchmark: SQL round trips and latency per webhook turn,
+legacy SELECT/INSERT/UPDATE/SELECT sequence vs. session_store.upsert_session.
+
+Runs against an in-memory connection stand-in that sleeps for a simulated
+network round trip on every execute(), commit() and rollback(), so no MySQL
+is needed.
+
+Usage:
+    python -m benchmarks.bench_session_store [--rtt-ms 20] [--sessions 50]
+"""
+import argparse
+import re
+import statistics
+import time
+from app.session_store import upsert_session
+
+# A typical claim conversation: one Dialogflow turn per entry
+CONVERSATION = [
+    {},  # greeting, nothing extracted
+    {"claimant_name": "John Doe"},
+    {"policy_number": "ABC-12345"},
+    {"date_time_of_incident": "2026-01-18T09:30:00"},
+    {"vehicle_info": "2019 Honda Civic"},
+    {"vehicle_info": "2019 Honda Civic"},  # repeated answer
+    {"incident_description": "I was rear-ended at a red light"},
+]
+
+
+class FakeCursor:
+    def __init__(self, conn):
+        self.conn = conn
+        self._result = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def execute(self, sql, params=()):
+        self.conn.round_trip()
+        table = self.conn.rows
+        sql = " ".join(sql.split())
+
+        if sql.startswith("SELECT * FROM insurance_sessions WHERE session_id"):
+            row = table.get(params[0])
+            self._result = dict(row) if row else None
+        elif sql.startswith("INSERT INTO insurance_sessions"):
+            columns = [c.strip() for c in re.search(r"\(([^)]*)\) VALUES", sql).group(1).split(",")]
+            values = dict(zip(columns, params))
+            row = table.setdefault(values["session_id"], {"session_id": values["session_id"]})
+            row.update(values)
+        elif sql.startswith("UPDATE insurance_sessions SET"):
+            columns = re.findall(r"(\w+) = %s", sql.split(" WHERE ")[0])
+            table[params[-1]].update(dict(zip(columns, params[:-1])))
+        else:
+            raise NotImplementedError(sql)
+
+    def fetchone(self):
+        return self._result
+
+
+class FakeConnection:
+    """Counts round trips and sleeps rtt seconds for each one."""
+
+    def __init__(self, rtt):
+        self.rtt = rtt
+        self.rows = {}
+        self.round_trips = 0
+
+    def round_trip(self):
+        self.round_trips += 1
+        if self.rtt:
+            time.sleep(self.rtt)
+
+    def cursor(self):
+        return FakeCursor(self)
+
+    def commit(self):
+        self.round_trip()
+
+    def rollback(self):
+        self.round_trip()
+
+
+def legacy_sync_session(conn, session_id, new_data):
+    """The webhook's original per-turn sequence (kept here for comparison)."""
+    with conn.cursor() as cursor:
+        cursor.execute("SELECT * FROM insurance_sessions WHERE session_id = %s", (session_id,))
+        existing_row = cursor.fetchone()
+        if not existing_row:
+            cursor.execute("INSERT INTO insurance_sessions (session_id) VALUES (%s)", (session_id,))
+            conn.commit()
+
+        updates = [f"{field} = %s" for field, val in new_data.items() if val is not None]
+        vals = [val for val in new_data.values() if val is not None]
+        if updates:
+            sql = f"UPDATE insurance_sessions SET {', '.join(updates)} WHERE session_id = %s"
+            vals.append(session_id)
+            cursor.execute(sql, tuple(vals))
+            conn.commit()
+
+        cursor.execute("SELECT * FROM insurance_sessions WHERE session_id = %s", (session_id,))
+        return cursor.fetchone()
+
+
+def run(sync_fn, rtt, sessions):
+    conn = FakeConnection(rtt)
+    latencies = []
+    final_states = []
+    for n in range(sessions):
+        session_id = f"bench-session-{n}"
+        for turn in CONVERSATION:
+            started = time.perf_counter()
+            state = sync_fn(conn, session_id, dict(turn))
+            latencies.append((time.perf_counter() - started) * 1000)
+        final_states.append(state)
+    turns = sessions * len(CONVERSATION)
+    return {
+        "round_trips_per_turn": conn.round_trips / turns,
+        "latency_mean_ms": statistics.mean(latencies),
+        "latency_p95_ms": sorted(latencies)[int(len(latencies) * 0.95) - 1],
+        "final_states": final_states,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rtt-ms", type=float, default=20.0, help="simulated network round trip to MySQL")
+    parser.add_argument("--sessions", type=int, default=50)
+    args = parser.parse_args()
+
+    rtt = args.rtt_ms / 1000
+    before = run(legacy_sync_session, rtt, args.sessions)
+    after = run(upsert_session, rtt, args.sessions)
+
+    # Both paths must end in the same session state
+    fields = ["claimant_name", "policy_number", "date_time_of_incident", "vehicle_info", "incident_description"]
+    for old, new in zip(before["final_states"], after["final_states"]):
+        assert all(old.get(f) == new.get(f) for f in fields), (old, new)
+
+    print(f"{len(CONVERSATION)}-turn conversation x {args.sessions} sessions, simulated RTT {args.rtt_ms:.0f}ms")
+    print(f"{'':<10}{'round trips/turn':>18}{'mean ms/turn':>15}{'p95 ms/turn':>14}")
+    for name, result in (("before", before), ("after", after)):
+        print(f"{name:<10}{result['round_trips_per_turn']:>18.2f}"
+              f"{result['latency_mean_ms']:>15.1f}{result['latency_p95_ms']:>14.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,149 @@
+"""
+Cold-start benchmark: every run is a fresh interpreter (like a new autoscaled
+instance) against the local fake Groq API and the SQLite MySQL stand-in.
+
+Per run it measures:
+    import_ms          importing app.main
+    startup_ms         the startup hooks (DB pool warm-up, vision job queue)
+    first_request_ms   first GET / through the ASGI app
+    first_chat_ms      first webhook turn that needs the LLM (unclassified text)
+    ready_ms           process spawn -> first GET / answered
+    first_reply_ms     process spawn -> first LLM-backed reply
+
+Reports the median of --repeats runs and saves them as JSON.
+
+Usage:
+    python -m benchmarks.bench_startup [--repeats 5] [--no-warm-clients] [--chat-delay-ms 0]
+                                       [--out benchmarks/results/startup.json] [--baseline FILE]
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+from benchmarks.bench_webhook import RESULTS_DIR, configure_environment, _payload, _git_commit, _delta
+from benchmarks.fake_groq import FakeGroqServer
+from benchmarks.fake_mysql import make_connect
+
+METRICS = ("import_ms", "startup_ms", "first_request_ms", "first_chat_ms", "ready_ms", "first_reply_ms")
+RESULT_PREFIX = "STARTUP_RESULT "
+
+
+async def child(args, spawned_at):
+    """One cold start, in this (fresh) interpreter."""
+    workdir = tempfile.mkdtemp(prefix="claim-startup-")
+    groq = FakeGroqServer(latency_ms=args.groq_latency_ms, jitter_ms=0).start()
+    configure_environment(argparse.Namespace(realistic_quota=False, db_pool_size=10), workdir, groq.url)
+    os.environ["WARM_CLIENTS_ON_STARTUP"] = "false" if args.no_warm_clients else "true"
+    os.environ.setdefault("LOG_LEVEL", "WARNING")
+
+    started = time.perf_counter()
+    from app.main import app, start_background_services, stop_background_services
+    from app.db_helper import db_pool
+    imported = time.perf_counter()
+
+    connect, _ = make_connect(os.path.join(workdir, "claims.sqlite3"))
+    db_pool._connect = connect
+    await start_background_services()
+    ready = time.perf_counter()
+
+    import httpx
+    timings = {"import_ms": imported - started, "startup_ms": ready - imported}
+    try:
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://startup") as client:
+            t0 = time.perf_counter()
+            (await client.get("/")).raise_for_status()
+            timings["first_request_ms"] = time.perf_counter() - t0
+            timings["ready_ms"] = time.time() - spawned_at
+
+            if args.chat_delay_ms:
+                await asyncio.sleep(args.chat_delay_ms / 1000)  # traffic arriving a little after boot
+            payload = _payload("smalltalk", "Do you also cover rental cars?", {})
+            payload["session"] = "projects/bench/agent/sessions/startup"
+            t0 = time.perf_counter()
+            (await client.post("/webhook", json=payload)).raise_for_status()
+            timings["first_chat_ms"] = time.perf_counter() - t0
+            timings["first_reply_ms"] = time.time() - spawned_at
+    finally:
+        await stop_background_services()
+        groq.stop()
+
+    timings = {k: round(v * 1000, 1) for k, v in timings.items()}
+    timings["groq_chat_requests"] = groq.requests["chat"]
+    print(RESULT_PREFIX + json.dumps(timings), flush=True)
+
+
+def spawn(args):
+    command = [sys.executable, "-m", "benchmarks.bench_startup", "--child", "--spawned-at", repr(time.time()),
+               "--groq-latency-ms", str(args.groq_latency_ms), "--chat-delay-ms", str(args.chat_delay_ms)]
+    if args.no_warm_clients:
+        command.append("--no-warm-clients")
+    completed = subprocess.run(command, capture_output=True, text=True, timeout=300)
+    for line in completed.stdout.splitlines():
+        if line.startswith(RESULT_PREFIX):
+            return json.loads(line[len(RESULT_PREFIX):])
+    raise RuntimeError(f"Cold-start run failed:\n{completed.stdout[-2000:]}\n{completed.stderr[-2000:]}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeats", type=int, default=5)
+    parser.add_argument("--no-warm-clients", action="store_true", help="build the Groq clients on first use only")
+    parser.add_argument("--chat-delay-ms", type=float, default=0.0, help="pause between the first GET / and first chat")
+    parser.add_argument("--groq-latency-ms", type=float, default=50.0)
+    parser.add_argument("--run-id", default=datetime.now().strftime("startup-%Y%m%d-%H%M%S"))
+    parser.add_argument("--out", default=None, help="defaults to benchmarks/results/<run-id>.json")
+    parser.add_argument("--baseline", default=None, help="earlier results JSON to compare against")
+    parser.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    parser.add_argument("--spawned-at", type=float, default=None, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        asyncio.run(child(args, args.spawned_at or time.time()))
+        return
+
+    runs = []
+    for i in range(args.repeats):
+        runs.append(spawn(args))
+        print(f"run {i + 1}/{args.repeats}: " + ", ".join(f"{k}={runs[-1][k]}" for k in METRICS))
+
+    result = {
+        "meta": {
+            "run_id": args.run_id,
+            "timestamp": datetime.now().isoformat(timespec="seconds"),
+            "git_commit": _git_commit(),
+            "python": platform.python_version(),
+            "config": {k: v for k, v in vars(args).items() if k not in ("out", "baseline", "child", "spawned_at")},
+        },
+        "median": {k: round(statistics.median(r[k] for r in runs), 1) for k in METRICS},
+        "runs": runs,
+    }
+    print(f"\nMedian of {args.repeats} cold starts:")
+    for k, v in result["median"].items():
+        print(f"  {k:<18}{v:>10} ms")
+
+    out = args.out or os.path.join(RESULTS_DIR, f"{args.run_id}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(out)), exist_ok=True)
+    with open(out, "w", encoding="utf-8") as f:
+        json.dump(result, f, indent=2)
+    print(f"💾 Saved results to {out}")
+
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            baseline = json.load(f)
+        print(f"\nvs. baseline {baseline['meta'].get('run_id')} ({baseline['meta'].get('git_commit')})")
+        for k, v in result["median"].items():
+            old = baseline["median"].get(k)
+            if old is not None:
+                print(f"  {k}: {old} -> {v} ms ({_delta(old, v)})")
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,305 @@
+"""
+Offline load test of the FastAPI app: concurrent multi-turn Dialogflow sessions
+driven in-process, with a local fake Groq API (benchmarks/fake_groq.py) and a
+SQLite stand-in for MySQL (benchmarks/fake_mysql.py). No network, no keys.
+
+Each session replays the MOCK_PAYLOAD_* turns from tests/test_webhook.py,
+completed with the remaining claim fields, a photo URL (background vision
+job) and a follow-up turn that reads the report.
+
+Reports throughput, p50/p95/p99 per endpoint and per intent, DB round trips
+per turn and the app's own per-stage timings, and saves them as JSON.
+Pass --baseline to compare against an earlier run.
+
+Usage:
+    python -m benchmarks.bench_webhook [--sessions 200] [--concurrency 20] [--groq-latency-ms 300]
+                                       [--db-rtt-ms 2] [--out benchmarks/results/run.json]
+                                       [--baseline benchmarks/results/baseline.json]
+"""
+import argparse
+import asyncio
+import copy
+import json
+import os
+import platform
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+from benchmarks.fake_groq import FakeGroqServer
+from benchmarks.fake_mysql import make_connect
+
+RESULTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "results")
+
+# The webhook answers 200 even when it fails; these replies count as errors
+ERROR_REPLIES = ("Database connection error", "I'm having a technical issue")
+DIALOGFLOW_TIMEOUT_MS = 5000  # Dialogflow ES abandons slower webhook calls
+
+# Turns added around the MOCK_PAYLOAD_* ones so a session reaches completion.
+# {session} makes every session's photo distinct (no shared vision cache hits);
+# {images} is the fake server, which also serves the photos.
+EXTRA_TURNS = [
+    ("Default Welcome Intent", "Hi, I need to report an accident", {}),
+    ("smalltalk", "Do you also cover rental cars?", {}),  # unclassified: LLM fallback path
+    ("provide_date_time", "It happened yesterday at 9am", {"date-time": "2026-01-18T09:00:00"}),
+    ("provide_vehicle_info", "A 2019 Honda Civic", {"vehicle_info": "2019 Honda Civic"}),
+    ("describe_incident", "Here is a photo {images}/claims/{session}.jpg", {}),
+    ("smalltalk", "Is my photo done?", {}),
+]
+
+
+def _payload(intent, text, parameters):
+    return {"queryResult": {"queryText": text, "intent": {"displayName": intent},
+                            "parameters": parameters, "languageCode": "en"}}
+
+
+def build_conversation():
+    """Greeting, an off-script question, the three MOCK_PAYLOAD_* turns, the remaining fields, a photo and a follow-up."""
+    from tests.test_webhook import MOCK_PAYLOAD_POLICY, MOCK_PAYLOAD_NAME, MOCK_PAYLOAD_INCIDENT
+    greeting, question, date, vehicle, photo, follow_up = [_payload(*turn) for turn in EXTRA_TURNS]
+    return [greeting, question, MOCK_PAYLOAD_POLICY, MOCK_PAYLOAD_NAME, date, vehicle,
+            MOCK_PAYLOAD_INCIDENT, photo, follow_up]
+
+
+def followup_payload(session, event):
+    """What Dialogflow sends when a reply carries followupEventInput (the event's intent, re-fulfilled)."""
+    if not event:
+        return None
+    return {"session": session,
+            "queryResult": {"queryText": event["name"], "intent": {"displayName": event["name"]},
+                            "parameters": event.get("parameters", {}),
+                            "languageCode": event.get("languageCode", "en")}}
+
+
+def percentile(values, pct):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(int(round(pct / 100 * len(ordered) + 0.5)) - 1, len(ordered) - 1)]
+
+
+def latency_summary(samples):
+    return {
+        "count": len(samples),
+        "p50_ms": round(percentile(samples, 50), 2),
+        "p95_ms": round(percentile(samples, 95), 2),
+        "p99_ms": round(percentile(samples, 99), 2),
+        "max_ms": round(max(samples), 2) if samples else 0.0,
+    }
+
+
+def configure_environment(args, workdir, groq_url):
+    """Must run before any app module is imported: they read their config at import time."""
+    os.environ.update({
+        "GROQ_API_KEY": "bench",
+        "GROQ_BASE_URL": groq_url,
+        "GROQ_GOVERNOR_DB": os.path.join(workdir, "groq_governor.sqlite3"),
+        # Measure the app, not the quota: generous limits unless --realistic-quota
+        "GROQ_MODEL_LIMITS": "{}" if args.realistic_quota else json.dumps({
+            "meta-llama/llama-4-scout-17b-16e-instruct": {"rpm": 100000, "tpm": 10 ** 9, "concurrency": 64},
+            "llama-3.1-8b-instant": {"rpm": 100000, "tpm": 10 ** 9, "concurrency": 64},
+        }),
+        "DB_POOL_MIN_SIZE": "2",
+        "DB_POOL_MAX_SIZE": str(args.db_pool_size),
+        "PROMPT_PHRASINGS_FILE": os.path.join(workdir, "prompt_phrasings.json"),
+        "BATCH_CHECKPOINT_FILE": os.path.join(workdir, "batch_checkpoint.jsonl"),
+        "IMAGE_FETCH_CACHE_DIR": os.path.join(workdir, "url_cache"),
+        "IMAGE_FETCH_ALLOW_PRIVATE": "true",  # photos are served from 127.0.0.1
+    })
+
+
+async def drive(app, conversation, args):
+    import httpx
+
+    endpoint_samples = {}
+    intent_samples = {}
+    errors = {"http": 0, "exceptions": 0, "error_replies": 0, "over_budget": 0}
+    followups = {"events": 0}
+    semaphore = asyncio.Semaphore(args.concurrency)
+    transport = httpx.ASGITransport(app=app)
+
+    async def request(client, method, path, template, **kwargs):
+        started = time.perf_counter()
+        try:
+            response = await client.request(method, path, **kwargs)
+        except Exception:
+            errors["exceptions"] += 1
+            return None
+        elapsed = (time.perf_counter() - started) * 1000
+        endpoint_samples.setdefault(f"{method} {template}", []).append(elapsed)
+        if response.status_code >= 400:
+            errors["http"] += 1
+        return response, elapsed
+
+    async def session(client, index):
+        async with semaphore:
+            session_id = f"bench-{args.run_id}-{index}"
+            for turn in conversation:
+                payload = copy.deepcopy(turn)
+                payload["session"] = f"projects/bench/agent/sessions/{session_id}"
+                query = payload["queryResult"]
+                query["queryText"] = (query["queryText"].replace("{session}", session_id)
+                                      .replace("{images}", os.environ["GROQ_BASE_URL"]))
+                while payload:
+                    result = await request(client, "POST", "/webhook", "/webhook", json=payload)
+                    if not result:
+                        break
+                    body = result[0].json()
+                    if body.get("fulfillmentText", "").startswith(ERROR_REPLIES):
+                        errors["error_replies"] += 1
+                    if result[1] > DIALOGFLOW_TIMEOUT_MS:
+                        errors["over_budget"] += 1
+                    intent = payload["queryResult"]["intent"]["displayName"]
+                    intent_samples.setdefault(intent, []).append(result[1])
+                    payload = followup_payload(payload["session"], body.get("followupEventInput"))
+                    followups["events"] += int(payload is not None)
+                if args.think_ms:
+                    await asyncio.sleep(args.think_ms / 1000)
+            await request(client, "GET", "/", "/")
+
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=120) as client:
+        started = time.perf_counter()
+        await asyncio.gather(*[session(client, i) for i in range(args.sessions)])
+        elapsed = time.perf_counter() - started
+    errors.update(followups)
+    return endpoint_samples, intent_samples, errors, elapsed
+
+
+async def run(args):
+    workdir = tempfile.mkdtemp(prefix="claim-bench-")
+    groq = FakeGroqServer(latency_ms=args.groq_latency_ms, jitter_ms=args.groq_jitter_ms,
+                          vision_latency_ms=args.vision_latency_ms, error_rate=args.groq_error_rate).start()
+    configure_environment(args, workdir, groq.url)
+
+    from app.main import app, start_background_services, stop_background_services
+    from app.db_helper import db_pool
+    from app.metrics import stage_duration
+    db_path = os.path.join(workdir, "claims.sqlite3")
+    connect, db_stats = make_connect(db_path, rtt=args.db_rtt_ms / 1000)
+    db_pool._connect = connect
+
+    await start_background_services()
+    try:
+        conversation = build_conversation()
+        endpoint_samples, intent_samples, errors, elapsed = await drive(app, conversation, args)
+        # Let queued and running vision jobs finish so their DB work is counted
+        deadline = time.monotonic() + 60
+        while _pending_jobs(db_path) and time.monotonic() < deadline:
+            await asyncio.sleep(0.1)
+    finally:
+        await stop_background_services()
+        groq.stop()
+
+    turns = args.sessions * len(conversation)
+    stages = {}
+    for labels, values in stage_duration.summary().items():
+        name = ",".join(f"{k}={v}" for k, v in labels)
+        stages[name] = {"count": values["count"],
+                        "mean_ms": round(values["sum"] / values["count"] * 1000, 3) if values["count"] else 0.0}
+
+    return {
+        "meta": {
+            "run_id": args.run_id,
+            "timestamp": datetime.now().isoformat(timespec="seconds"),
+            "git_commit": _git_commit(),
+            "python": platform.python_version(),
+            "config": {k: v for k, v in vars(args).items() if k not in ("out", "baseline")},
+        },
+        "throughput": {
+            "elapsed_s": round(elapsed, 3),
+            "webhook_turns": turns,
+            "turns_per_s": round(turns / elapsed, 2) if elapsed else 0.0,
+            "sessions_per_s": round(args.sessions / elapsed, 2) if elapsed else 0.0,
+        },
+        "endpoints": {name: latency_summary(samples) for name, samples in sorted(endpoint_samples.items())},
+        "intents": {name: latency_summary(samples) for name, samples in sorted(intent_samples.items())},
+        "db": {
+            "round_trips": db_stats.round_trips,
+            "round_trips_per_turn": round(db_stats.round_trips / turns, 2),
+            "connections_opened": db_stats.connects,
+        },
+        "groq": dict(groq.requests),
+        "errors": errors,
+        "stages": dict(sorted(stages.items())),
+    }
+
+
+def _pending_jobs(db_path):
+    with sqlite3.connect(db_path) as db:
+        return db.execute("SELECT COUNT(*) FROM vision_jobs WHERE status IN ('queued', 'running')").fetchone()[0]
+
+
+def _git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except Exception:
+        return None
+
+
+def compare(result, baseline):
+    """Prints per-endpoint p95 and throughput deltas against a baseline run."""
+    print(f"\nvs. baseline {baseline['meta'].get('run_id')} ({baseline['meta'].get('git_commit')})")
+    old, new = baseline["throughput"]["turns_per_s"], result["throughput"]["turns_per_s"]
+    print(f"  throughput: {old} -> {new} turns/s ({_delta(old, new)})")
+    old, new = baseline["db"]["round_trips_per_turn"], result["db"]["round_trips_per_turn"]
+    print(f"  DB round trips/turn: {old} -> {new} ({_delta(old, new)})")
+    for name, summary in result["endpoints"].items():
+        before = baseline["endpoints"].get(name)
+        if before:
+            print(f"  {name} p95: {before['p95_ms']} -> {summary['p95_ms']} ms ({_delta(before['p95_ms'], summary['p95_ms'])})")
+
+
+def _delta(old, new):
+    return f"{(new - old) / old * 100:+.1f}%" if old else "n/a"
+
+
+def print_report(result):
+    t = result["throughput"]
+    print(f"\n{t['webhook_turns']} webhook turns in {t['elapsed_s']}s: "
+          f"{t['turns_per_s']} turns/s, {t['sessions_per_s']} sessions/s")
+    print(f"{'':<28}{'count':>8}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+    for section in ("endpoints", "intents"):
+        for name, s in result[section].items():
+            print(f"{name:<28}{s['count']:>8}{s['p50_ms']:>10}{s['p95_ms']:>10}{s['p99_ms']:>10}")
+    print(f"DB round trips/turn: {result['db']['round_trips_per_turn']} "
+          f"({result['db']['connections_opened']} connections opened)")
+    print(f"Groq requests: {result['groq']} | errors: {result['errors']}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sessions", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=20, help="sessions in flight at once")
+    parser.add_argument("--think-ms", type=float, default=0.0, help="pause between a session's turns")
+    parser.add_argument("--groq-latency-ms", type=float, default=300.0)
+    parser.add_argument("--vision-latency-ms", type=float, default=None, help="defaults to 3x --groq-latency-ms")
+    parser.add_argument("--groq-jitter-ms", type=float, default=50.0)
+    parser.add_argument("--groq-error-rate", type=float, default=0.0, help="fraction of Groq calls answered with 429")
+    parser.add_argument("--realistic-quota", action="store_true", help="keep the governor's production limits")
+    parser.add_argument("--db-rtt-ms", type=float, default=2.0, help="simulated MySQL round trip")
+    parser.add_argument("--db-pool-size", type=int, default=10)
+    parser.add_argument("--run-id", default=datetime.now().strftime("%Y%m%d-%H%M%S"))
+    parser.add_argument("--out", default=None, help="defaults to benchmarks/results/<run-id>.json")
+    parser.add_argument("--baseline", default=None, help="earlier results JSON to compare against")
+    args = parser.parse_args()
+
+    result = asyncio.run(run(args))
+    print_report(result)
+
+    out = args.out or os.path.join(RESULTS_DIR, f"{args.run_id}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(out)), exist_ok=True)
+    with open(out, "w", encoding="utf-8") as f:
+        json.dump(result, f, indent=2)
+    print(f"💾 Saved results to {out}")
+
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            compare(result, json.load(f))
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,167 @@
+"""
+Local stand-in for the Groq chat completions API with configurable latency
+and rate-limit errors. Point the app at it with GROQ_BASE_URL.
+
+Vision requests (messages containing an image_url part) get a DamageReport
+JSON reply ({"photos": [...]} with one report per image when several are
+sent in one request); chat requests get a one-sentence question. GET requests for any
+other path return a small JPEG that is distinct per path (with an ETag), to
+stand in for user-supplied image URLs.
+
+Usage:
+    python -m benchmarks.fake_groq [--port 8765] [--latency-ms 400] [--jitter-ms 100] [--error-rate 0.02]
+"""
+import argparse
+import hashlib
+import json
+import random
+import threading
+import time
+from io import BytesIO
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+VISION_REPLY = {
+    "license_plate": "ABC1234",
+    "severity": "Medium",
+    "description": "Dented rear bumper with scratches on the left tail light housing.",
+    "confidence": 0.82,
+}
+CHAT_REPLY = "Thanks for that. Could you please tell me when the incident happened?"
+
+
+class FakeGroqServer:
+    def __init__(self, port=0, latency_ms=400.0, jitter_ms=100.0, vision_latency_ms=None, error_rate=0.0):
+        self.latency = latency_ms / 1000
+        self.vision_latency = (vision_latency_ms if vision_latency_ms is not None else latency_ms * 3) / 1000
+        self.jitter = jitter_ms / 1000
+        self.error_rate = error_rate
+        self.requests = {"chat": 0, "vision": 0, "rate_limited": 0, "images": 0, "images_not_modified": 0}
+        self._images = {}
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer(("127.0.0.1", port), self._handler())
+        self._server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self._server.server_address
+        return f"http://{host}:{port}"
+
+    def _count(self, name):
+        with self._lock:
+            self.requests[name] += 1
+
+    def image(self, path):
+        """Deterministic 800x600 JPEG for a path (different paths -> different bytes)."""
+        with self._lock:
+            data = self._images.get(path)
+        if data is None:
+            from PIL import Image
+            digest = hashlib.sha256(path.encode("utf-8")).digest()
+            buffer = BytesIO()
+            Image.new("RGB", (800, 600), tuple(digest[:3])).save(buffer, format="JPEG", quality=85)
+            data = buffer.getvalue()
+            with self._lock:
+                self._images[path] = data
+        return data
+
+    def _handler(self):
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def _send(self, status, body, headers=None):
+                data = json.dumps(body).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                for name, value in (headers or {}).items():
+                    self.send_header(name, value)
+                self.end_headers()
+                try:
+                    self.wfile.write(data)
+                except (BrokenPipeError, ConnectionResetError):
+                    pass  # client gave up (timeout or shutdown)
+
+            def do_GET(self):
+                data = fake.image(self.path)
+                etag = '"' + hashlib.sha256(data).hexdigest()[:16] + '"'
+                if self.headers.get("If-None-Match") == etag:
+                    fake._count("images_not_modified")
+                    self.send_response(304)
+                    self.send_header("ETag", etag)
+                    self.end_headers()
+                    return
+                fake._count("images")
+                self.send_response(200)
+                self.send_header("Content-Type", "image/jpeg")
+                self.send_header("Content-Length", str(len(data)))
+                self.send_header("ETag", etag)
+                self.end_headers()
+                try:
+                    self.wfile.write(data)
+                except (BrokenPipeError, ConnectionResetError):
+                    pass
+
+            def do_POST(self):
+                payload = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+                messages = payload.get("messages", [])
+                images = sum(part.get("type") == "image_url" for m in messages
+                             if isinstance(m.get("content"), list) for part in m["content"])
+                is_vision = images > 0
+
+                if fake.error_rate and random.random() < fake.error_rate:
+                    fake._count("rate_limited")
+                    self._send(429, {"error": {"message": "Rate limit reached", "type": "rate_limit_exceeded"}},
+                               {"retry-after": "1"})
+                    return
+
+                base = fake.vision_latency if is_vision else fake.latency
+                time.sleep(max(base + random.uniform(-fake.jitter, fake.jitter), 0))
+                fake._count("vision" if is_vision else "chat")
+                if images > 1:
+                    content = json.dumps({"photos": [VISION_REPLY] * images})
+                else:
+                    content = json.dumps(VISION_REPLY) if is_vision else CHAT_REPLY
+                prompt_tokens = 1800 * images if is_vision else 120
+                self._send(200, {
+                    "id": f"chatcmpl-fake-{random.getrandbits(32):08x}",
+                    "object": "chat.completion",
+                    "created": int(time.time()),
+                    "model": payload.get("model", "fake"),
+                    "choices": [{"index": 0, "finish_reason": "stop",
+                                 "message": {"role": "assistant", "content": content}}],
+                    "usage": {"prompt_tokens": prompt_tokens, "completion_tokens": 40,
+                              "total_tokens": prompt_tokens + 40},
+                })
+
+        return Handler
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, name="fake-groq", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency-ms", type=float, default=400.0, help="chat completion latency")
+    parser.add_argument("--vision-latency-ms", type=float, default=None, help="defaults to 3x --latency-ms")
+    parser.add_argument("--jitter-ms", type=float, default=100.0)
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fraction of requests answered with 429")
+    args = parser.parse_args()
+
+    server = FakeGroqServer(args.port, args.latency_ms, args.jitter_ms, args.vision_latency_ms, args.error_rate)
+    print(f"Fake Groq API on {server.url} (set GROQ_BASE_URL={server.url})")
+    server._server.serve_forever()
+
+
+if __name__ == "__main__":
+    main()
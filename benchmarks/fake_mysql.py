@@ -0,0 +1,189 @@
+"""
+SQLite-backed stand-in for the app's PyMySQL connections, for offline benchmarks.
+
+Translates the MySQL dialect the app uses (%s placeholders,
+ON DUPLICATE KEY UPDATE / VALUES(col), NOW() - INTERVAL n SECOND) to SQLite,
+returns rows as dicts like pymysql's DictCursor, counts round trips
+(every execute/executemany/commit) and can sleep a simulated network RTT
+on each one.
+"""
+import re
+import sqlite3
+import threading
+import time
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS insurance_sessions (
+    session_id TEXT PRIMARY KEY,
+    policy_number TEXT, claimant_name TEXT, date_time_of_incident TEXT,
+    vehicle_info TEXT, incident_description TEXT,
+    photo_uploaded INTEGER DEFAULT 0, damage_report TEXT,
+    license_plate TEXT, damage_severity TEXT, damage_confidence REAL,
+    near_duplicate_of TEXT, near_duplicate_distance INTEGER,
+    created_at TEXT DEFAULT CURRENT_TIMESTAMP, updated_at TEXT DEFAULT CURRENT_TIMESTAMP,
+    is_complete INTEGER GENERATED ALWAYS AS (
+        COALESCE(policy_number, '') <> '' AND COALESCE(claimant_name, '') <> ''
+        AND COALESCE(date_time_of_incident, '') <> '' AND COALESCE(vehicle_info, '') <> ''
+        AND COALESCE(incident_description, '') <> ''
+    ) STORED
+);
+-- SQLite indexes hold the rowid, not the TEXT primary key, so session_id is listed explicitly
+CREATE INDEX IF NOT EXISTS idx_created_at ON insurance_sessions (created_at, session_id);
+CREATE INDEX IF NOT EXISTS idx_policy_created ON insurance_sessions (policy_number, created_at, session_id);
+CREATE INDEX IF NOT EXISTS idx_complete_created ON insurance_sessions (is_complete, created_at, session_id);
+CREATE TABLE IF NOT EXISTS vision_cache (
+    cache_key TEXT PRIMARY KEY, image_hash TEXT NOT NULL,
+    model TEXT NOT NULL, prompt_version TEXT NOT NULL, result TEXT NOT NULL,
+    created_at TEXT DEFAULT CURRENT_TIMESTAMP
+);
+CREATE TABLE IF NOT EXISTS vision_jobs (
+    job_id TEXT PRIMARY KEY, session_id TEXT NOT NULL, image_ref TEXT NOT NULL, image_hash TEXT,
+    status TEXT NOT NULL DEFAULT 'queued', attempts INTEGER NOT NULL DEFAULT 0,
+    result TEXT, error TEXT,
+    created_at TEXT DEFAULT CURRENT_TIMESTAMP, updated_at TEXT DEFAULT CURRENT_TIMESTAMP
+);
+CREATE TABLE IF NOT EXISTS claim_photos (
+    id INTEGER PRIMARY KEY AUTOINCREMENT, session_id TEXT NOT NULL, object_key TEXT NOT NULL,
+    original_filename TEXT, size_bytes INTEGER NOT NULL, created_at TEXT DEFAULT CURRENT_TIMESTAMP,
+    damage_report TEXT, license_plate TEXT, damage_severity TEXT, damage_confidence REAL, analyzed_at TEXT,
+    UNIQUE (session_id, object_key)
+);
+CREATE TABLE IF NOT EXISTS photo_fingerprints (
+    id INTEGER PRIMARY KEY AUTOINCREMENT, session_id TEXT NOT NULL, image_hash TEXT NOT NULL,
+    phash INTEGER NOT NULL, dhash INTEGER NOT NULL, created_at TEXT DEFAULT CURRENT_TIMESTAMP,
+    UNIQUE (session_id, image_hash)
+);
+CREATE TABLE IF NOT EXISTS policies (
+    policy_number TEXT PRIMARY KEY, active INTEGER NOT NULL DEFAULT 1,
+    created_at TEXT DEFAULT CURRENT_TIMESTAMP, updated_at TEXT DEFAULT CURRENT_TIMESTAMP
+);
+"""
+
+# Conflict target for ON DUPLICATE KEY UPDATE (the table's primary or unique key)
+PRIMARY_KEYS = {"insurance_sessions": "session_id", "vision_cache": "cache_key", "vision_jobs": "job_id",
+                "claim_photos": "session_id, object_key", "photo_fingerprints": "session_id, image_hash",
+                "policies": "policy_number"}
+
+_translated = {}
+
+
+def translate(sql):
+    """MySQL statement as used by the app -> equivalent SQLite statement (cached)."""
+    cached = _translated.get(sql)
+    if cached is not None:
+        return cached
+    out = sql.replace("%s", "?")
+    out = re.sub(r"NOW\(\) - INTERVAL \? SECOND", "datetime('now', '-' || ? || ' seconds')", out)
+    out = re.sub(r"VALUES\((\w+)\)", r"excluded.\1", out)
+    out = out.replace(" FOR UPDATE", "")  # SQLite locks the whole database on write
+    table = re.match(r"\s*INSERT INTO (\w+)", out)
+    if table and "ON DUPLICATE KEY UPDATE" in out:
+        out = out.replace("ON DUPLICATE KEY UPDATE",
+                          f"ON CONFLICT({PRIMARY_KEYS[table.group(1)]}) DO UPDATE SET")
+    _translated[sql] = out
+    return out
+
+
+class Stats:
+    def __init__(self):
+        self.round_trips = 0
+        self.connects = 0
+        self._lock = threading.Lock()
+
+    def add(self, name):
+        with self._lock:
+            setattr(self, name, getattr(self, name) + 1)
+
+
+class FakeCursor:
+    def __init__(self, conn):
+        self.conn = conn
+        self._cursor = conn._db.cursor()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+        return False
+
+    def close(self):
+        self._cursor.close()
+
+    @property
+    def rowcount(self):
+        return self._cursor.rowcount
+
+    def execute(self, sql, params=()):
+        self.conn._round_trip()
+        if sql.lstrip().upper().startswith("SET "):
+            return 0  # session variables (e.g. net_write_timeout) have no SQLite equivalent
+        self._cursor.execute(translate(sql), tuple(params or ()))
+        return self._cursor.rowcount
+
+    def executemany(self, sql, rows):
+        self.conn._round_trip()
+        self._cursor.executemany(translate(sql), [tuple(r) for r in rows])
+        return self._cursor.rowcount
+
+    def fetchone(self):
+        row = self._cursor.fetchone()
+        return dict(row) if row is not None else None
+
+    def fetchmany(self, size):
+        return [dict(row) for row in self._cursor.fetchmany(size)]
+
+    def fetchall(self):
+        return [dict(row) for row in self._cursor.fetchall()]
+
+
+class FakeConnection:
+    """One SQLite connection per pooled 'MySQL' connection (WAL, shared file)."""
+
+    def __init__(self, path, rtt, stats):
+        self.rtt = rtt
+        self.stats = stats
+        self._db = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self._db.row_factory = sqlite3.Row
+        self.open = True
+
+    def _round_trip(self):
+        self.stats.add("round_trips")
+        if self.rtt:
+            time.sleep(self.rtt)
+
+    def cursor(self, cursor=None):
+        # SQLite cursors already step through results lazily, like pymysql's SSCursor
+        return FakeCursor(self)
+
+    def commit(self):
+        self._round_trip()
+        self._db.commit()
+
+    def rollback(self):
+        self._round_trip()
+        self._db.rollback()
+
+    def ping(self, reconnect=False):
+        self._round_trip()
+
+    def close(self):
+        self.open = False
+        self._db.close()
+
+
+def make_connect(path, rtt=0.0, stats=None):
+    """
+    Returns (connect, stats). connect(max_retries=...) has the same shape as
+    db_helper.get_db_connection, so it can be handed to ConnectionPool.
+    """
+    stats = stats or Stats()
+    with sqlite3.connect(path) as db:
+        db.execute("PRAGMA journal_mode=WAL")
+        db.executescript(SCHEMA)
+
+    def connect(max_retries=3):
+        stats.add("connects")
+        return FakeConnection(path, rtt, stats)
+
+    return connect, stats
@@ -0,0 +1,10 @@
+-- Structured damage report columns (app/damage_report.py)
+-- Apply once to databases created before these columns were added to sql/schema.sql,
+-- then run the backfill: python -m app.damage_report --backfill
+
+ALTER TABLE insurance_sessions
+    ADD COLUMN license_plate VARCHAR(20) DEFAULT NULL AFTER damage_report,
+    ADD COLUMN damage_severity ENUM('Low', 'Medium', 'High') DEFAULT NULL AFTER license_plate,
+    ADD COLUMN damage_confidence DECIMAL(3, 2) DEFAULT NULL AFTER damage_severity,
+    ADD INDEX idx_license_plate (license_plate, created_at),
+    ADD INDEX idx_damage_severity_created (damage_severity, created_at);
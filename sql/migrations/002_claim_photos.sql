@@ -0,0 +1,15 @@
+-- Content-addressed photo storage index (app/storage.py)
+-- Apply once to databases created before claim_photos was added to sql/schema.sql.
+-- Photos uploaded before this change stay in app/data/uploads/ and are still served from /uploads.
+
+CREATE TABLE IF NOT EXISTS claim_photos (
+    id BIGINT AUTO_INCREMENT PRIMARY KEY,
+    session_id VARCHAR(255) NOT NULL,
+    object_key VARCHAR(80) NOT NULL,
+    original_filename VARCHAR(255) DEFAULT NULL,
+    size_bytes INT UNSIGNED NOT NULL,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    UNIQUE KEY uq_claim_photos_session_object (session_id, object_key),
+    INDEX idx_claim_photos_object (object_key),
+    INDEX idx_claim_photos_created (created_at)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci;
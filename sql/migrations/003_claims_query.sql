@@ -0,0 +1,13 @@
+-- Claims read API (app/claims_query.py)
+-- Apply once to databases created before is_complete and the keyset indexes were added to sql/schema.sql.
+-- idx_policy_created replaces idx_policy_number (its leading column serves the same lookups).
+
+ALTER TABLE insurance_sessions
+    ADD COLUMN is_complete BOOLEAN AS (
+        COALESCE(policy_number, '') <> '' AND COALESCE(claimant_name, '') <> ''
+        AND COALESCE(date_time_of_incident, '') <> '' AND COALESCE(vehicle_info, '') <> ''
+        AND COALESCE(incident_description, '') <> ''
+    ) STORED AFTER updated_at,
+    ADD INDEX idx_policy_created (policy_number, created_at),
+    ADD INDEX idx_complete_created (is_complete, created_at),
+    DROP INDEX idx_policy_number;
@@ -0,0 +1,16 @@
+-- Near-duplicate photo screening (app/photo_index.py)
+-- Apply once to databases created before photo_fingerprints was added to sql/schema.sql.
+
+ALTER TABLE insurance_sessions
+    ADD COLUMN near_duplicate_of VARCHAR(255) DEFAULT NULL AFTER damage_confidence,
+    ADD COLUMN near_duplicate_distance TINYINT UNSIGNED DEFAULT NULL AFTER near_duplicate_of;
+
+CREATE TABLE IF NOT EXISTS photo_fingerprints (
+    id BIGINT AUTO_INCREMENT PRIMARY KEY,
+    session_id VARCHAR(255) NOT NULL,
+    image_hash CHAR(64) NOT NULL,
+    phash BIGINT NOT NULL,
+    dhash BIGINT NOT NULL,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    UNIQUE KEY uq_photo_fingerprints_session_image (session_id, image_hash)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci;
@@ -0,0 +1,9 @@
+-- Multi-photo claims (app/claim_analysis.py)
+-- Apply once to databases created before claim_photos had per-photo analysis columns.
+
+ALTER TABLE claim_photos
+    ADD COLUMN damage_report TEXT DEFAULT NULL,
+    ADD COLUMN license_plate VARCHAR(20) DEFAULT NULL,
+    ADD COLUMN damage_severity ENUM('Low', 'Medium', 'High') DEFAULT NULL,
+    ADD COLUMN damage_confidence DECIMAL(3, 2) DEFAULT NULL,
+    ADD COLUMN analyzed_at TIMESTAMP NULL DEFAULT NULL;
@@ -0,0 +1,11 @@
+-- Policy-number validation index (app/policy_index.py)
+-- Apply once to databases created before policies was added to sql/schema.sql, then load the
+-- book of policies into it. While the table is empty, policy numbers are accepted unchecked.
+
+CREATE TABLE IF NOT EXISTS policies (
+    policy_number VARCHAR(50) PRIMARY KEY,
+    active BOOLEAN NOT NULL DEFAULT TRUE,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+    INDEX idx_policies_updated (updated_at)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci;
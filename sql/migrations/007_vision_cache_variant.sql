@@ -0,0 +1,8 @@
+-- Vision cache variants (app/vision_cache.py, app/image_processor.py)
+-- Apply once to databases created before the cache variant included the preprocessing settings.
+-- Lookups are by content hash only, so the URL key and its index are dropped.
+
+ALTER TABLE vision_cache
+    DROP INDEX idx_vision_cache_url,
+    DROP COLUMN url_hash,
+    MODIFY COLUMN prompt_version VARCHAR(64) NOT NULL;
@@ -11,8 +11,96 @@ CREATE TABLE IF NOT EXISTS insurance_sessions (
     incident_description TEXT DEFAULT NULL,
     photo_uploaded BOOLEAN DEFAULT FALSE,
     damage_report TEXT DEFAULT NULL,
+    license_plate VARCHAR(20) DEFAULT NULL,
+    damage_severity ENUM('Low', 'Medium', 'High') DEFAULT NULL,
+    damage_confidence DECIMAL(3, 2) DEFAULT NULL,
+    -- Closest session with a near-identical photo (app/photo_index.py), NULL when none
+    near_duplicate_of VARCHAR(255) DEFAULT NULL,
+    near_duplicate_distance TINYINT UNSIGNED DEFAULT NULL,
     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
     updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
-    INDEX idx_policy_number (policy_number),
-    INDEX idx_created_at (created_at)
-) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci;
\ No newline at end of file
+    -- Same rule as REQUIRED_FIELDS in app/routes.py (empty strings count as missing)
+    is_complete BOOLEAN AS (
+        COALESCE(policy_number, '') <> '' AND COALESCE(claimant_name, '') <> ''
+        AND COALESCE(date_time_of_incident, '') <> '' AND COALESCE(vehicle_info, '') <> ''
+        AND COALESCE(incident_description, '') <> ''
+    ) STORED,
+    -- Keyset pagination for /claims (app/claims_query.py): InnoDB appends the primary key
+    -- (session_id) to every secondary index, so each of these covers (filter, created_at, session_id)
+    INDEX idx_created_at (created_at),
+    INDEX idx_policy_created (policy_number, created_at),
+    INDEX idx_complete_created (is_complete, created_at),
+    INDEX idx_license_plate (license_plate, created_at),
+    INDEX idx_damage_severity_created (damage_severity, created_at)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci;
+
+-- Vision analysis cache (persistent tier of app/vision_cache.py)
+-- image_hash is the SHA-256 of the image bytes; prompt_version holds the cache variant
+-- (prompt version plus preprocessing settings, e.g. 'v2p:webp1536q80')
+CREATE TABLE IF NOT EXISTS vision_cache (
+    cache_key CHAR(64) PRIMARY KEY,
+    image_hash VARCHAR(80) NOT NULL,
+    model VARCHAR(100) NOT NULL,
+    prompt_version VARCHAR(64) NOT NULL,
+    result TEXT NOT NULL,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci;
+
+
+-- Background vision analysis jobs (app/job_queue.py)
+CREATE TABLE IF NOT EXISTS vision_jobs (
+    job_id CHAR(36) PRIMARY KEY,
+    session_id VARCHAR(255) NOT NULL,
+    image_ref VARCHAR(2048) NOT NULL,
+    image_hash CHAR(64) DEFAULT NULL,
+    status ENUM('queued', 'running', 'done', 'failed') NOT NULL DEFAULT 'queued',
+    attempts INT NOT NULL DEFAULT 0,
+    result TEXT DEFAULT NULL,
+    error TEXT DEFAULT NULL,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+    INDEX idx_vision_jobs_status (status, created_at),
+    INDEX idx_vision_jobs_session (session_id, created_at)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci;
+
+-- Which photos belong to which session (app/storage.py)
+-- object_key is '<sha256>.<ext>' in the content-addressed store; one object can back many sessions
+CREATE TABLE IF NOT EXISTS claim_photos (
+    id BIGINT AUTO_INCREMENT PRIMARY KEY,
+    session_id VARCHAR(255) NOT NULL,
+    object_key VARCHAR(80) NOT NULL,
+    original_filename VARCHAR(255) DEFAULT NULL,
+    size_bytes INT UNSIGNED NOT NULL,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    -- Per-photo vision result (app/claim_analysis.py); insurance_sessions holds the claim's aggregate
+    damage_report TEXT DEFAULT NULL,
+    license_plate VARCHAR(20) DEFAULT NULL,
+    damage_severity ENUM('Low', 'Medium', 'High') DEFAULT NULL,
+    damage_confidence DECIMAL(3, 2) DEFAULT NULL,
+    analyzed_at TIMESTAMP NULL DEFAULT NULL,
+    UNIQUE KEY uq_claim_photos_session_object (session_id, object_key),
+    INDEX idx_claim_photos_object (object_key),
+    INDEX idx_claim_photos_created (created_at)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci;
+
+-- Perceptual hashes of claim photos for near-duplicate screening (app/photo_index.py)
+-- phash/dhash are unsigned 64-bit values stored as two's-complement BIGINT (8 bytes each)
+CREATE TABLE IF NOT EXISTS photo_fingerprints (
+    id BIGINT AUTO_INCREMENT PRIMARY KEY,
+    session_id VARCHAR(255) NOT NULL,
+    image_hash CHAR(64) NOT NULL,
+    phash BIGINT NOT NULL,
+    dhash BIGINT NOT NULL,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    UNIQUE KEY uq_photo_fingerprints_session_image (session_id, image_hash)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci;
+
+-- Known policy numbers, held in memory to validate the policy number given in chat (app/policy_index.py)
+-- Deactivate rather than delete: the index picks up changes by updated_at
+CREATE TABLE IF NOT EXISTS policies (
+    policy_number VARCHAR(50) PRIMARY KEY,
+    active BOOLEAN NOT NULL DEFAULT TRUE,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+    INDEX idx_policies_updated (updated_at)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci;
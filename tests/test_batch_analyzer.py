@@ -0,0 +1,110 @@
+"""
+Bulk re-analysis (app/batch_analyzer.py): legacy upload filenames and the
+run-keyed checkpoint, with the vision call and DB writes stubbed out.
+"""
+import asyncio
+import os
+import tempfile
+
+import pytest
+
+from benchmarks.fake_mysql import make_connect
+from app import batch_analyzer
+from app.batch_analyzer import append_checkpoint, load_checkpoint, run_batch, session_id_from_filename
+from app.image_processor import VisionResult
+
+
+def test_session_id_from_filename_with_underscores():
+    known = {"abc", "projects_x_sessions_42"}
+    assert session_id_from_filename("abc_IMG_2034.jpg", known) == "abc"
+    assert session_id_from_filename("projects_x_sessions_42_front_left.jpg", known) == "projects_x_sessions_42"
+    assert session_id_from_filename("other_IMG_2034.jpg", known) is None
+    assert session_id_from_filename("nounderscore.jpg", known) is None
+
+
+def test_load_checkpoint_by_run():
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "checkpoint.jsonl")
+        append_checkpoint(path, [{"run": "a", "path": "p1", "session_id": "s1"},
+                                 {"run": "b", "path": "p2", "session_id": "s2"},
+                                 {"path": "p3", "session_id": "s3"}])  # written before runs had ids
+        assert load_checkpoint(path) == {"p1", "p2", "p3"}
+        assert load_checkpoint(path, "a") == {"p1"}
+        assert load_checkpoint(path, "c") == set()
+
+
+@pytest.fixture
+def stubbed(monkeypatch):
+    analysed, written = [], []
+
+    async def analyze(path):
+        analysed.append(path)
+        return VisionResult(f"report for {path}")
+
+    async def run_db(fn, *args, **kwargs):
+        if fn is batch_analyzer._sessions_with_reports:
+            return set(args[0])  # every session already has a report
+        written.append(list(args[0]))
+
+    monkeypatch.setattr(batch_analyzer, "analyze_car_damage_detailed", analyze)
+    monkeypatch.setattr(batch_analyzer, "run_db", run_db)
+    with tempfile.TemporaryDirectory() as tmp:
+        yield os.path.join(tmp, "checkpoint.jsonl"), analysed, written
+
+
+def test_force_ignores_other_runs_checkpoint(stubbed):
+    checkpoint, analysed, written = stubbed
+    images = [("p1", "s1"), ("p2", "s2")]
+    options = {"images": images, "checkpoint_path": checkpoint, "rpm": 0, "report_every": 60}
+
+    first = asyncio.run(run_batch(force=True, **options))
+    assert sorted(analysed) == ["p1", "p2"]
+    assert sum(len(rows) for rows in written) == 2
+
+    analysed.clear()
+    asyncio.run(run_batch(**options))
+    assert analysed == []  # checkpointed (and sessions have reports)
+
+    asyncio.run(run_batch(force=True, **options))
+    assert sorted(analysed) == ["p1", "p2"]  # a new forced run starts afresh
+
+    analysed.clear()
+    resumed = asyncio.run(run_batch(force=True, run_id=first["run_id"], **options))
+    assert analysed == []
+    assert resumed["skipped"] == 2
+
+
+def test_legacy_photos_of_a_session_are_written_together(stubbed):
+    checkpoint, analysed, written = stubbed
+    images = [("/u/s1_front.jpg", "s1"), ("/u/s2_a.jpg", "s2"), ("/u/s1_back.jpg", "s1")]
+    asyncio.run(run_batch(images=images, checkpoint_path=checkpoint, force=True, rpm=0, update_size=1,
+                          report_every=60))
+    by_session = {}
+    for rows in written:
+        for _, sid, path in rows:
+            by_session.setdefault(sid, []).append(len(rows))
+    assert by_session["s1"] == [2, 2]  # both photos in one save_claim_analysis batch, not last-one-wins
+
+
+def test_failed_reports_do_not_count_as_analysed():
+    connect, _ = make_connect(os.path.join(tempfile.mkdtemp(prefix="batch-"), "db.sqlite3"))
+    conn = connect()
+    with conn.cursor() as cursor:
+        cursor.executemany("INSERT INTO insurance_sessions (session_id, damage_report) VALUES (%s, %s)", [
+            ("ok", "Severity: Low"), ("outage", "Analysis failed (Status: 503): busy"),
+            ("bad", "Error: Image file not found."), ("empty", ""), ("none", None),
+        ])
+    conn.commit()
+    found = batch_analyzer._sessions_with_reports(conn, ["ok", "outage", "bad", "empty", "none"])
+    assert found == {"ok"}
+
+
+def test_reanalyze_rejects_malformed_body(monkeypatch):
+    monkeypatch.setenv("ADMIN_API_TOKEN", "secret")
+    from fastapi.testclient import TestClient
+    from app.main import app
+
+    client = TestClient(app)
+    for body in (b"not json", b"[1, 2]", b'{"rpm": "fast"}'):
+        response = client.post("/admin/reanalyze", content=body, headers={"X-Admin-Token": "secret"})
+        assert response.status_code == 400
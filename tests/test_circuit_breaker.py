@@ -0,0 +1,178 @@
+"""
+Circuit breaker state transitions (app/circuit_breaker.py) and what run_db
+(app/db_helper.py) reports to the DB breaker.
+"""
+import asyncio
+import time
+
+import pymysql
+import pytest
+
+from app import db_helper
+from app.circuit_breaker import CLOSED, HALF_OPEN, OPEN, CircuitBreaker, CircuitOpenError
+from app.db_helper import ConnectionPool, DatabaseUnavailableError, run_db
+
+
+def make_breaker(**kwargs):
+    options = {"window": 30, "min_calls": 4, "failure_rate": 0.5, "slow_rate": 0.75,
+               "open_seconds": 60, "half_open_calls": 2}
+    options.update(kwargs)
+    return CircuitBreaker("test", slow_call=1.0, **options)
+
+
+def trip(breaker):
+    while breaker.state == CLOSED:
+        assert breaker.allow()
+        breaker.record(0.0, failed=True)
+
+
+def expire_open(breaker):
+    breaker._opened_at -= breaker.open_seconds
+
+
+def test_opens_on_failure_rate():
+    breaker = make_breaker()
+    for failed in (False, True, False):
+        breaker.record(0.0, failed=failed)
+    assert breaker.state == CLOSED  # below min_calls
+    breaker.record(0.0, failed=True)
+    assert breaker.state == OPEN  # 2 of 4 failed
+
+
+def test_opens_on_slow_rate():
+    breaker = make_breaker()
+    for elapsed in (2.0, 2.0, 0.1):
+        breaker.record(elapsed)
+    assert breaker.state == CLOSED
+    breaker.record(0.0, timed_out=True)
+    assert breaker.state == OPEN  # 3 of 4 slow
+
+
+def test_old_calls_leave_the_window():
+    breaker = make_breaker(window=0.05)
+    for _ in range(3):
+        breaker.record(0.0, failed=True)
+    time.sleep(0.1)
+    breaker.record(0.0)
+    assert breaker.state == CLOSED
+    assert breaker.stats()["calls"] == 1
+
+
+def test_open_rejects_calls():
+    breaker = make_breaker()
+    trip(breaker)
+    assert not breaker.allow()
+    assert breaker.retry_after() > 0
+    with pytest.raises(CircuitOpenError) as error:
+        breaker.check()
+    assert error.value.status_code == 503
+    assert breaker.stats()["rejected"] == 2
+
+
+def test_half_open_limits_probes_and_closes():
+    breaker = make_breaker()
+    trip(breaker)
+    expire_open(breaker)
+    assert breaker.state == HALF_OPEN
+    assert breaker.allow() and breaker.allow()
+    assert not breaker.allow()  # half_open_calls probes already in flight
+    breaker.record(0.1)
+    assert breaker.state == HALF_OPEN
+    breaker.record(0.1)
+    assert breaker.state == CLOSED
+
+
+def test_failed_or_slow_probe_reopens():
+    for outcome in ({"failed": True}, {"timed_out": True}):
+        breaker = make_breaker()
+        trip(breaker)
+        expire_open(breaker)
+        assert breaker.allow()
+        breaker.record(0.0, **outcome)
+        assert breaker.state == OPEN
+        assert breaker.stats()["opened"] == 2
+
+
+def test_skip_frees_probe_slot():
+    breaker = make_breaker(half_open_calls=1)
+    trip(breaker)
+    expire_open(breaker)
+    assert breaker.allow()
+    assert not breaker.allow()
+    breaker.skip()  # the probe never reached the upstream
+    assert breaker.state == HALF_OPEN
+    assert breaker.allow()
+
+
+# --- run_db accounting ---
+
+class StubConnection:
+    open = True
+
+    def rollback(self):
+        pass
+
+    def ping(self, reconnect=False):
+        pass
+
+    def close(self):
+        self.open = False
+
+
+@pytest.fixture
+def stub_db(monkeypatch):
+    """run_db against a one-connection stub pool and a fresh DB breaker."""
+    state = {"reachable": True}
+
+    def connect(max_retries=1):
+        return StubConnection() if state["reachable"] else None
+
+    pool = ConnectionPool(connect=connect, min_size=0, max_size=1, timeout=0.05)
+    breaker = CircuitBreaker("db", slow_call=0.05, min_calls=2, failure_rate=0.5, slow_rate=0.5, open_seconds=60)
+    monkeypatch.setattr(db_helper, "db_pool", pool)
+    monkeypatch.setattr(db_helper, "db_breaker", breaker)
+    return pool, breaker, state
+
+
+def test_pool_exhaustion_is_not_a_db_failure(stub_db):
+    pool, breaker, _ = stub_db
+    held = pool.acquire()
+    for _ in range(3):
+        with pytest.raises(DatabaseUnavailableError):
+            asyncio.run(run_db(lambda conn: None, max_retries=1))
+    pool.release(held)
+    assert breaker.state == CLOSED
+    assert breaker.stats()["calls"] == 0
+
+
+def test_connect_and_connection_errors_are_failures(stub_db):
+    _, breaker, state = stub_db
+    state["reachable"] = False
+    with pytest.raises(DatabaseUnavailableError):
+        asyncio.run(run_db(lambda conn: None, max_retries=1))
+    state["reachable"] = True
+
+    def lost(conn):
+        raise pymysql.err.OperationalError(2013, "Lost connection")
+
+    with pytest.raises(pymysql.err.OperationalError):
+        asyncio.run(run_db(lost, max_retries=1))
+    assert breaker.state == OPEN
+    with pytest.raises(DatabaseUnavailableError, match="circuit open"):
+        asyncio.run(run_db(lambda conn: None))
+
+
+def test_long_running_calls_are_not_slow(stub_db):
+    _, breaker, _ = stub_db
+
+    def export(conn):
+        time.sleep(0.1)
+        return "done"
+
+    for _ in range(3):
+        assert asyncio.run(run_db(export, long_running=True)) == "done"
+    assert breaker.state == CLOSED
+    assert breaker.stats()["slow_rate"] == 0.0
+    for _ in range(3):
+        asyncio.run(run_db(export))
+    assert breaker.state == OPEN
@@ -0,0 +1,84 @@
+"""
+Streaming claim extracts (app/claims_export.py, GET /admin/export/claims)
+against the SQLite stand-in for MySQL (benchmarks/fake_mysql.py).
+"""
+import asyncio
+import csv
+import gzip
+import io
+import json
+import os
+import tempfile
+from datetime import datetime
+
+import pytest
+
+from benchmarks import fake_mysql
+from benchmarks.fake_mysql import make_connect
+from app import db_helper
+from app.claims_export import export_to_file
+
+CLAIMS = [("jan-1", "2025-01-05 10:00:00"), ("jan-2", "2025-01-20 09:30:00"), ("feb-1", "2025-02-02 08:00:00")]
+
+
+@pytest.fixture
+def fake_db():
+    connect, _ = make_connect(os.path.join(tempfile.mkdtemp(prefix="claims-export-"), "db.sqlite3"))
+    conn = connect()
+    with conn.cursor() as cursor:
+        cursor.executemany("INSERT INTO insurance_sessions (session_id, claimant_name, created_at) "
+                           "VALUES (%s, %s, %s)", [(sid, f"Name {sid}", created) for sid, created in CLAIMS])
+    conn.commit()
+    original = db_helper.db_pool._connect
+    db_helper.db_pool._connect = connect
+    db_helper.db_pool.close_all()
+    yield conn
+    db_helper.db_pool.close_all()
+    db_helper.db_pool._connect = original
+
+
+@pytest.fixture
+def client(monkeypatch, fake_db):
+    monkeypatch.setenv("ADMIN_API_TOKEN", "secret")
+    from fastapi.testclient import TestClient
+    from app.main import app
+    return TestClient(app)
+
+
+def test_ndjson_date_filter(client):
+    response = client.get("/admin/export/claims", params={"since": "2025-01-10", "until": "2025-02-01"},
+                          headers={"X-Admin-Token": "secret"})
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("application/x-ndjson")
+    assert 'filename="claims-20250110-20250201.ndjson"' in response.headers["content-disposition"]
+    rows = [json.loads(line) for line in response.text.splitlines()]
+    assert [row["session_id"] for row in rows] == ["jan-2"]
+    assert rows[0]["claimant_name"] == "Name jan-2"
+
+
+def test_gzipped_csv(client):
+    response = client.get("/admin/export/claims", params={"format": "csv", "gzip": "true",
+                                                          "fields": "session_id,claimant_name"},
+                          headers={"X-Admin-Token": "secret"})
+    assert response.status_code == 200
+    assert response.headers["content-type"] == "application/gzip"
+    rows = list(csv.reader(io.StringIO(gzip.decompress(response.content).decode("utf-8"))))
+    assert rows[0] == ["session_id", "created_at", "claimant_name"]  # sort keys always included
+    assert [row[0] for row in rows[1:]] == ["jan-1", "jan-2", "feb-1"]  # oldest first
+
+
+def test_cli_export_and_session_timeout_reset(fake_db, monkeypatch):
+    statements = []
+    execute = fake_mysql.FakeCursor.execute
+
+    def recording(self, sql, params=()):
+        statements.append(sql)
+        return execute(self, sql, params)
+
+    monkeypatch.setattr(fake_mysql.FakeCursor, "execute", recording)
+    out = io.BytesIO()
+    stats = asyncio.run(export_to_file(out, ("session_id",), None, datetime(2025, 2, 1), "csv", False, 1))
+    assert stats["rows"] == 2
+    assert out.getvalue().decode("utf-8").splitlines() == ["session_id", "jan-1", "jan-2"]
+    # The pooled connection doesn't keep the export's net_write_timeout
+    assert statements[-1] == "SET SESSION net_write_timeout = DEFAULT"
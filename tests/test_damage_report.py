@@ -0,0 +1,33 @@
+"""
+Parsing the vision model's reply (app/damage_report.py parse_damage_report).
+"""
+import json
+import logging
+
+from app.damage_report import format_damage_report, parse_damage_report
+
+
+def test_json_reply_is_validated_and_normalized():
+    report = parse_damage_report('Here you go: {"license_plate": "ab-12 cd", "severity": "HIGH", '
+                                 '"description": "Crushed bumper", "confidence": 1.7}')
+    assert (report.license_plate, report.severity, report.description, report.confidence) == \
+        ("AB12CD", "High", "Crushed bumper", 1.0)
+
+
+def test_invalid_json_field_is_dropped_and_logged(caplog):
+    reply = json.dumps({"license_plate": "XYZ 789", "severity": "Medium",
+                        "description": ["dent", "scratch"], "confidence": 0.8})
+    with caplog.at_level(logging.WARNING, logger="app.damage_report"):
+        report = parse_damage_report(reply)
+    # The valid fields are kept, not the raw JSON stored as a description with confidence 0
+    assert (report.license_plate, report.severity, report.description, report.confidence) == \
+        ("XYZ789", "Medium", "", 0.8)
+    assert "description (string_type)" in caplog.text
+    assert "XYZ" not in caplog.text
+
+
+def test_free_text_falls_back_to_patterns():
+    report = parse_damage_report("Severity: low\nLicense plate: KL-55 TT\nMinor scratch on the door.")
+    assert (report.license_plate, report.severity, report.confidence) == ("KL55TT", "Low", 0.0)
+    assert format_damage_report(report).startswith("Severity: Low. License plate: KL55TT.")
+    assert parse_damage_report("") is None
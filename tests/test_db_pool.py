@@ -0,0 +1,75 @@
+"""
+Connection pool checkout/release behaviour (app/db_helper.py), with stand-in
+connections instead of MySQL.
+"""
+from app.db_helper import ConnectionPool, db_connection
+
+
+class StubConnection:
+    def __init__(self):
+        self.open = True
+        self.rollbacks = 0
+        self.fail_rollback = False
+
+    def rollback(self):
+        if self.fail_rollback:
+            raise ConnectionError("gone")
+        self.rollbacks += 1
+
+    def ping(self, reconnect=False):
+        pass
+
+    def close(self):
+        self.open = False
+
+
+def make_pool(**kwargs):
+    opened = []
+
+    def connect(max_retries=1):
+        opened.append(StubConnection())
+        return opened[-1]
+
+    return ConnectionPool(connect=connect, min_size=0, max_size=2, **kwargs), opened
+
+
+def test_release_rolls_back_before_reuse():
+    pool, opened = make_pool()
+    conn = pool.acquire()
+    pool.release(conn)
+    assert conn.rollbacks == 1  # read snapshot ended before the next checkout
+    assert pool.acquire() is conn  # and the connection is reused
+
+
+def test_failed_rollback_discards_connection():
+    pool, opened = make_pool()
+    conn = pool.acquire()
+    conn.fail_rollback = True
+    pool.release(conn)
+    assert not conn.open
+    assert pool.stats()["idle"] == 0
+    assert pool.acquire() is not conn
+
+
+def test_expired_connection_is_recycled():
+    pool, opened = make_pool(max_age=0)
+    conn = pool.acquire()
+    pool.release(conn)
+    assert not conn.open
+    assert pool.stats()["recycled"] == 1
+
+
+def test_db_connection_discards_on_error():
+    pool, opened = make_pool()
+    import app.db_helper as db_helper
+    original, db_helper.db_pool = db_helper.db_pool, pool
+    try:
+        try:
+            with db_connection():
+                raise RuntimeError("query failed")
+        except RuntimeError:
+            pass
+        assert not opened[0].open
+        assert pool.stats()["in_use"] == 0
+    finally:
+        db_helper.db_pool = original
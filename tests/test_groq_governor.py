@@ -0,0 +1,60 @@
+"""
+Groq quota accounting (app/groq_governor.py) with a throwaway bucket file
+and a stand-in request instead of the Groq API.
+"""
+import asyncio
+import os
+import tempfile
+
+import groq
+import httpx
+
+from app.groq_governor import GroqGovernor, SharedBuckets
+
+MODEL = "test-model"
+
+
+class ServerError(Exception):
+    status_code = 503
+
+
+def levels(buckets):
+    rows = buckets._connect().execute("SELECT name, level FROM buckets").fetchall()
+    return {name.split(":")[1]: level for name, level in rows}
+
+
+def test_retries_charge_tokens_once():
+    buckets = SharedBuckets(os.path.join(tempfile.mkdtemp(prefix="groq-governor-"), "buckets.sqlite3"))
+    governor = GroqGovernor(buckets=buckets, max_retries=3, backoff_base=0.001)
+    attempts = []
+
+    async def request():
+        attempts.append(1)
+        if len(attempts) < 3:
+            raise ServerError("upstream busy")
+        return "ok"
+
+    assert asyncio.run(governor.call(MODEL, request, estimated_tokens=1000)) == "ok"
+    assert len(attempts) == 3
+    level = levels(buckets)
+    # Buckets refill while the test runs (0.5 requests/s, 100 tokens/s)
+    assert 27 <= level["requests"] < 27.5  # a request slot per attempt
+    assert 5000 <= level["tokens"] < 5100  # the estimate once, not per attempt
+    assert governor.stats()["retries"] == 2
+
+
+def test_timeouts_are_retried_and_count_as_failures():
+    buckets = SharedBuckets(os.path.join(tempfile.mkdtemp(prefix="groq-governor-"), "buckets.sqlite3"))
+    governor = GroqGovernor(buckets=buckets, max_retries=3, backoff_base=0.001)
+    attempts = []
+
+    async def request():
+        attempts.append(1)
+        if len(attempts) < 2:
+            raise groq.APITimeoutError(request=httpx.Request("POST", "https://api.groq.com/openai/v1/chat"))
+        return "ok"
+
+    assert asyncio.run(governor.call("timeout-model", request, estimated_tokens=10)) == "ok"
+    assert len(attempts) == 2
+    breaker = governor.breaker("timeout-model").stats()
+    assert (breaker["calls"], breaker["failure_rate"]) == (2, 0.5)
@@ -0,0 +1,83 @@
+"""
+Malformed image URLs (app/image_fetcher.py) become permanent fetch errors,
+so a vision job fails cleanly instead of crashing its worker; hosts are
+checked against the addresses the fetcher actually connects to.
+"""
+import asyncio
+import socket
+
+import pytest
+
+from app.image_fetcher import ImageFetcher, ImageFetchError, PublicAddressBackend, _check_url
+from app.image_processor import analyze_car_damage_detailed
+
+MALFORMED = ["http://example.com:99999/a.jpg", "http://[::1/a.jpg", "http://example.com:port/a.jpg",
+             "http://" + "a" * 70 + ".com/a.jpg"]
+
+
+@pytest.mark.parametrize("url", MALFORMED)
+def test_check_url_rejects_malformed(url):
+    with pytest.raises(ImageFetchError) as error:
+        asyncio.run(_check_url(url))
+    assert not error.value.retryable
+
+
+@pytest.mark.parametrize("url", ["ftp://example.com/a.jpg", "http:///a.jpg"])
+def test_check_url_rejects_non_http(url):
+    with pytest.raises(ImageFetchError):
+        asyncio.run(_check_url(url))
+
+
+@pytest.mark.parametrize("url", MALFORMED[:2])
+def test_analysis_of_malformed_url_is_permanent_error(url):
+    result = asyncio.run(analyze_car_damage_detailed(url))
+    assert result.text.startswith("Error:")
+    assert result.report is None
+
+
+# --- Connect-time address checks (DNS rebinding) ---
+
+class RecordingBackend:
+    def __init__(self):
+        self.connected = []
+
+    async def connect_tcp(self, host, port, **kwargs):
+        self.connected.append((host, port))
+        return "stream"
+
+
+def resolving_to(monkeypatch, *addresses):
+    async def getaddrinfo(self, host, port, **kwargs):
+        return [(socket.AF_INET, socket.SOCK_STREAM, 6, "", (address, port)) for address in addresses]
+    monkeypatch.setattr(asyncio.BaseEventLoop, "getaddrinfo", getaddrinfo)
+
+
+def test_backend_connects_to_the_checked_address(monkeypatch):
+    resolving_to(monkeypatch, "93.184.216.34")
+    backend = PublicAddressBackend(allow_private=False)
+    backend._backend = RecordingBackend()
+    assert asyncio.run(backend.connect_tcp("images.example.com", 443)) == "stream"
+    assert backend._backend.connected == [("93.184.216.34", 443)]  # not the host name, resolved again
+
+
+@pytest.mark.parametrize("address", ["169.254.169.254", "10.0.0.5", "127.0.0.1"])
+def test_backend_refuses_private_addresses(monkeypatch, address):
+    resolving_to(monkeypatch, "93.184.216.34", address)
+    backend = PublicAddressBackend(allow_private=False)
+    backend._backend = RecordingBackend()
+    with pytest.raises(ImageFetchError, match="non-public"):
+        asyncio.run(backend.connect_tcp("rebind.example.com", 80))
+    assert backend._backend.connected == []
+
+
+def test_fetch_of_private_host_fails_before_connecting():
+    fetcher = ImageFetcher()
+
+    async def fetch():
+        try:
+            await fetcher._download("http://127.0.0.1:9/a.jpg", "/nonexistent.img", "/nonexistent.json", None)
+        finally:
+            await fetcher.close()
+
+    with pytest.raises(ImageFetchError, match="non-public"):
+        asyncio.run(fetch())
@@ -0,0 +1,30 @@
+"""
+Vision payload preparation (app/image_processor.py preprocess_image).
+"""
+from io import BytesIO
+
+from PIL import Image
+
+from app.image_processor import is_failed_analysis, preprocess_image
+
+
+def encode(fmt, size=(64, 48)):
+    buffer = BytesIO()
+    Image.new("RGB", size, (200, 30, 30)).save(buffer, format=fmt)
+    return buffer.getvalue()
+
+
+def test_jpg_output_format_is_jpeg():
+    payload, mime_type, error = preprocess_image(encode("PNG"), max_dimension=32, output_format="jpg")
+    assert error is None
+    assert mime_type == "image/jpeg"
+    assert Image.open(BytesIO(payload)).format == "JPEG"
+
+
+def test_undecodable_images_are_permanent_errors():
+    jpeg = encode("JPEG", size=(400, 300))
+    for raw in (b"definitely not an image", jpeg[:len(jpeg) // 2]):
+        payload, mime_type, error = preprocess_image(raw, max_dimension=100)
+        assert payload is None
+        assert error.startswith("Error:")  # not retried by the job queue
+        assert is_failed_analysis(error)
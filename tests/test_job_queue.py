@@ -0,0 +1,137 @@
+"""
+Vision job queue (app/job_queue.py) against the SQLite stand-in for MySQL
+(benchmarks/fake_mysql.py), with the vision call stubbed out.
+"""
+import asyncio
+import os
+import tempfile
+
+import pytest
+
+from benchmarks.fake_mysql import make_connect
+from app import db_helper, job_queue
+from app.claim_analysis import ClaimAnalysis
+from app.deadline import Deadline
+from app.image_processor import VisionResult
+from app.job_queue import JobQueue
+
+
+@pytest.fixture
+def fake_db():
+    connect, _ = make_connect(os.path.join(tempfile.mkdtemp(prefix="job-queue-"), "db.sqlite3"))
+    original = db_helper.db_pool._connect
+    db_helper.db_pool._connect = connect
+    db_helper.db_pool.close_all()
+    yield connect()
+    db_helper.db_pool.close_all()
+    db_helper.db_pool._connect = original
+
+
+@pytest.fixture
+def vision(monkeypatch):
+    """Queue of outcomes for the stubbed analysis: report text, or an exception to raise."""
+    outcomes, calls = [], []
+
+    async def analyze(image_ref, image_hash=None):
+        calls.append(image_ref)
+        outcome = outcomes.pop(0) if outcomes else "Severity: Low"
+        if isinstance(outcome, Exception):
+            raise outcome
+        return ClaimAnalysis(VisionResult(outcome), [(image_ref, VisionResult(outcome))])
+
+    monkeypatch.setattr(job_queue, "analyze_claim_photos", analyze)
+    return outcomes, calls
+
+
+def run_jobs(queue, *refs):
+    """Submits a job per ref and waits for each; returns the waiters' outcomes."""
+    async def main():
+        await queue.start()
+        try:
+            job_ids = [await queue.submit("s1", ref) for ref in refs]
+            return [await queue.wait_for_result(job_id, Deadline(budget=5, reserve=0)) for job_id in job_ids]
+        finally:
+            await queue.stop()
+    return asyncio.run(main())
+
+
+def job_row(conn):
+    with conn.cursor() as cursor:
+        cursor.execute("SELECT status, attempts, result, error FROM vision_jobs")
+        return cursor.fetchone()
+
+
+def test_successful_job(fake_db, vision):
+    completed = []
+    queue = JobQueue(workers=2, backoff=0.01)
+    queue.add_completion_hook(lambda session_id, result: completed.append((session_id, result)))
+    assert run_jobs(queue, "photo.jpg") == [{"status": "done", "result": "Severity: Low", "error": None}]
+    assert completed == [("s1", "Severity: Low")]
+    assert job_row(fake_db) == {"status": "done", "attempts": 1, "result": "Severity: Low", "error": None}
+
+
+def test_transient_failure_and_crash_are_retried(fake_db, vision):
+    outcomes, calls = vision
+    outcomes.extend(["Analysis failed (Status: 503): busy", RuntimeError("boom")])
+    outcome, = run_jobs(JobQueue(workers=1, backoff=0.01), "photo.jpg")
+    assert outcome["status"] == "done"
+    assert len(calls) == 3
+    assert job_row(fake_db)["attempts"] == 3
+
+
+def test_gives_up_at_max_attempts(fake_db, vision):
+    outcomes, calls = vision
+    outcomes.extend([RuntimeError("boom")] * 3)
+    outcome, = run_jobs(JobQueue(workers=1, max_attempts=3, backoff=0.01), "photo.jpg")
+    assert outcome == {"status": "failed", "result": None, "error": "Analysis failed: RuntimeError"}
+    assert len(calls) == 3
+    assert job_row(fake_db)["status"] == "failed"  # not left 'running'
+
+
+def test_permanent_error_is_not_retried(fake_db, vision):
+    outcomes, calls = vision
+    outcomes.append("Error: Image file not found.")
+    outcome, = run_jobs(JobQueue(workers=1, backoff=0.01), "missing.jpg")
+    assert outcome["status"] == "failed"
+    assert len(calls) == 1
+
+
+def test_jobs_wait_while_breaker_is_open(fake_db, vision):
+    _, calls = vision
+    queue = JobQueue(workers=1, backoff=0.01)
+    paused = [True]
+    queue.paused_for = lambda: 0.05 if paused[0] else 0
+
+    async def main():
+        await queue.start()
+        try:
+            job_id = await queue.submit("s1", "photo.jpg")
+            await asyncio.sleep(0.2)
+            assert calls == []
+            assert (await queue.get_job(job_id))["attempts"] == 0  # no attempt used up
+            paused[0] = False
+            return await queue.wait_for_result(job_id, Deadline(budget=5, reserve=0))
+        finally:
+            await queue.stop()
+
+    assert asyncio.run(main())["status"] == "done"
+
+
+def test_sweep_requeues_stale_running_jobs(fake_db, vision):
+    _, calls = vision
+    queue = JobQueue(workers=1, backoff=0.01, sweep_interval=0.05)
+
+    async def main():
+        await queue.start()
+        try:
+            await asyncio.sleep(0.01)  # past the one-off startup recovery
+            with fake_db.cursor() as cursor:  # a worker died mid-run an hour ago
+                cursor.execute("INSERT INTO vision_jobs (job_id, session_id, image_ref, status, attempts, updated_at) "
+                               "VALUES ('j1', 's1', 'photo.jpg', 'running', 1, datetime('now', '-1 hour'))")
+            fake_db.commit()
+            return await queue.wait_for_result("j1", Deadline(budget=5, reserve=0))
+        finally:
+            await queue.stop()
+
+    assert asyncio.run(main())["status"] == "done"
+    assert calls == ["photo.jpg"]
@@ -0,0 +1,49 @@
+"""
+Log redaction and the non-blocking queue handler (app/logger.py).
+"""
+import logging
+import queue
+
+from app.logger import REDACTED, ContextQueueHandler, redact
+
+
+def test_policy_numbers_are_redacted_in_any_format():
+    for text in ("Policy number ABC-9O81 not found", "policy_number=car5500", "policy #77123",
+                 "Checked POL-1234 and CAR-5500", "Claim for POL_AG_1234 opened", "pol-ag-1234 typed"):
+        assert "9O81" not in redact(text) and "5500" not in redact(text) and "1234" not in redact(text)
+        assert REDACTED in redact(text)
+    assert redact("Policy index built from file") == "Policy index built from file"
+    assert redact({"policy_number": "XY 12"}) == {"policy_number": REDACTED}
+
+
+def test_queued_record_has_its_message_rendered():
+    handler = ContextQueueHandler(queue.Queue())
+    fields = {"claimant_name": "before"}
+    record = logging.LogRecord("app.test", logging.INFO, __file__, 1, "Fields: %s", (fields,), None)
+    handler.enqueue(handler.prepare(record))
+    fields["claimant_name"] = "after"  # the caller keeps using the object after logging it
+    queued = handler.queue.get_nowait()
+    assert (queued.getMessage(), queued.args) == ("Fields: {'claimant_name': 'before'}", None)
+
+
+class ListHandler(logging.Handler):
+    def __init__(self):
+        super().__init__()
+        self.records = []
+
+    def emit(self, record):
+        self.records.append(record)
+
+
+def test_claim_summary_log_leaves_out_the_report_text():
+    from app.routes import send_claim_summary
+
+    handler = ListHandler()
+    logging.getLogger("app.routes").addHandler(handler)  # 'app' doesn't propagate to pytest's handlers
+    try:
+        send_claim_summary("s1", "Severity: High. License plate: KL55TT. Rear bumper crushed.")
+    finally:
+        logging.getLogger("app.routes").removeHandler(handler)
+    record, = [r for r in handler.records if r.getMessage() == "Email report generated"]
+    assert record.severity == "High"
+    assert not any("KL55TT" in str(value) for value in vars(record).values())
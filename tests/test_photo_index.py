@@ -0,0 +1,94 @@
+"""
+Near-duplicate index (app/photo_index.py): multi-index search against a
+brute-force scan, and incremental refresh from photo_fingerprints (SQLite
+stand-in for MySQL).
+"""
+import asyncio
+import os
+import random
+import tempfile
+
+import pytest
+
+from benchmarks.fake_mysql import make_connect
+from app import db_helper
+from app.photo_index import MultiIndexHashTable, PhotoIndex, hamming, to_signed
+
+
+def flip_bits(value, count, rng):
+    for bit in rng.sample(range(64), count):
+        value ^= 1 << bit
+    return value
+
+
+def test_empty_table_allocates_nothing():
+    table = MultiIndexHashTable()
+    assert table.search(123, 456) == []
+    assert table._heads is None
+
+
+@pytest.mark.parametrize("chunks", [3, 4])
+def test_search_matches_brute_force(chunks):
+    rng = random.Random(chunks)
+    table = MultiIndexHashTable(chunks=chunks)
+    stored = [(rng.getrandbits(64), rng.getrandbits(64)) for _ in range(2000)]
+    for row_id, (phash, dhash) in enumerate(stored, 1):
+        table.add(row_id, phash, dhash)
+
+    for target in rng.sample(range(len(stored)), 50):
+        phash = flip_bits(stored[target][0], rng.randint(0, 8), rng)
+        dhash = flip_bits(stored[target][1], rng.randint(0, 4), rng)
+        expected = sorted((row_id, hamming(phash, p), hamming(dhash, d)) for row_id, (p, d) in enumerate(stored, 1)
+                          if hamming(phash, p) <= 8 and hamming(dhash, d) <= 14)
+        found = table.search(phash, dhash, max_distance=8, max_dhash_distance=14)
+        assert sorted(found) == expected
+        assert target + 1 in [row_id for row_id, _, _ in found]
+        assert [m[1] for m in found] == sorted(m[1] for m in found)  # closest first
+
+
+def test_dhash_confirmation_filters_matches():
+    table = MultiIndexHashTable()
+    table.add(1, 0xABCDEF, 0)
+    assert table.search(0xABCDEF, (1 << 20) - 1, max_dhash_distance=14) == []
+    assert table.search(0xABCDEF, 0b111, max_dhash_distance=14) == [(1, 0, 3)]
+
+
+@pytest.fixture
+def fake_db():
+    connect, _ = make_connect(os.path.join(tempfile.mkdtemp(prefix="photo-index-"), "db.sqlite3"))
+    original = db_helper.db_pool._connect
+    db_helper.db_pool._connect = connect
+    db_helper.db_pool.close_all()
+    yield connect()
+    db_helper.db_pool.close_all()
+    db_helper.db_pool._connect = original
+
+
+def row_hash(row_id):
+    return random.Random(row_id).getrandbits(64)  # unrelated photos: ~32 bits apart
+
+
+def insert(conn, row_id):
+    phash = row_hash(row_id)
+    with conn.cursor() as cursor:
+        cursor.execute("INSERT INTO photo_fingerprints (id, session_id, image_hash, phash, dhash) "
+                       "VALUES (%s, %s, %s, %s, %s)", (row_id, f"s{row_id}", f"h{row_id}", to_signed(phash), 0))
+    conn.commit()
+
+
+def test_refresh_picks_up_rows_committed_out_of_order(fake_db):
+    index = PhotoIndex(overlap=16)
+    for row_id in (1, 2, 3, 5):  # 4 is allocated but not yet committed
+        insert(fake_db, row_id)
+    asyncio.run(index.refresh())
+    assert len(index._table) == 4
+
+    insert(fake_db, 4)
+    insert(fake_db, 6)
+    asyncio.run(index.refresh())
+    assert len(index._table) == 6  # 4 picked up, 1-3 and 5 not indexed twice
+    assert index.stats()["late_rows"] == 1
+    assert [m[0] for m in index._table.search(row_hash(4), 0)] == [4]
+
+    asyncio.run(index.refresh())
+    assert len(index._table) == 6
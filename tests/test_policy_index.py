@@ -0,0 +1,49 @@
+"""
+Policy-number validation (app/policy_index.py): exact matches, one-edit
+corrections and suggestions, over an in-memory snapshot.
+"""
+from app.policy_index import PolicyIndex, PolicySnapshot, normalize_policy
+
+POLICIES = ["POL-1234", "POL-1284", "ABC-9O81", "CAR-5500"]
+
+
+def make_snapshot(policies=POLICIES):
+    return PolicySnapshot({normalize_policy(p): p for p in policies})
+
+
+def test_valid_ignores_case_and_separators():
+    result = make_snapshot().check("pol 1234")
+    assert result.status == "valid"
+    assert result.policy_number == "POL-1234"
+
+
+def test_single_confusable_slip_is_corrected():
+    snapshot = make_snapshot()
+    assert snapshot.check("POL-I234").policy_number == "POL-1234"  # I for 1
+    result = snapshot.check("ABC-9081")  # 0 for O
+    assert result.status == "corrected"
+    assert result.policy_number == "ABC-9O81"
+
+
+def test_other_slips_are_suggested():
+    snapshot = make_snapshot()
+    for typed, expected in (("POL-1243", ("POL-1234",)),  # transposition
+                            ("POL-123", ("POL-1234",)),  # deletion
+                            ("POL-12X4", ("POL-1234", "POL-1284"))):  # two candidates
+        result = snapshot.check(typed)
+        assert result.status == "suggest"
+        assert result.policy_number is None
+        assert result.suggestions == expected
+
+
+def test_far_or_empty_values_are_invalid():
+    snapshot = make_snapshot()
+    assert snapshot.check("XYZ-0000").status == "invalid"
+    assert snapshot.check("POL-9999").status == "invalid"  # two edits away
+    assert snapshot.check(" - ").status == "invalid"
+
+
+def test_unloaded_index_answers_unknown():
+    index = PolicyIndex(source="off")
+    assert index.check("POL-1234").status == "unknown"
+    assert index.stats()["unknown"] == 1
@@ -0,0 +1,53 @@
+"""
+Per-turn session upsert (app/session_store.py) against the SQLite stand-in
+for MySQL (benchmarks/fake_mysql.py).
+"""
+import os
+import tempfile
+
+import pytest
+
+from benchmarks.fake_mysql import make_connect
+from app.session_store import upsert_session
+
+
+@pytest.fixture
+def conn():
+    connect, stats = make_connect(os.path.join(tempfile.mkdtemp(prefix="session-store-"), "db.sqlite3"))
+    conn = connect()
+    conn.stats = stats
+    yield conn
+    conn.close()
+
+
+def test_round_trips_and_no_open_transaction(conn):
+    before = conn.stats.round_trips
+    row = upsert_session(conn, "s1", {})
+    assert row["session_id"] == "s1" and row["claimant_name"] is None
+    row = upsert_session(conn, "s1", {"claimant_name": "John Doe", "vehicle_info": None})
+    assert row["claimant_name"] == "John Doe"
+    assert conn.stats.round_trips - before == 6  # SELECT, upsert, COMMIT per turn
+
+    before = conn.stats.round_trips
+    row = upsert_session(conn, "s1", {"claimant_name": "John Doe"})  # repeated answer
+    assert row["claimant_name"] == "John Doe"
+    assert conn.stats.round_trips - before == 2  # SELECT, ROLLBACK
+    assert not conn._db.in_transaction
+
+
+def test_writes_are_committed_and_keep_other_columns(conn):
+    upsert_session(conn, "s1", {"policy_number": "POL-1"})
+    with conn.cursor() as cursor:
+        cursor.execute("UPDATE insurance_sessions SET damage_report = %s WHERE session_id = %s", ("dent", "s1"))
+    conn.commit()  # e.g. a vision job finishing between two turns
+    row = upsert_session(conn, "s1", {"vehicle_info": "2019 Honda Civic"})
+    assert (row["policy_number"], row["damage_report"], row["vehicle_info"]) == ("POL-1", "dent", "2019 Honda Civic")
+
+    with conn.cursor() as cursor:
+        cursor.execute("SELECT vehicle_info FROM insurance_sessions WHERE session_id = %s", ("s1",))
+        assert cursor.fetchone()["vehicle_info"] == "2019 Honda Civic"
+
+
+def test_unknown_column_is_rejected(conn):
+    with pytest.raises(ValueError):
+        upsert_session(conn, "s1", {"is_complete": True})
@@ -0,0 +1,41 @@
+"""
+Rejected uploads (app/routes.py process_upload) answer with the status the
+upload helper chose, not a 500. Rejections happen before any DB work and
+before any photo of the upload is stored.
+"""
+import os
+
+os.environ.setdefault("STORAGE_BACKEND", "memory")
+
+from fastapi.testclient import TestClient
+from app.main import app
+from app.storage import storage
+from app.upload_helper import MAX_UPLOAD_BYTES
+
+client = TestClient(app)  # no startup: rejected uploads never reach the DB or the job queue
+
+
+def test_unsupported_type_is_415():
+    response = client.post("/upload-image/test-session",
+                           files={"files": ("notes.txt", b"not an image at all", "text/plain")})
+    assert response.status_code == 415
+    assert response.json()["error"].startswith("notes.txt: Unsupported file type")
+
+
+def test_oversized_photo_is_413():
+    too_big = b"\xff\xd8\xff\xe0" + b"\0" * MAX_UPLOAD_BYTES
+    response = client.post("/upload-image/test-session", files={"files": ("big.jpg", too_big, "image/jpeg")})
+    assert response.status_code == 413
+    assert "too large" in response.json()["error"]
+
+
+def test_rejected_photo_stores_nothing_of_the_upload():
+    staging = os.path.dirname(storage.staging_path())
+    before = set(os.listdir(staging))
+    response = client.post("/upload-image/test-session", files=[
+        ("files", ("front.jpg", b"\xff\xd8\xff\xe0" + b"front" * 100, "image/jpeg")),
+        ("files", ("notes.txt", b"not an image at all", "text/plain")),
+    ])
+    assert response.status_code == 415
+    assert storage.stats()["objects_written"] == 0 and storage.stats()["deduplicated"] == 0
+    assert set(os.listdir(staging)) == before  # front.jpg's staging file is gone too
@@ -0,0 +1,44 @@
+"""
+Vision result cache (app/vision_cache.py) with its persistent tier on the
+SQLite stand-in for MySQL (benchmarks/fake_mysql.py).
+"""
+import asyncio
+import os
+import tempfile
+
+import pytest
+
+from benchmarks.fake_mysql import make_connect
+from app import db_helper
+from app.image_processor import PACKED_CACHE_VARIANT
+from app.vision_cache import VisionCache, hash_bytes
+
+
+@pytest.fixture
+def fake_db():
+    connect, _ = make_connect(os.path.join(tempfile.mkdtemp(prefix="vision-cache-"), "db.sqlite3"))
+    original = db_helper.db_pool._connect
+    db_helper.db_pool._connect = connect
+    db_helper.db_pool.close_all()
+    yield connect()
+    db_helper.db_pool.close_all()
+    db_helper.db_pool._connect = original
+
+
+def test_persistent_tier_is_keyed_by_content_and_variant(fake_db):
+    image_hash = hash_bytes(b"photo")
+
+    async def main():
+        await VisionCache().set('{"severity": "Low"}', "model", PACKED_CACHE_VARIANT, image_hash=image_hash)
+        cache = VisionCache()  # a fresh process: empty memory tier
+        hit = await cache.get("model", PACKED_CACHE_VARIANT, image_hash=image_hash)
+        other_variant = await cache.get("model", "v2:jpeg1024q85", image_hash=image_hash)
+        return hit, other_variant, cache.stats()
+
+    hit, other_variant, stats = asyncio.run(main())
+    assert hit == '{"severity": "Low"}'
+    assert other_variant is None
+    assert (stats["persistent_hits"], stats["misses"]) == (1, 1)
+    with fake_db.cursor() as cursor:
+        cursor.execute("SELECT prompt_version FROM vision_cache")
+        assert len(cursor.fetchone()["prompt_version"]) <= 64  # sql/schema.sql column width